@@ -1,236 +1,229 @@
 import decision_tree as dt
 import math
 import numpy as np
-import copy
+from dataset import Dataset, SparseMatrix
+from metrics import METRICS
+from model import BoostModel
 
 
-# Maximum is 10, equal to the number of features
+# default number of boosting rounds, features can be used by more than one round
 NUMBER_OF_STUMPS = 10
 
 
-def get_feature_list_decreasing_gain(temp_data_list):
+def make_stumps(data_list, rounds=NUMBER_OF_STUMPS):
     """
-    returns a list of features, the list is ordered such that the feature names
-    are listed in decreasing order of information gains
+    main function which is called to make adaboost stumps
+    every stump has a feature, the conclusion if the feature value is True, the conclusion if it is False
+    and its amount_of_say, a feature can be the root of more than one stump
 
-    :param temp_data_list: input data
+    :param data_list: the input data to be listed, a Dataset or a list of feature dictionaries, it is not changed
+    :param rounds: number of stumps to make
 
-    :return: list of features
+    :return: BoostModel made from the stumps
     """
 
-    feature_list = []
-    if temp_data_list:
-        for i in range(len(temp_data_list[0].keys())):
-            max_gain = 0
-            max_gain_feat = None
-            for key in temp_data_list[0]:
-                if key == "res" or key == "sent" or key == "weight" or key == "sent":
-                    continue
-                feat_pos, feat_neg = dt.split_by_feat(temp_data_list, key)
-                a_prob = dt.calculate_a_b_probability(temp_data_list)
-                gain = dt.calculate_gain(a_prob, feat_pos, feat_neg)
-                if gain > max_gain or max_gain_feat is None:
-                    max_gain = gain
-                    max_gain_feat = key
-            if max_gain_feat is not None:
-                feature_list.append(max_gain_feat)
-                dt.remove_feat(temp_data_list, max_gain_feat)
-
-    return feature_list
-
-
-def make_stumps(data_list):
-    """
-    main function which is called to make adaboost stumps
-    returns a dictionary with feature_name as keys and value is a dictionary with
-    'amount_of_say', conclusion if feature value is True and conclusion if feature is False
-    as parameters
+    if not isinstance(data_list, Dataset):
+        data_list = Dataset.from_rows(data_list)
+    stumps = []
+    if not len(data_list):
+        return BoostModel.from_stumps(stumps, data_list.spec)
+    weights = np.full(len(data_list), 1 / len(data_list))
+    add_stumps(stumps, data_list.packed(), data_list.labels, weights, rounds)
+    return BoostModel.from_stumps(stumps, data_list.spec)
 
-    :param data_list: the input data to be listed
 
-    :return: the dictionary made in the function
+def add_stumps(stumps, matrix, labels, weights, rounds):
     """
-
-    new_data_list = copy.deepcopy(data_list)
-    feat_list = get_feature_list_decreasing_gain(new_data_list)
-    add_weights(data_list)
-    feat_dict = {}
-    count_stumps = 0
-    if data_list:
-        for key in feat_list:
-            count_stumps += 1
-            if count_stumps == NUMBER_OF_STUMPS:
-                break
-            if key == "res" or key == "sent" or key == "weight":
-                continue
-            new_data, amount_of_say = make_stump(data_list, key, feat_dict)
-            change_weights(data_list, new_data, amount_of_say)
-    return feat_dict
-
-
-def change_weights(data_list, new_data, amount_of_say):
+    the boosting rounds of make_stumps, every round adds the stump with the lowest weighted error
+    and changes the weights, it stops early when no stump is better than chance or one makes no mistakes
+
+    :param stumps: list of (feature index, conclusion if True, conclusion if False, amount_of_say), the new stumps
+                   are appended
+    :param matrix: uint8 array of 0 and 1 with shape (rows, features), or a SparseMatrix
+    :param labels: boolean array, True for is_nl
+    :param weights: weight of every row, summing to 1, changed in place
+    :param rounds: number of stumps to add
+    :return: None
     """
-    change the weights of the incorrectly classified and the correctly classified weights
-    for the next tree
+    for _ in range(rounds):
+        with METRICS.timer("stump_search"):
+            feat_index, pos_conclusion, neg_conclusion, error = find_best_stump(matrix, labels, weights)
+        METRICS.count("rounds")
+        METRICS.count("stumps_evaluated", matrix.shape[1])
+        if error >= 0.5:
+            break
+        amount_of_say = find_amount_of_say(error)
+        stumps.append((feat_index, pos_conclusion, neg_conclusion, amount_of_say))
+        if error <= 0:
+            break
+        with METRICS.timer("reweight"):
+            change_weights(weights, matrix[:, feat_index], labels, pos_conclusion, neg_conclusion, amount_of_say)
+
+
+def replay_weights(model, matrix, labels):
+    """
+    rebuilds the weights make_stumps would have after the rounds of a model without running them,
+    every round multiplies the weight of a row by exp(-y * amount_of_say * h) with y and h 1 for is_nl and -1
+    for is_en, so the weight of a row is proportional to exp(-y * margin)
+
+    :param model: BoostModel
+    :param matrix: uint8 array of 0 and 1 with shape (rows, features), or a SparseMatrix
+    :param labels: boolean array, True for is_nl
+    :return: weight of every row, summing to 1
+    """
+    exponents = np.where(labels, -1.0, 1.0) * model.margins(matrix)
+    weights = np.exp(exponents - exponents.max(initial=0))
+    return weights / np.sum(weights)
 
-    :param data_list: input data
-    :param new_data: data with information about correctness of the weight
-    :param amount_of_say: amount_of_say of current stump
 
-    :return: None
+def refit_stumps(stumps, matrix, labels):
     """
-
-    total_weight = 0
-    for i in range(len(new_data)):
-        new_row = new_data[i]
-        row = data_list[i]
-        if new_row["incorrect"]:
-            row["weight"] = row["weight"] * math.pow(math.e, amount_of_say)
-            total_weight += row["weight"]
-        else:
-            row["weight"] = row["weight"] * math.pow(math.e, -amount_of_say)
-            total_weight += row["weight"]
-    factor = 1 / total_weight
-    for row in data_list:
-        row["weight"] = row["weight"] * factor
-
-
-def make_stump(data_list, feat_name, feat_dict):
+    works out the amount_of_say of the stumps of a model again on other data, in the order they were made,
+    a stump which is no better than chance on the data is left out
+
+    :param stumps: list of (feature index, conclusion if True, conclusion if False, amount_of_say)
+    :param matrix: uint8 array of 0 and 1 with shape (rows, features), or a SparseMatrix
+    :param labels: boolean array, True for is_nl
+    :return:    list of the stumps with their new amount_of_say
+                weight of every row after the stumps, summing to 1
     """
-    calculates probability, adds correctness information to data, finds amount of say
-
-    :param data_list: input data
-    :param feat_name: feature to be used as a root
-    :param feat_dict: representation of previously added stumps
-    :return: new_data contains data modified with calculated stump data
-             amount_of_say of the current stump
+    weights = np.full(len(labels), 1 / len(labels))
+    refitted = []
+    for feat_index, pos_conclusion, neg_conclusion, _ in stumps:
+        feat_values = matrix[:, feat_index]
+        incorrect = labels != np.where(feat_values, pos_conclusion, neg_conclusion)
+        error = np.sum(weights[incorrect])
+        if error >= 0.5:
+            continue
+        amount_of_say = find_amount_of_say(error)
+        refitted.append((feat_index, pos_conclusion, neg_conclusion, amount_of_say))
+        if error <= 0:
+            break
+        change_weights(weights, feat_values, labels, pos_conclusion, neg_conclusion, amount_of_say)
+    return refitted, weights
+
+
+def continue_stumps(model, data_list, rounds=NUMBER_OF_STUMPS, refit=False):
     """
+    warm start of adaboost from a trained model, the weights of the rows are rebuilt from the margins
+    of the model in one pass and the boosting goes on from there, so the cost is one pass plus the new rounds
+    instead of all the rounds, given only the new lines the rounds focus on the ones the model gets wrong
 
-    new_data = get_new_stump_data(data_list, feat_name)
-    feat_pos, feat_neg = dt.split_by_feat(new_data, feat_name)
-    is_nl_prob_feat_pos = dt.calculate_a_b_probability(feat_pos)
-    is_nl_prob_feat_neg = dt.calculate_a_b_probability(feat_neg)
-    amount_of_say = find_amount_of_say(new_data, feat_name, is_nl_prob_feat_pos, is_nl_prob_feat_neg)
-    add_child(feat_dict, feat_name, "amount_of_say", amount_of_say)
-    if is_nl_prob_feat_pos >= 0.5:
-        add_child(feat_dict, feat_name, "True", "is_nl")
-    else:
-        add_child(feat_dict, feat_name, "True", "is_en")
+    :param model: BoostModel, trained on the features of the spec of data_list
+    :param data_list: Dataset to go on with, the data of the model, new data or both
+    :param rounds: number of stumps to add, 0 to only refit
+    :param refit: True to work out the amount_of_say of the stumps of the model again on data_list first
 
-    if is_nl_prob_feat_neg >= 0.5:
-        add_child(feat_dict, feat_name, "False", "is_nl")
+    :return: BoostModel with the stumps of the model followed by the new ones
+    """
+    if not isinstance(data_list, Dataset):
+        data_list = Dataset.from_rows(data_list)
+    if model.spec != data_list.spec:
+        raise ValueError("the model was trained on other features than the data has")
+    stumps = model.stumps()
+    if not len(data_list):
+        return BoostModel.from_stumps(stumps, data_list.spec)
+    matrix = data_list.packed()
+    labels = data_list.labels
+    if refit:
+        stumps, weights = refit_stumps(stumps, matrix, labels)
     else:
-        add_child(feat_dict, feat_name, "False", "is_en")
+        weights = replay_weights(model, matrix, labels)
+    add_stumps(stumps, matrix, labels, weights, rounds)
+    return BoostModel.from_stumps(stumps, data_list.spec)
 
-    return new_data, amount_of_say
 
-
-def find_amount_of_say(new_data, feat_name, is_nl_prob_pos, is_nl_prob_neg):
+def find_best_stump(matrix, labels, weights):
     """
-    calculates amount of say of current stump
+    finds the stump with the lowest weighted error, the weighted is_nl and is_en sums of every
+    feature come from one matrix product and every branch concludes the label with more weight
 
-    :param new_data: input data with calculated stump information
-    :param feat_name: feature used to split
-    :param is_nl_prob_pos: probability of is_nl if feat value is True
-    :param is_nl_prob_neg: probability of is_nl if feat value is False
+    :param matrix: uint8 array of 0 and 1 with shape (rows, features)
+    :param labels: boolean array, True for is_nl
+    :param weights: weight of every row
 
-    :return: amount of say of current stump
+    :return:    index of the feature
+                conclusion if the feature is True, True for is_nl
+                conclusion if the feature is False, True for is_nl
+                weighted error of the stump
     """
 
-    error = find_error(new_data, feat_name, is_nl_prob_pos, is_nl_prob_neg)
-    factor = (1 - error) / (error + np.finfo(float).eps)
-    return 0.5 * math.log(factor, math.e)
+    pos_weights = dt.label_counts(matrix, labels, weights)
+    a_weight = np.dot(weights, labels)
+    return best_stump_of_weights(pos_weights, (a_weight, np.sum(weights) - a_weight))
 
 
-def find_error(data, feat_name, is_nl_prob_pos, is_nl_prob_neg):
+def best_stump_of_weights(pos_weights, total_weights):
     """
-    finds error in current stump
+    finds the stump with the lowest weighted error from the weighted label sums of the rows
 
-    :param data: input data
-    :param feat_name: feature which is root of stump
-    :param is_nl_prob_pos: probability of is_nl if feat value is True
-    :param is_nl_prob_neg: probability of is_nl if feat value is False
+    :param pos_weights: array of shape (features, 2) with the is_nl and is_en weight of the rows where a feature is True
+    :param total_weights: is_nl and is_en weight of all the rows
 
-    :return: error in the current stump
+    :return:    index of the feature
+                conclusion if the feature is True, True for is_nl
+                conclusion if the feature is False, True for is_nl
+                weighted error of the stump
     """
-    error = 0.0
-    pos_conclusion = False
-    neg_conclusion = False
-    if is_nl_prob_pos >= 0.5:
-        pos_conclusion = True
-    if is_nl_prob_neg >= 0.5:
-        neg_conclusion = True
-    for row in data:
-        if row[feat_name] and row["res"] != pos_conclusion:
-            error += row["weight"]
-            row["incorrect"] = True
-        elif not row[feat_name] and row["res"] != neg_conclusion:
-            error += row["weight"]
-            row["incorrect"] = True
-        else:
-            row["incorrect"] = False
-
-    return error
-
-
-def add_weights(data_list):
+    neg_weights = np.array(total_weights) - pos_weights
+    pos_conclusions = pos_weights[:, 0] >= pos_weights[:, 1]
+    neg_conclusions = neg_weights[:, 0] >= neg_weights[:, 1]
+    errors = np.where(pos_conclusions, pos_weights[:, 1], pos_weights[:, 0]) + \
+        np.where(neg_conclusions, neg_weights[:, 1], neg_weights[:, 0])
+    feat_index = int(np.argmin(errors))
+    return feat_index, bool(pos_conclusions[feat_index]), bool(neg_conclusions[feat_index]), errors[feat_index]
+
+
+def find_amount_of_say(error):
     """
-    add weight key and value to the current given data sample
+    calculates amount of say of a stump
 
-    :param data_list: input data
+    :param error: weighted error of the stump
 
-    :return: None
+    :return: amount of say of current stump
     """
 
-    count_sample = len(data_list)
-    for data in data_list:
-        data["weight"] = 1 / count_sample
+    factor = (1 - error) / (error + np.finfo(float).eps)
+    return 0.5 * math.log(factor, math.e)
 
 
-def get_new_stump_data(data_list, feat_name):
+def change_weights(weights, feat_values, labels, pos_conclusion, neg_conclusion, amount_of_say):
     """
-    adds two new keys to the data and returns that
-
-    :param data_list: input data
-    :param feat_name: name of the feature which will be used as root of stump
+    change the weights of the incorrectly classified and the correctly classified rows
+    for the next stump, weights is changed in place and normalized to sum to 1
+
+    :param weights: weight of every row
+    :param feat_values: value of the feature of the stump for every row
+    :param labels: boolean array, True for is_nl
+    :param pos_conclusion: conclusion of the stump if the feature is True
+    :param neg_conclusion: conclusion of the stump if the feature is False
+    :param amount_of_say: amount_of_say of current stump
 
-    :return: data with the additional keys
+    :return: None
     """
 
-    new_data = []
-    for data in data_list:
-        new_data.append({feat_name: data[feat_name],
-                         "res": data["res"], "weight": data["weight"]})
-    return new_data
+    incorrect = labels != np.where(feat_values, pos_conclusion, neg_conclusion)
+    weights *= np.where(incorrect, math.exp(amount_of_say), math.exp(-amount_of_say))
+    weights /= np.sum(weights)
 
 
-def add_child(feat_dict, parent_feat, child_feat, final_outcome):
+def stumps_of(decision_dict, key):
     """
-    Add a child to the final model dictionary
-
-    :param feat_dict: current model dictionary
-    :param parent_feat: feature which will be rot
-    :param child_feat: True or False
-    :param final_outcome: is_nl or is_en depending on probability
-
-    :return: None
+    :param decision_dict: adaboost dictionary model
+    :param key: feature name
+    :return: list of the stump dictionaries of the feature
     """
-    append_string = ""
-    if child_feat == "True" or child_feat == "False":
-        append_string = final_outcome
-    if child_feat == "amount_of_say":
-        append_string = final_outcome
-    if parent_feat not in feat_dict.keys():
-        feat_dict[parent_feat] = {child_feat: append_string}
-    else:
-        feat_dict[parent_feat][child_feat] = append_string
+    stumps = decision_dict[key]
+    if isinstance(stumps, dict):
+        return [stumps]
+    return stumps
 
 
 def decide(decision_dict, row):
     """
     function to provide a model and test data to get a prediction
 
-    :param decision_dict: adaboost dictionary model formed using the test branch of this algorithm
+    :param decision_dict: adaboost dictionary model made by older versions of make_stumps
     :param row: row to be tested on
 
     :return: is_nl or is_en
@@ -239,17 +232,18 @@ def decide(decision_dict, row):
     weight_is_nl = 0.0
     weight_is_en = 0.0
     for key in decision_dict:
-        if row[key]:
-            if decision_dict[key]["True"] == "is_nl":
-                weight_is_nl += decision_dict[key]["amount_of_say"]
-            elif decision_dict[key]["True"] == "is_en":
-                weight_is_en += decision_dict[key]["amount_of_say"]
-
-        else:
-            if decision_dict[key]["False"] == "is_nl":
-                weight_is_nl += decision_dict[key]["amount_of_say"]
-            elif decision_dict[key]["False"] == "is_en":
-                weight_is_en += decision_dict[key]["amount_of_say"]
+        for stump in stumps_of(decision_dict, key):
+            if row[key]:
+                if stump["True"] == "is_nl":
+                    weight_is_nl += stump["amount_of_say"]
+                elif stump["True"] == "is_en":
+                    weight_is_en += stump["amount_of_say"]
+
+            else:
+                if stump["False"] == "is_nl":
+                    weight_is_nl += stump["amount_of_say"]
+                elif stump["False"] == "is_en":
+                    weight_is_en += stump["amount_of_say"]
 
     if weight_is_nl > weight_is_en:
         return_value = "is_nl"
@@ -257,3 +251,109 @@ def decide(decision_dict, row):
         return_value = "is_en"
 
     return return_value
+
+
+def margin_to_probability(margin):
+    """
+    adaboost margins estimate half the log odds of is_nl, so the probability of is_nl
+    is the logistic function of twice the margin, works element wise on numpy arrays
+
+    :param margin: margin of a row, positive for is_nl
+    :return: probability of is_nl
+    """
+    return 1 / (1 + np.exp(-2 * np.asarray(margin, dtype=float)))
+
+
+class ConfidenceScorer:
+    """
+    scores rows of a BoostModel with their margin and the probability of is_nl
+    with early_exit the features are looked at in order of the size of their weight and a row stops as soon as
+    the weights left can not change the label or take the margin below min_margin,
+    the margin given for such a row is the bound closest to zero the weights left allow
+    """
+    __slots__ = "model", "early_exit", "min_margin", "order", "order_weights", "rest_pos", "rest_neg"
+
+    def __init__(self, model, early_exit=False, min_margin=0.0):
+        """
+        :param model: BoostModel
+        :param early_exit: True to stop evaluating a row once its label is known
+        :param min_margin: with early_exit, a row only stops once its margin is known to be at least this far from 0
+        """
+        self.model = model
+        self.early_exit = early_exit
+        self.min_margin = min_margin
+        weights = np.asarray(model.weights, dtype=float)
+        order = np.argsort(-np.abs(weights), kind="stable")
+        self.order = order[weights[order] != 0]
+        self.order_weights = weights[self.order]
+        # sums of the positive and of the negative weights from every position in the order to the end
+        self.rest_pos = np.append(np.cumsum(np.maximum(self.order_weights, 0)[::-1])[::-1], 0)
+        self.rest_neg = np.append(np.cumsum(np.minimum(self.order_weights, 0)[::-1])[::-1], 0)
+
+    def is_decided(self, margin, position):
+        """
+        :param margin: margin of the features before position in the order
+        :param position: position in the order
+        :return: the margin bound if the row can stop, None otherwise
+        """
+        lower = margin + self.rest_neg[position]
+        if lower > 0 and lower >= self.min_margin:
+            return lower
+        upper = margin + self.rest_pos[position]
+        if upper <= 0 and upper <= -self.min_margin:
+            return upper
+        return None
+
+    def decide(self, row):
+        """
+        scores a single row
+
+        :param row: feature dictionary, or sequence of feature values in the order of the model's features
+        :return:    is_nl or is_en
+                    margin, positive for is_nl
+                    probability of is_nl
+                    number of features looked at
+        """
+        if isinstance(row, dict):
+            row = [row[feat_name] for feat_name in self.model.feature_names]
+        margin = self.model.bias
+        evaluated = 0
+        for position, (feat_index, weight) in enumerate(zip(self.order.tolist(), self.order_weights.tolist())):
+            if self.early_exit:
+                bound = self.is_decided(margin, position)
+                if bound is not None:
+                    margin = bound
+                    break
+            evaluated += 1
+            if row[feat_index]:
+                margin += weight
+        is_nl = margin > 0
+        return "is_nl" if is_nl else "is_en", margin, float(margin_to_probability(margin)), evaluated
+
+    def margins(self, matrix):
+        """
+        scores every row of a matrix, the early exit is done for all rows together feature by feature
+
+        :param matrix: array of 0 and 1 with shape (rows, features), or a SparseMatrix
+        :return:    array of margins, positive for is_nl
+                    array with the number of features looked at for every row
+        """
+        if not isinstance(matrix, SparseMatrix):
+            matrix = np.asarray(matrix)
+        margins = np.full(len(matrix), self.model.bias)
+        evaluated = np.zeros(len(matrix), dtype=np.intp)
+        active = np.arange(len(matrix))
+        for position, (feat_index, weight) in enumerate(zip(self.order.tolist(), self.order_weights.tolist())):
+            if self.early_exit:
+                lower = margins[active] + self.rest_neg[position]
+                upper = margins[active] + self.rest_pos[position]
+                is_nl = (lower > 0) & (lower >= self.min_margin)
+                is_en = (upper <= 0) & (upper <= -self.min_margin)
+                margins[active[is_nl]] = lower[is_nl]
+                margins[active[is_en]] = upper[is_en]
+                active = active[~(is_nl | is_en)]
+                if not len(active):
+                    break
+            margins[active] += weight * matrix[active, feat_index]
+            evaluated[active] += 1
+        return margins, evaluated
@@ -0,0 +1,60 @@
+import argparse
+import os
+import sys
+import time
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import adaboost as ada
+from dataset import Dataset
+from model import BoostModel, load_model
+
+
+def main():
+    """
+    compares the number of features looked at per row by adaboost with and without early exit
+    and checks that the labels are the same
+
+    first command line argument: file_name of the data, lines start with the language
+    --model: adaboost model file, a model is trained on the data if it is not given
+    --rounds: number of rounds of the trained model
+    --min-margin: margin a row needs to be known to have before it stops
+    --repeat: number of times the data is repeated to make the timings longer
+
+    :return: None
+    """
+    parser = argparse.ArgumentParser(description="benchmark of adaboost early exit")
+    parser.add_argument("data", help="file with the data")
+    parser.add_argument("--model", help="adaboost model file, trained on the data if not given")
+    parser.add_argument("--rounds", type=int, default=ada.NUMBER_OF_STUMPS)
+    parser.add_argument("--min-margin", type=float, default=0.0)
+    parser.add_argument("--repeat", type=int, default=1)
+    args = parser.parse_args()
+
+    if args.model:
+        model = load_model(args.model)
+        if not isinstance(model, BoostModel):
+            raise SystemExit("early exit needs an adaboost model")
+        data = Dataset.from_file(args.data, spec=model.spec)
+    else:
+        data = Dataset.from_file(args.data)
+        model = ada.make_stumps(data, args.rounds)
+    matrix = np.tile(data.matrix(), (args.repeat, 1))
+
+    results = {}
+    for early_exit in (False, True):
+        scorer = ada.ConfidenceScorer(model, early_exit, args.min_margin)
+        start = time.perf_counter()
+        margins, evaluated = scorer.margins(matrix)
+        seconds = time.perf_counter() - start
+        results[early_exit] = margins
+        print("early exit %-5s  rows %d  stumps %d  features with weight %d  features looked at per row %.3f  "
+              "seconds %.4f" % (early_exit, len(matrix), len(model.stump_say), len(scorer.order),
+                                evaluated.mean() if len(evaluated) else 0.0, seconds))
+    same = np.array_equal(results[False] > 0, results[True] > 0)
+    print("same labels: %s" % same)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+import argparse
+import os
+import sys
+import time
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import adaboost as ada
+import decision_tree as dt
+from dataset import CHUNK_SIZE, Dataset, extract_matrix
+from make_features import DEFAULT_SPEC, HASH_MAX_N, HASH_MIN_N, FeatureSpec, parse_line
+from model import predict_batch
+
+
+# lines with at most this many words count as short lines
+SHORT_LINE_WORDS = 5
+
+
+def make_dataset(lines, spec):
+    """
+    :param lines: list of lines which start with the language
+    :param spec: FeatureSpec of the features which are extracted
+    :return: Dataset of the lines
+    """
+    datasets = []
+    for start in range(0, len(lines), CHUNK_SIZE):
+        matrix, labels = extract_matrix(lines[start:start + CHUNK_SIZE], spec=spec)
+        datasets.append(Dataset.from_matrix(matrix, labels, spec))
+    return Dataset.concatenate(datasets)
+
+
+def main():
+    """
+    compares the ten default features with hashed character ngrams, for the decision tree and adaboost,
+    on extraction speed, training time and accuracy on held out lines, overall and on short lines
+
+    first command line argument: file_name of the training data, lines start with the language
+    optional second command line argument: file_name of the test data, lines start with the language,
+                                           every --holdout th training line is held out if it is not given
+    --buckets: number of buckets of the hashed ngrams
+    --min-n, --max-n: shortest and longest hashed ngram
+    --rounds: number of adaboost rounds
+    --repeat: number of times the training lines are repeated to make the timings longer
+
+    :return: None
+    """
+    parser = argparse.ArgumentParser(description="benchmark of hashed ngram features against the default features")
+    parser.add_argument("train_data", help="file with the training data")
+    parser.add_argument("test_data", nargs="?", help="file with the test data, held out lines are used without it")
+    parser.add_argument("--holdout", type=int, default=5, help="every holdout th line is test data")
+    parser.add_argument("--buckets", type=int, default=4096)
+    parser.add_argument("--min-n", type=int, default=HASH_MIN_N)
+    parser.add_argument("--max-n", type=int, default=HASH_MAX_N)
+    parser.add_argument("--rounds", type=int, default=ada.NUMBER_OF_STUMPS)
+    parser.add_argument("--repeat", type=int, default=1)
+    args = parser.parse_args()
+
+    with open(args.train_data) as file:
+        train_lines = file.readlines()
+    if args.test_data:
+        with open(args.test_data) as file:
+            test_lines = file.readlines()
+    else:
+        test_lines = train_lines[args.holdout - 1::args.holdout]
+        del train_lines[args.holdout - 1::args.holdout]
+    train_lines = train_lines * args.repeat
+    is_short = np.array([len(parse_line(line)[1].split()) <= SHORT_LINE_WORDS for line in test_lines], dtype=bool)
+
+    hashed_spec = FeatureSpec([{"name": "ngram", "type": "hashed_ngrams", "buckets": args.buckets,
+                                "min_n": args.min_n, "max_n": args.max_n}])
+    print("train lines %d  test lines %d  short test lines %d" % (len(train_lines), len(test_lines),
+                                                                  np.count_nonzero(is_short)))
+    for spec_name, spec in (("default", DEFAULT_SPEC), ("hashed", hashed_spec)):
+        start = time.perf_counter()
+        train_data = make_dataset(train_lines, spec)
+        seconds = time.perf_counter() - start
+        test_data = make_dataset(test_lines, spec)
+        print("%-8s features %d  extraction %.0f lines/s  memory %d bytes" % (
+            spec_name, len(spec), len(train_lines) / max(seconds, 1e-9), train_data.nbytes))
+        for learner_name, learn in (("dt", dt.make_decision_tree),
+                                    ("ada", lambda data: ada.make_stumps(data, args.rounds))):
+            start = time.perf_counter()
+            model = learn(train_data)
+            train_seconds = time.perf_counter() - start
+            start = time.perf_counter()
+            correct = predict_batch(model, test_data) == test_data.labels
+            predict_seconds = time.perf_counter() - start
+            print("%-8s %-3s  training %.3fs  prediction %.0f lines/s  accuracy %.4f  short line accuracy %.4f" % (
+                spec_name, learner_name, train_seconds, len(test_lines) / max(predict_seconds, 1e-9),
+                correct.mean() if len(correct) else float("nan"),
+                correct[is_short].mean() if np.any(is_short) else float("nan")))
+
+
+if __name__ == "__main__":
+    main()
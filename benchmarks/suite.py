@@ -0,0 +1,383 @@
+import argparse
+import json
+import os
+import platform
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import adaboost as ada
+import decision_tree as dt
+from dataset import Dataset, extract_matrix, read_chunks
+from lazy import LazyPredicter
+from model import load_model, save_model
+
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# corpus sizes benchmarked when none are given
+DEFAULT_SIZES = (1000, 10000, 100000)
+# lines written at a time by the corpus generator
+GENERATOR_BLOCK = 1 << 16
+# lines predicted one at a time by the predict_row stages, the rate of a line does not change with the corpus size
+ROW_LINES = 10000
+# times a model is loaded by the load stages
+LOAD_REPEAT = 50
+# change of a metric from which compare flags a regression
+REGRESSION_THRESHOLD = 0.10
+
+STAGES = ("extract", "train_dt", "train_ada", "load_dt", "load_ada", "predict_row_dt", "predict_row_ada",
+          "predict_batch_dt", "predict_batch_ada")
+# unit every stage is reported and compared in, lines per second for the stages going through a corpus
+# and seconds per load for the stages loading a model, whose time does not depend on lines
+STAGE_UNITS = {stage: "s/load" if stage.startswith("load") else "lines/s" for stage in STAGES}
+# format of a value of every unit and whether a higher value is better
+UNITS = {"lines/s": ("%.0f", True), "s/load": ("%.3g", False)}
+
+
+class CorpusModel:
+    """
+    word level model of a labeled corpus, every line has the language of a line of the corpus,
+    the number of words of a line of the same language and words drawn from the words of that language
+    """
+    __slots__ = "nl_share", "words", "lengths"
+
+    def __init__(self, file_name):
+        """
+        :param file_name: labeled corpus, lines start with the language
+        """
+        words = {True: [], False: []}
+        lengths = {True: [], False: []}
+        with open(file_name) as file:
+            for line in file:
+                if len(line) < 4:
+                    continue
+                is_nl = line[:2] == "nl"
+                line_words = line[3:].split()
+                words[is_nl].extend(line_words)
+                lengths[is_nl].append(len(line_words))
+        if not lengths[True] or not lengths[False]:
+            raise ValueError(file_name + " needs lines of both languages")
+        self.nl_share = len(lengths[True]) / (len(lengths[True]) + len(lengths[False]))
+        self.words = {is_nl: np.array(language_words, dtype=object) for is_nl, language_words in words.items()}
+        self.lengths = {is_nl: np.array(language_lengths) for is_nl, language_lengths in lengths.items()}
+
+    def write(self, file_name, n_lines, seed=0):
+        """
+        writes a synthetic corpus, the same seed always gives the same corpus
+
+        :param file_name: name of the corpus file
+        :param n_lines: number of lines
+        :param seed: seed of the random generator
+        :return: None
+        """
+        generator = np.random.default_rng(seed)
+        with open(file_name, "w") as file:
+            for start in range(0, n_lines, GENERATOR_BLOCK):
+                count = min(GENERATOR_BLOCK, n_lines - start)
+                is_nl = generator.random(count) < self.nl_share
+                lines = []
+                for language in (True, False):
+                    lengths = generator.choice(self.lengths[language], np.count_nonzero(is_nl == language))
+                    words = generator.choice(self.words[language], lengths.sum())
+                    bounds = np.append(0, np.cumsum(lengths))
+                    prefix = "nl|" if language else "en|"
+                    lines.append([prefix + " ".join(words[bounds[i]:bounds[i + 1]]) for i in range(len(lengths))])
+                order = np.argsort(~is_nl, kind="stable")
+                block = np.empty(count, dtype=object)
+                block[order] = lines[0] + lines[1]
+                file.write("\n".join(block) + "\n")
+
+
+def peak_rss():
+    """
+    :return: peak resident memory of the process in bytes
+    """
+    # ru_maxrss keeps the peak of the process which started this one, VmHWM starts again at exec
+    try:
+        with open("/proc/self/status") as file:
+            for line in file:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def stage_extract(corpus, work_dir, rounds):
+    data = Dataset.from_file(corpus)
+    return len(data)
+
+
+def stage_train(learn_type):
+    def run(corpus, work_dir, rounds):
+        data = Dataset.from_file(corpus)
+        start = time.perf_counter()
+        model = dt.make_decision_tree(data) if learn_type == "dt" else ada.make_stumps(data, rounds)
+        seconds = time.perf_counter() - start
+        save_model(model, os.path.join(work_dir, learn_type + ".model"))
+        return len(data), seconds
+    return run
+
+
+def stage_load(learn_type):
+    def run(corpus, work_dir, rounds):
+        model_file_name = os.path.join(work_dir, learn_type + ".model")
+        start = time.perf_counter()
+        for _ in range(LOAD_REPEAT):
+            load_model(model_file_name)
+        return LOAD_REPEAT, time.perf_counter() - start
+    return run
+
+
+def stage_predict_row(learn_type):
+    def run(corpus, work_dir, rounds):
+        predicter = LazyPredicter(load_model(os.path.join(work_dir, learn_type + ".model")))
+        with open(corpus) as file:
+            lines = [line for _, line in zip(range(ROW_LINES), file)]
+        start = time.perf_counter()
+        for line in lines:
+            predicter.predict_lines([line])
+        return len(lines), time.perf_counter() - start
+    return run
+
+
+def stage_predict_batch(learn_type):
+    def run(corpus, work_dir, rounds):
+        model = load_model(os.path.join(work_dir, learn_type + ".model"))
+        count = 0
+        with open(corpus) as file:
+            for lines in read_chunks(file):
+                matrix, _ = extract_matrix(lines, spec=model.spec)
+                model.predict_batch(matrix)
+                count += len(lines)
+        return count
+    return run
+
+
+STAGE_FUNCTIONS = {"extract": stage_extract,
+                   "train_dt": stage_train("dt"),
+                   "train_ada": stage_train("ada"),
+                   "load_dt": stage_load("dt"),
+                   "load_ada": stage_load("ada"),
+                   "predict_row_dt": stage_predict_row("dt"),
+                   "predict_row_ada": stage_predict_row("ada"),
+                   "predict_batch_dt": stage_predict_batch("dt"),
+                   "predict_batch_ada": stage_predict_batch("ada"),
+                   }
+
+
+def time_stage(stage, corpus, work_dir, rounds):
+    """
+    runs a stage once, a stage returns the number of lines it handled, or of times it loaded the model,
+    and the seconds of the timed part when only part of it is timed
+
+    :return: (count, seconds) pair
+    """
+    start = time.perf_counter()
+    result = STAGE_FUNCTIONS[stage](corpus, work_dir, rounds)
+    seconds = time.perf_counter() - start
+    if isinstance(result, tuple):
+        return result
+    return result, seconds
+
+
+def run_stage(stage, corpus, work_dir, rounds, repeat, allocations):
+    """
+    runs a stage in a fresh process, the best of repeat timings is kept and the peak memory is the one
+    of the process, allocations are traced in one more run after the timed ones
+
+    :param stage: name of the stage
+    :param corpus: name of the corpus file
+    :param work_dir: directory of the models made by the training stages
+    :param rounds: number of adaboost rounds
+    :param repeat: number of timed runs
+    :param allocations: True to trace the allocations of the stage
+    :return: dictionary of the metrics of the stage
+    """
+    count, seconds = min((time_stage(stage, corpus, work_dir, rounds) for _ in range(repeat)),
+                         key=lambda timing: timing[1])
+    unit = STAGE_UNITS[stage]
+    value = count / max(seconds, 1e-9) if unit == "lines/s" else seconds / max(count, 1)
+    result = {"count": count, "seconds": seconds, "unit": unit, "value": value, "peak_rss_bytes": peak_rss()}
+    if allocations:
+        tracemalloc.start()
+        time_stage(stage, corpus, work_dir, rounds)
+        result["alloc_peak_bytes"] = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    return result
+
+
+def stage_value(result):
+    """
+    :param result: dictionary of the metrics of a stage, results from before the units have lines_per_sec
+    :return: (value, unit) pair of the stage
+    """
+    if "unit" in result:
+        return result["value"], result["unit"]
+    if STAGE_UNITS.get(result["stage"]) == "s/load":
+        return result["seconds"] / max(result["lines"], 1), "s/load"
+    return result["lines_per_sec"], "lines/s"
+
+
+def format_value(value, unit):
+    return UNITS[unit][0] % value + " " + unit
+
+
+def git_commit():
+    """
+    :return: commit of the repository, None if it is not known
+    """
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], cwd=REPO_DIR, capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(args):
+    """
+    writes the corpora and runs every stage on every size, every stage in a fresh process
+
+    :param args: arguments of the run command
+    :return: None
+    """
+    stages = args.stages.split(",") if args.stages else list(STAGES)
+    for stage in stages:
+        if stage not in STAGE_FUNCTIONS:
+            raise SystemExit("unknown stage " + stage + ", stages are " + ",".join(STAGES))
+    # training stages write the models the later stages read
+    stages = [stage for stage in STAGES if stage in stages]
+    sizes = [int(size) for size in args.sizes.split(",")] if args.sizes else list(DEFAULT_SIZES)
+    corpus_model = CorpusModel(args.train_data)
+    work_dir = args.work_dir or tempfile.mkdtemp(prefix="benchmark")
+    os.makedirs(work_dir, exist_ok=True)
+    report = {"meta": {"commit": git_commit(), "python": platform.python_version(), "numpy": np.__version__,
+                       "platform": platform.platform(), "cpus": os.cpu_count(), "time": time.time(),
+                       "train_data": args.train_data, "seed": args.seed, "rounds": args.rounds,
+                       "repeat": args.repeat},
+              "results": []}
+    try:
+        for size in sizes:
+            corpus = os.path.join(work_dir, "corpus_%d.txt" % size)
+            if not os.path.exists(corpus):
+                corpus_model.write(corpus, size, args.seed)
+            size_dir = os.path.join(work_dir, "models_%d" % size)
+            os.makedirs(size_dir, exist_ok=True)
+            for stage in stages:
+                learn_type = stage.rsplit("_", 1)[-1]
+                if stage.startswith(("load", "predict")) and "train_" + learn_type not in stages and \
+                        not os.path.exists(os.path.join(size_dir, learn_type + ".model")):
+                    raise SystemExit(stage + " needs the train_" + learn_type + " stage or a model from an earlier "
+                                     "run in --work-dir")
+                with ProcessPoolExecutor(1, mp_context=get_context("spawn")) as executor:
+                    result = executor.submit(run_stage, stage, corpus, size_dir, args.rounds, args.repeat,
+                                             args.allocations).result()
+                result = dict(size=size, stage=stage, **result)
+                report["results"].append(result)
+                print("%10d %-18s %18s %10.4fs  peak rss %8.1f MB%s" % (
+                    size, stage, format_value(result["value"], result["unit"]), result["seconds"],
+                    result["peak_rss_bytes"] / 1e6,
+                    "  alloc peak %8.1f MB" % (result["alloc_peak_bytes"] / 1e6) if args.allocations else ""),
+                    file=sys.stderr)
+    finally:
+        if not args.work_dir:
+            shutil.rmtree(work_dir)
+    with open(args.output, "w") as file:
+        json.dump(report, file, indent=1)
+
+
+def compare(args):
+    """
+    compares the results of two runs stage by stage in the unit of the stage, a stage regresses when it gets slower,
+    fewer lines per second or more seconds per load, or its memory grows by more than the threshold
+
+    :param args: arguments of the compare command
+    :return: number of regressions
+    """
+    with open(args.old) as file:
+        old = {(result["size"], result["stage"]): result for result in json.load(file)["results"]}
+    with open(args.new) as file:
+        new = {(result["size"], result["stage"]): result for result in json.load(file)["results"]}
+    regressions = 0
+    print("%10s %-18s %18s %18s %8s %9s  %s" % ("size", "stage", "old", "new", "speed", "memory", ""))
+    for key in sorted(old.keys() & new.keys()):
+        old_value, unit = stage_value(old[key])
+        new_value, new_unit = stage_value(new[key])
+        if new_unit != unit:
+            print("%10d %-18s %s in %s and %s in %s" % (key[0], key[1], unit, args.old, new_unit, args.new))
+            continue
+        # above 0 is faster in either unit
+        if UNITS[unit][1]:
+            speed = new_value / max(old_value, 1e-9) - 1
+        else:
+            speed = old_value / max(new_value, 1e-9) - 1
+        memory = new[key]["peak_rss_bytes"] / max(old[key]["peak_rss_bytes"], 1) - 1
+        flags = []
+        if speed < -args.threshold:
+            flags.append("SLOWER")
+        if memory > args.threshold:
+            flags.append("MORE MEMORY")
+        if "alloc_peak_bytes" in old[key] and "alloc_peak_bytes" in new[key] and \
+                new[key]["alloc_peak_bytes"] / max(old[key]["alloc_peak_bytes"], 1) - 1 > args.threshold:
+            flags.append("MORE ALLOCATED")
+        regressions += bool(flags)
+        print("%10d %-18s %18s %18s %+7.1f%% %+8.1f%%  %s" % (
+            key[0], key[1], format_value(old_value, unit), format_value(new_value, unit), speed * 100, memory * 100,
+            " ".join(flags)))
+    for key in sorted(old.keys() ^ new.keys()):
+        print("%10d %-18s only in %s" % (key[0], key[1], args.old if key in old else args.new))
+    print("%d regressions" % regressions)
+    return regressions
+
+
+def main():
+    """
+    run: writes synthetic english and dutch corpora of the given sizes, modelled on the training data,
+         and times feature extraction, training, model loading and prediction on them, the results go to json
+    compare: compares two result files and exits with status 1 if a stage regressed
+
+    :return: None
+    """
+    parser = argparse.ArgumentParser(description="benchmark suite of training and prediction throughput")
+    commands = parser.add_subparsers(dest="command")
+    run_parser = commands.add_parser("run", help="run the benchmarks")
+    run_parser.add_argument("--train-data", default=os.path.join(REPO_DIR, "train.dat"),
+                            help="labeled corpus the synthetic corpora are modelled on")
+    run_parser.add_argument("--sizes", help="comma separated numbers of lines, 1000,10000,100000 by default")
+    run_parser.add_argument("--stages", help="comma separated stages, all by default: " + ",".join(STAGES))
+    run_parser.add_argument("--rounds", type=int, default=ada.NUMBER_OF_STUMPS)
+    run_parser.add_argument("--repeat", type=int, default=1, help="timed runs of every stage, the best is kept")
+    run_parser.add_argument("--seed", type=int, default=0)
+    run_parser.add_argument("--allocations", action="store_true",
+                            help="trace the allocations of every stage in one more, slower, run")
+    run_parser.add_argument("--work-dir", help="directory which keeps the corpora between runs, a temporary one "
+                                               "is used and removed without it")
+    run_parser.add_argument("--output", default="benchmark.json", help="json file of the results")
+    compare_parser = commands.add_parser("compare", help="compare two result files")
+    compare_parser.add_argument("old", help="json file of the earlier run")
+    compare_parser.add_argument("new", help="json file of the later run")
+    compare_parser.add_argument("--threshold", type=float, default=REGRESSION_THRESHOLD,
+                                help="relative change flagged as a regression")
+    args = parser.parse_args()
+
+    if args.command == "run":
+        run(args)
+    elif args.command == "compare":
+        sys.exit(1 if compare(args) else 0)
+    else:
+        parser.print_help()
+
+
+if __name__ == "__main__":
+    main()
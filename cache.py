@@ -0,0 +1,243 @@
+import hashlib
+import sqlite3
+from collections import OrderedDict
+import numpy as np
+from dataset import SparseMatrix, extract_matrix
+from make_features import parse_line
+from metrics import METRICS
+from model import BoostModel, model_version
+
+
+# entries kept in memory when no size is given
+CACHE_SIZE = 1 << 16
+# keys looked up in the disk tier with one query, below the limit sqlite puts on the variables of a query
+DISK_QUERY_SIZE = 500
+
+STAT_NAMES = ("hits", "feature_hits", "misses", "disk_hits", "evictions", "invalidations")
+
+
+def line_key(text):
+    """
+    :param text: lowercased line without the language, the way the features see it
+    :return: 8 byte digest of the line
+    """
+    return hashlib.blake2b(text.encode("utf-8"), digest_size=8).digest()
+
+
+class FeatureCache:
+    """
+    bounded least recently used cache of the features and the score of lines, keyed by line_key
+    the features are the indices of the True columns and the score is the adaboost margin, or 1 and -1 for a tree,
+    entries are dropped when the feature spec changes and lose their score when the model changes
+    with a file_name the entries are also kept in an sqlite file, which is read when they are not in memory
+    """
+
+    def __init__(self, max_entries=CACHE_SIZE, file_name=None):
+        """
+        :param max_entries: most entries kept in memory
+        :param file_name: optional sqlite file which keeps the entries between runs
+        """
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.spec_version = None
+        self.model_version = None
+        self.stats = dict.fromkeys(STAT_NAMES, 0)
+        self.pending = {}
+        self.db = None
+        if file_name is not None:
+            self.db = sqlite3.connect(file_name)
+            self.db.execute("CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value TEXT)")
+            self.db.execute("CREATE TABLE IF NOT EXISTS entries (key BLOB PRIMARY KEY, features BLOB, score REAL)")
+
+    def bind(self, spec_version, model_version):
+        """
+        sets the versions the entries belong to, entries of another feature spec are dropped
+        and entries of another model keep their features but lose their score
+
+        :param spec_version: version of the FeatureSpec
+        :param model_version: version of the model from model.model_version
+        :return: None
+        """
+        # the memory and the disk tier are invalidated by the same change, which is counted once
+        invalidated = False
+        if self.spec_version is not None and spec_version != self.spec_version:
+            self.entries.clear()
+            invalidated = True
+        elif self.model_version is not None and model_version != self.model_version:
+            for entry in self.entries.values():
+                entry[1] = None
+            invalidated = True
+        self.spec_version = spec_version
+        self.model_version = model_version
+        if self.db is not None:
+            meta = dict(self.db.execute("SELECT name, value FROM meta"))
+            if meta.get("spec_version", spec_version) != spec_version:
+                self.db.execute("DELETE FROM entries")
+                invalidated = True
+            elif meta.get("model_version", model_version) != model_version:
+                self.db.execute("UPDATE entries SET score = NULL")
+                invalidated = True
+            self.db.executemany("INSERT OR REPLACE INTO meta VALUES (?, ?)",
+                                [("spec_version", spec_version), ("model_version", model_version)])
+            self.db.commit()
+        self.stats["invalidations"] += invalidated
+
+    def lookup(self, keys):
+        """
+        :param keys: list of keys
+        :return: list with a [features, score] entry or None for every key, score is None if only the features are known
+        """
+        found = [self.entries.get(key) for key in keys]
+        for key, entry in zip(keys, found):
+            if entry is not None:
+                self.entries.move_to_end(key)
+        if self.db is not None:
+            missing = list({key for key, entry in zip(keys, found) if entry is None})
+            disk_entries = {}
+            for start in range(0, len(missing), DISK_QUERY_SIZE):
+                chunk = missing[start:start + DISK_QUERY_SIZE]
+                query = "SELECT key, features, score FROM entries WHERE key IN (%s)" % ",".join("?" * len(chunk))
+                for key, features, score in self.db.execute(query, chunk):
+                    disk_entries[key] = [features, score]
+            self.stats["disk_hits"] += len(disk_entries)
+            for key, entry in disk_entries.items():
+                self.put(key, entry, to_disk=False)
+            found = [disk_entries.get(key) if entry is None else entry for key, entry in zip(keys, found)]
+        return found
+
+    def put(self, key, entry, to_disk=True):
+        """
+        :param key: key of the line
+        :param entry: [features, score] list
+        :param to_disk: True to write the entry to the disk tier on the next flush
+        :return: None
+        """
+        if self.max_entries > 0:
+            self.entries[key] = entry
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+                self.stats["evictions"] += 1
+        if to_disk and self.db is not None:
+            self.pending[key] = entry
+
+    def flush(self):
+        """
+        writes the new entries to the disk tier
+        """
+        if self.db is not None and self.pending:
+            self.db.executemany("INSERT OR REPLACE INTO entries VALUES (?, ?, ?)",
+                                [(key, features, score) for key, (features, score) in self.pending.items()])
+            self.db.commit()
+        self.pending = {}
+
+    def close(self):
+        self.flush()
+        if self.db is not None:
+            self.db.close()
+            self.db = None
+
+    def hit_rate(self):
+        """
+        :return: share of the lines whose score came from the cache
+        """
+        total = self.stats["hits"] + self.stats["feature_hits"] + self.stats["misses"]
+        return self.stats["hits"] / total if total else 0.0
+
+    def format_stats(self):
+        return "cache " + "  ".join("%s %d" % (name, self.stats[name]) for name in STAT_NAMES) + \
+            "  entries %d  hit rate %.3f" % (len(self.entries), self.hit_rate())
+
+
+class CachedPredicter:
+    """
+    predicts lines through a FeatureCache, the lines of a call which are not cached are extracted and scored together,
+    lines whose features are cached from an earlier model are scored without extracting them again
+    """
+    __slots__ = "model", "spec", "cache"
+
+    def __init__(self, model, cache):
+        """
+        :param model: TreeModel or BoostModel
+        :param cache: FeatureCache, it is bound to the spec and the version of the model
+        """
+        self.model = model
+        self.spec = model.spec
+        self.cache = cache
+        cache.bind(model.spec.version, model_version(model))
+
+    def margins_lines(self, lines, is_test=False):
+        """
+        :param lines: list of lines
+        :param is_test: True if the lines do not have the language at the start
+        :return: array with the score of every line, the adaboost margin, or 1 for is_nl and -1 for is_en of a tree
+        """
+        texts = [parse_line(line, is_test)[1] for line in lines]
+        keys = [line_key(text) for text in texts]
+        scores = np.empty(len(texts))
+        # positions of the lines which need a score, by key, and the features of those already known
+        positions = {}
+        features = {}
+        missing = {}
+        for i, (key, entry) in enumerate(zip(keys, self.cache.lookup(keys))):
+            if entry is not None and entry[1] is not None:
+                scores[i] = entry[1]
+                self.cache.stats["hits"] += 1
+            elif key in positions:
+                positions[key].append(i)
+                self.cache.stats["hits"] += 1
+            elif entry is not None:
+                positions[key] = [i]
+                features[key] = entry[0]
+                self.cache.stats["feature_hits"] += 1
+            else:
+                positions[key] = [i]
+                missing[key] = texts[i]
+                self.cache.stats["misses"] += 1
+        if missing:
+            features.update(zip(missing, self.extract(list(missing.values()))))
+        if positions:
+            new_keys = list(positions)
+            new_scores = self.score([features[key] for key in new_keys])
+            for key, score in zip(new_keys, new_scores.tolist()):
+                self.cache.put(key, [features[key], score])
+                scores[positions[key]] = score
+        self.cache.flush()
+        METRICS.count("lines_predicted", len(texts))
+        return scores
+
+    def predict_lines(self, lines, is_test=False):
+        """
+        :param lines: list of lines
+        :param is_test: True if the lines do not have the language at the start
+        :return: boolean array, True for is_nl
+        """
+        return self.margins_lines(lines, is_test) > 0
+
+    def extract(self, texts):
+        """
+        :param texts: list of lowercased lines without the language
+        :return: list with the indices of the True columns of every line as int32 bytes
+        """
+        matrix, _ = extract_matrix(texts, is_test=True, spec=self.spec)
+        if isinstance(matrix, SparseMatrix):
+            return [matrix.indices[matrix.indptr[i]:matrix.indptr[i + 1]].tobytes() for i in range(len(matrix))]
+        return [np.flatnonzero(row).astype(np.int32).tobytes() for row in matrix]
+
+    def score(self, features):
+        """
+        :param features: list with the indices of the True columns of every line as int32 bytes
+        :return: array with the score of every line
+        """
+        indices = [np.frombuffer(row, dtype=np.int32) for row in features]
+        counts = np.array([len(row) for row in indices], dtype=np.int64)
+        rows = np.repeat(np.arange(len(indices)), counts)
+        cols = np.concatenate(indices + [np.zeros(0, dtype=np.int32)])
+        if self.spec.sparse:
+            matrix = SparseMatrix.from_coordinates(rows, cols, len(indices), len(self.spec))
+        else:
+            matrix = np.zeros((len(indices), len(self.spec)), dtype=np.uint8)
+            matrix[rows, cols] = 1
+        if isinstance(self.model, BoostModel):
+            return self.model.margins(matrix)
+        return np.where(self.model.predict_batch(matrix), 1.0, -1.0)
@@ -0,0 +1,526 @@
+import numpy as np
+import ingest
+from make_features import DEFAULT_SPEC, parse_line
+from metrics import METRICS
+
+
+# number of lines which are extracted and packed together, has to be a multiple of 8
+CHUNK_SIZE = 1 << 16
+
+
+class SparseMatrix:
+    """
+    matrix of 0 and 1 which only keeps the columns of the ones of every row, in compressed sparse row form,
+    the columns of row i are indices[indptr[i]:indptr[i + 1]] in increasing order
+    """
+    __slots__ = "indptr", "indices", "shape", "_keys"
+
+    def __init__(self, indptr, indices, n_cols):
+        """
+        :param indptr: integer array of length rows + 1 with the start of every row in indices
+        :param indices: integer array with the columns of the ones, sorted within every row
+        :param n_cols: number of columns
+        """
+        self.indptr = np.asarray(indptr, dtype=np.int64)
+        self.indices = np.asarray(indices, dtype=np.int32)
+        self.shape = (len(self.indptr) - 1, n_cols)
+        self._keys = None
+
+    @classmethod
+    def from_coordinates(cls, rows, cols, n_rows, n_cols):
+        """
+        :param rows: integer array with the row of every one, in increasing order
+        :param cols: integer array with the column of every one, in increasing order within a row
+        :param n_rows: number of rows
+        :param n_cols: number of columns
+        :return: the matrix
+        """
+        indptr = np.zeros(n_rows + 1, dtype=np.int64)
+        np.cumsum(np.bincount(rows, minlength=n_rows), out=indptr[1:])
+        return cls(indptr, cols, n_cols)
+
+    @classmethod
+    def from_dense(cls, matrix):
+        """
+        :param matrix: array like of booleans with shape (rows, columns)
+        :return: the matrix
+        """
+        matrix = np.asarray(matrix, dtype=bool)
+        rows, cols = np.nonzero(matrix)
+        return cls.from_coordinates(rows, cols, matrix.shape[0], matrix.shape[1])
+
+    @classmethod
+    def concatenate(cls, matrices, n_cols):
+        """
+        :param matrices: list of matrices with n_cols columns
+        :param n_cols: number of columns
+        :return: the matrix with the rows of all the matrices
+        """
+        indptr = [np.zeros(1, dtype=np.int64)]
+        offset = 0
+        for matrix in matrices:
+            indptr.append(matrix.indptr[1:] + offset)
+            offset += len(matrix.indices)
+        indices = np.concatenate([matrix.indices for matrix in matrices] + [np.zeros(0, dtype=np.int32)])
+        return cls(np.concatenate(indptr), indices, n_cols)
+
+    def __len__(self):
+        return self.shape[0]
+
+    @property
+    def nbytes(self):
+        return self.indptr.nbytes + self.indices.nbytes
+
+    def row_ids(self):
+        """
+        :return: integer array with the row of every one
+        """
+        return np.repeat(np.arange(len(self), dtype=np.int64), np.diff(self.indptr))
+
+    def take(self, rows):
+        """
+        :param rows: integer array of rows
+        :return: matrix with the given rows in the given order
+        """
+        rows = np.asarray(rows, dtype=np.intp)
+        starts = self.indptr[rows]
+        counts = self.indptr[rows + 1] - starts
+        indptr = np.zeros(len(rows) + 1, dtype=np.int64)
+        np.cumsum(counts, out=indptr[1:])
+        # position of every one of the new matrix in the old indices
+        positions = np.arange(indptr[-1], dtype=np.int64) + np.repeat(starts - indptr[:-1], counts)
+        return SparseMatrix(indptr, self.indices[positions], self.shape[1])
+
+    def select(self, cols):
+        """
+        :param cols: integer array of distinct columns
+        :return: matrix with the given columns in the given order
+        """
+        position = np.full(self.shape[1], -1, dtype=np.int64)
+        position[np.asarray(cols, dtype=np.intp)] = np.arange(len(cols))
+        new_cols = position[self.indices]
+        keep = new_cols >= 0
+        rows = self.row_ids()[keep]
+        # columns within a row stay sorted only when cols is increasing, so the rows are sorted again
+        keys = np.sort(rows * len(cols) + new_cols[keep])
+        return SparseMatrix.from_coordinates(rows, keys % max(len(cols), 1), len(self), len(cols))
+
+    def contains(self, rows, cols):
+        """
+        looks up single values with a binary search of the sorted row * columns + column keys
+
+        :param rows: integer array of rows
+        :param cols: integer array of columns, one per row
+        :return: boolean array, True where the value is one
+        """
+        if self._keys is None:
+            self._keys = self.row_ids() * self.shape[1] + self.indices
+        targets = np.asarray(rows, dtype=np.int64) * self.shape[1] + np.asarray(cols, dtype=np.int64)
+        if not len(self._keys):
+            return np.zeros(len(targets), dtype=bool)
+        positions = np.minimum(np.searchsorted(self._keys, targets), len(self._keys) - 1)
+        return self._keys[positions] == targets
+
+    def column(self, col):
+        """
+        :param col: index of the column
+        :return: boolean array with the value of the column for every row
+        """
+        values = np.zeros(len(self), dtype=bool)
+        values[self.row_ids()[self.indices == col]] = True
+        return values
+
+    def __getitem__(self, index):
+        """
+        supports matrix[rows, col] and matrix[:, col] like a dense matrix
+
+        :param index: pair of an integer array or a full slice, and a column
+        :return: uint8 array of 0 and 1
+        """
+        rows, col = index
+        if isinstance(rows, slice):
+            return self.column(col)[rows].view(np.uint8)
+        rows = np.asarray(rows, dtype=np.int64)
+        return self.contains(rows, np.full(len(rows), col)).view(np.uint8)
+
+    def toarray(self):
+        """
+        :return: uint8 array of 0 and 1 with shape (rows, columns)
+        """
+        matrix = np.zeros(self.shape, dtype=np.uint8)
+        matrix[self.row_ids(), self.indices] = 1
+        return matrix
+
+
+class PackedMatrix:
+    """
+    matrix of 0 and 1 kept as the packed bits of a Dataset, indexing it unpacks only the rows or the column asked for,
+    so training goes over the features a block of rows at a time instead of unpacking the whole matrix
+    """
+    __slots__ = "bits", "shape"
+
+    def __init__(self, bits, n_rows):
+        """
+        :param bits: uint8 array of shape (ceil(n_rows / 8), columns) made with np.packbits(axis=0)
+        :param n_rows: number of rows
+        """
+        self.bits = bits
+        self.shape = (n_rows, bits.shape[1])
+
+    def __len__(self):
+        return self.shape[0]
+
+    def take(self, rows):
+        """
+        :param rows: integer array of rows, or a slice
+        :return: uint8 array of 0 and 1 with shape (rows, columns)
+        """
+        if isinstance(rows, slice):
+            start, stop, step = rows.indices(len(self))
+            if step != 1:
+                return self.take(np.arange(start, stop, step))
+            # whole bytes are unpacked from the one holding the first row
+            first = start - start % 8
+            unpacked = np.unpackbits(self.bits[first >> 3:(stop + 7) >> 3], axis=0, count=max(stop - first, 0))
+            return unpacked[start - first:]
+        rows = np.asarray(rows, dtype=np.intp)
+        shift = (7 - (rows & 7)).astype(np.uint8)
+        return (self.bits[rows >> 3] >> shift[:, None]) & 1
+
+    def column(self, col):
+        """
+        :param col: index of the column
+        :return: uint8 array of 0 and 1 with the value of the column for every row
+        """
+        return np.unpackbits(self.bits[:, col], count=len(self))
+
+    def __getitem__(self, index):
+        """
+        supports matrix[rows], matrix[rows, col] and matrix[:, col] like a dense matrix
+
+        :param index: integer array or slice of rows, or a pair of those and a column
+        :return: uint8 array of 0 and 1
+        """
+        if not isinstance(index, tuple):
+            return self.take(index)
+        rows, col = index
+        if isinstance(rows, slice):
+            return self.column(col)[rows]
+        rows = np.asarray(rows, dtype=np.intp)
+        return (self.bits[rows >> 3, col] >> (7 - (rows & 7)).astype(np.uint8)) & 1
+
+
+class Dataset:
+    """
+    compact columnar form of the data
+    every feature is a column of bits packed 8 rows to a byte, the language of every row is kept
+    in a boolean label vector and the sentences stay in the source file
+    with a sparse spec, like hashed ngrams, bits is a SparseMatrix of the True columns of every row instead
+    """
+    __slots__ = "bits", "labels", "n_rows", "spec", "feature_names", "source", "is_test", "input_format", "_weights"
+
+    def __init__(self, bits, labels, n_rows, spec=DEFAULT_SPEC, source=None, is_test=False,
+                 input_format=ingest.DEFAULT_FORMAT):
+        """
+        :param bits: uint8 array of shape (ceil(n_rows / 8), number of features) made with np.packbits(axis=0),
+                     or a SparseMatrix for a sparse spec
+        :param labels: boolean array, True for is_nl, None for test data
+        :param n_rows: number of rows
+        :param spec: FeatureSpec of the columns
+        :param source: file_name the rows were read from
+        :param is_test: True if the source file has no language at the start of the lines
+        :param input_format: ingest.InputFormat of the lines of the source file
+        """
+        self.bits = bits
+        self.labels = labels
+        self.n_rows = n_rows
+        self.spec = spec
+        self.feature_names = spec.names
+        self.source = source
+        self.is_test = is_test
+        self.input_format = input_format
+        self._weights = None
+
+    @classmethod
+    def from_matrix(cls, matrix, labels=None, spec=DEFAULT_SPEC, source=None, is_test=False,
+                    input_format=ingest.DEFAULT_FORMAT):
+        """
+        packs a (rows, features) boolean matrix
+
+        :param matrix: array like of booleans with one column per feature, or a SparseMatrix
+        :param labels: array like of booleans, True for is_nl
+        :param spec: FeatureSpec of the columns
+        :param source: file_name the rows were read from
+        :param is_test: True if the rows have no language
+        :param input_format: ingest.InputFormat of the lines of the source file
+        :return: the dataset
+        """
+        if labels is not None:
+            labels = np.asarray(labels, dtype=bool)
+        if isinstance(matrix, SparseMatrix):
+            return cls(matrix, labels, len(matrix), spec, source, is_test, input_format)
+        matrix = np.asarray(matrix, dtype=bool).reshape(-1, len(spec))
+        return cls(np.packbits(matrix, axis=0), labels, len(matrix), spec, source, is_test, input_format)
+
+    @classmethod
+    def from_rows(cls, rows):
+        """
+        makes a dataset of the default features from a list of Features.features dictionaries
+
+        :param rows: list of feature dictionaries
+        :return: the dataset
+        """
+        is_test = bool(rows) and "res" not in rows[0]
+        matrix = [[row[feat_name] for feat_name in DEFAULT_SPEC.names] for row in rows]
+        labels = None if is_test else [row["res"] for row in rows]
+        return cls.from_matrix(matrix, labels, is_test=is_test)
+
+    @classmethod
+    def from_file(cls, file_name, is_test=False, spec=DEFAULT_SPEC, input_format=ingest.DEFAULT_FORMAT):
+        """
+        reads the file specified in file_name and extracts the features of every line,
+        only the packed features and the labels are kept in memory
+
+        :param file_name: name of the file, which may be gzip, bz2 or xz compressed
+        :param is_test: True if the lines do not have the language at the start
+        :param spec: FeatureSpec of the features which are extracted
+        :param input_format: ingest.InputFormat of the lines
+        :return: the dataset
+        """
+        bits = []
+        labels = []
+        n_rows = 0
+        for lines in ingest.read_batches(file_name, input_format, is_test, CHUNK_SIZE):
+            matrix, chunk_labels = extract_matrix(lines, is_test, spec)
+            bits.append(matrix if spec.sparse else np.packbits(matrix, axis=0))
+            if not is_test:
+                labels.append(chunk_labels)
+            n_rows += len(lines)
+        if spec.sparse:
+            bits = SparseMatrix.concatenate(bits, len(spec))
+        elif bits:
+            bits = np.concatenate(bits)
+        else:
+            bits = np.zeros((0, len(spec)), dtype=np.uint8)
+        if is_test:
+            labels = None
+        else:
+            labels = np.concatenate(labels) if labels else np.zeros(0, dtype=bool)
+        return cls(bits, labels, n_rows, spec, file_name, is_test, input_format)
+
+    @classmethod
+    def concatenate(cls, datasets):
+        """
+        joins datasets with the same features, rows are repacked a dataset at a time
+        when a dataset does not end on a full byte
+
+        :param datasets: list of datasets
+        :return: the joined dataset, without a source
+        """
+        spec = datasets[0].spec if datasets else DEFAULT_SPEC
+        is_test = any(data.labels is None for data in datasets)
+        labels = None if is_test else np.concatenate([data.labels for data in datasets] + [np.zeros(0, dtype=bool)])
+        n_rows = sum(len(data) for data in datasets)
+        if spec.sparse:
+            return cls(SparseMatrix.concatenate([data.bits for data in datasets], len(spec)), labels, n_rows, spec,
+                       is_test=is_test)
+        bits = []
+        carry = np.zeros((0, len(spec)), dtype=np.uint8)
+        for data in datasets:
+            if not len(carry) and len(data) % 8 == 0:
+                bits.append(data.bits)
+                continue
+            matrix = np.concatenate((carry, data.matrix()))
+            full = len(matrix) - len(matrix) % 8
+            bits.append(np.packbits(matrix[:full], axis=0))
+            carry = matrix[full:]
+        bits.append(np.packbits(carry, axis=0))
+        return cls(np.concatenate(bits), labels, n_rows, spec, is_test=is_test)
+
+    def __len__(self):
+        return self.n_rows
+
+    @property
+    def n_features(self):
+        return len(self.feature_names)
+
+    @property
+    def nbytes(self):
+        """
+        memory used by the arrays of the dataset
+        """
+        total = self.bits.nbytes
+        if self.labels is not None:
+            total += self.labels.nbytes
+        if self._weights is not None:
+            total += self._weights.nbytes
+        return total
+
+    @property
+    def weights(self):
+        """
+        weight of every row, made uniform the first time it is asked for
+        """
+        if self._weights is None:
+            self._weights = np.full(self.n_rows, 1 / max(self.n_rows, 1))
+        return self._weights
+
+    @weights.setter
+    def weights(self, weights):
+        self._weights = np.asarray(weights, dtype=float)
+
+    def matrix(self, indices=None):
+        """
+        unpacks the features of the given rows
+
+        :param indices: integer array of rows, all rows if None
+        :return: uint8 array of 0 and 1 with shape (rows, features), a SparseMatrix for a sparse spec
+        """
+        if isinstance(self.bits, SparseMatrix):
+            return self.bits if indices is None else self.bits.take(indices)
+        if indices is None:
+            return np.unpackbits(self.bits, axis=0, count=self.n_rows)
+        return self.packed().take(indices)
+
+    def packed(self):
+        """
+        the features for training, which unpacks the rows as they are indexed, so memory stays near the packed size
+
+        :return: PackedMatrix of the bits, the SparseMatrix for a sparse spec
+        """
+        if isinstance(self.bits, SparseMatrix):
+            return self.bits
+        return PackedMatrix(self.bits, self.n_rows)
+
+    def chunks(self, size=CHUNK_SIZE):
+        """
+        :param size: number of rows of a chunk
+        :return: generator of (uint8 array of 0 and 1 with shape (rows, features), label array) pairs of blocks of rows,
+                 a SparseMatrix for a sparse spec
+        """
+        for start in range(0, self.n_rows, size):
+            rows = slice(start, min(start + size, self.n_rows))
+            labels = None if self.labels is None else self.labels[rows]
+            if isinstance(self.bits, SparseMatrix):
+                yield self.bits.take(np.arange(rows.start, rows.stop)), labels
+            else:
+                yield self.packed().take(rows), labels
+
+    def take(self, indices):
+        """
+        :param indices: integer array of rows
+        :return: dataset of the given rows, in the given order, without a source since its lines are not the
+                 lines of the file
+        """
+        indices = np.asarray(indices, dtype=np.intp)
+        labels = None if self.labels is None else self.labels[indices]
+        return Dataset.from_matrix(self.matrix(indices), labels, self.spec, is_test=self.is_test)
+
+    def select(self, spec):
+        """
+        :param spec: FeatureSpec whose features are features of the spec of the dataset
+        :return: dataset with only the columns of the given spec, in its order
+        """
+        cols = np.array([self.feature_names.index(name) for name in spec.names], dtype=np.intp)
+        if isinstance(self.bits, SparseMatrix):
+            return Dataset(self.bits.select(cols), self.labels, self.n_rows, spec, self.source, self.is_test,
+                           self.input_format)
+        return Dataset(self.bits[:, cols], self.labels, self.n_rows, spec, self.source, self.is_test, self.input_format)
+
+    def column(self, feat_name):
+        """
+        unpacks a single feature
+
+        :param feat_name: name of the feature
+        :return: boolean array with the value of the feature for every row
+        """
+        index = self.feature_names.index(feat_name)
+        if isinstance(self.bits, SparseMatrix):
+            return self.bits.column(index)
+        return np.unpackbits(self.bits[:, index], count=self.n_rows).astype(bool)
+
+    def rows(self):
+        """
+        yields every row as a feature dictionary in the form made by Features.make_features,
+        without the sentence
+
+        :return: generator of dictionaries
+        """
+        for start in range(0, self.n_rows, CHUNK_SIZE):
+            indices = np.arange(start, min(start + CHUNK_SIZE, self.n_rows))
+            matrix = self.matrix(indices)
+            if isinstance(matrix, SparseMatrix):
+                matrix = matrix.toarray()
+            for i, values in zip(indices, matrix.astype(bool).tolist()):
+                row = dict(zip(self.feature_names, values))
+                if self.labels is not None:
+                    row["res"] = bool(self.labels[i])
+                yield row
+
+    def sentences(self):
+        """
+        reads the lowercased sentences back from the source file, in the input format it was read in
+
+        :return: generator of sentences
+        """
+        if self.source is None:
+            raise ValueError("dataset was not read from a file")
+        for line in ingest.read_lines(self.source, self.input_format, self.is_test):
+            yield parse_line(line, self.is_test)[1]
+
+
+def extract_matrix(lines, is_test=False, spec=DEFAULT_SPEC):
+    """
+    extracts the features of a list of lines
+
+    :param lines: list of lines
+    :param is_test: True if the lines do not have the language at the start
+    :param spec: FeatureSpec of the features which are extracted
+    :return:    boolean array of shape (lines, features), a SparseMatrix for a sparse spec
+                boolean array of the labels of the lines, None for test data
+    """
+    METRICS.count("features_computed", len(lines) * len(spec))
+    with METRICS.timer("extract"):
+        if spec.sparse:
+            labels, lines = zip(*[parse_line(line, is_test) for line in lines]) if lines else ((), ())
+            rows, cols = spec.extract_lines(lines)
+            labels = None if is_test else np.array(labels, dtype=bool)
+            return SparseMatrix.from_coordinates(rows, cols, len(lines), len(spec)), labels
+        matrix = []
+        labels = None if is_test else np.zeros(len(lines), dtype=bool)
+        for i, line in enumerate(lines):
+            res, line = parse_line(line, is_test)
+            matrix.append(spec.extract(line))
+            if labels is not None:
+                labels[i] = res
+        return np.array(matrix, dtype=bool).reshape(-1, len(spec)), labels
+
+
+def read_chunks(file, size=CHUNK_SIZE):
+    """
+    reads an open file in lists of lines
+
+    :param file: open text file
+    :param size: maximum number of lines in a list
+    :return: generator of lists of lines
+    """
+    lines = []
+    for line in file:
+        lines.append(line)
+        if len(lines) == size:
+            METRICS.count("lines_read", len(lines))
+            yield lines
+            lines = []
+    if lines:
+        METRICS.count("lines_read", len(lines))
+        yield lines
+
+
+def as_dataset(data):
+    """
+    :param data: Dataset or list of feature dictionaries
+    :return: Dataset
+    """
+    if isinstance(data, Dataset):
+        return data
+    return Dataset.from_rows(data)
@@ -1,20 +1,84 @@
 import math
+from concurrent.futures import ProcessPoolExecutor
 import numpy as np
+from dataset import Dataset, SparseMatrix
+from metrics import METRICS
+from model import TreeModel
 
 
 # maximum depth of the decision tree being created
 MAX_DEPTH = math.inf
+# fewest rows a node needs to be split
+MIN_SAMPLES_SPLIT = 2
+# fewest rows each side of a split needs
+MIN_SAMPLES_LEAF = 1
+# information gain a split needs to be made, only gains above it count
+MIN_GAIN = 0.0
+
+# rows multiplied at a time in label_counts, bounds the memory of the unpacked rows and their float copy
+COUNT_CHUNK_SIZE = 1 << 18
+
+# rows of a node from which the workers share its split search, smaller nodes are built as whole subtrees by one worker
+PARALLEL_MIN_ROWS = 1 << 16
+# rows of a subtree below which it is built in the main process, sending it to a worker costs more than building it
+SUBTREE_MIN_ROWS = 1 << 10
+
+# matrix and labels of the training data, set once in every tree building worker
+worker_matrix = None
+worker_labels = None
+
+
+class TreeParams:
+    """
+    limits on the growth of a decision tree, the defaults grow the tree until the leaves are pure
+    or no split has a positive gain
+    """
+    __slots__ = "max_depth", "min_samples_split", "min_samples_leaf", "min_gain"
+
+    def __init__(self, max_depth=MAX_DEPTH, min_samples_split=MIN_SAMPLES_SPLIT, min_samples_leaf=MIN_SAMPLES_LEAF,
+                 min_gain=MIN_GAIN):
+        """
+        :param max_depth: maximum depth of the tree
+        :param min_samples_split: fewest rows a node needs to be split
+        :param min_samples_leaf: fewest rows each side of a split needs
+        :param min_gain: information gain a split needs to be made, only gains above it count
+        """
+        self.max_depth = max_depth
+        self.min_samples_split = min_samples_split
+        self.min_samples_leaf = min_samples_leaf
+        self.min_gain = min_gain
+
+    @classmethod
+    def from_args(cls, args):
+        """
+        :param args: argparse namespace with an attribute for every limit, None keeps the default
+        :return: the params
+        """
+        params = cls()
+        for name in cls.__slots__:
+            if getattr(args, name) is not None:
+                setattr(params, name, getattr(args, name))
+        return params
+
+    def __repr__(self):
+        return "TreeParams(max_depth=%s, min_samples_split=%d, min_samples_leaf=%d, min_gain=%g)" % (
+            self.max_depth, self.min_samples_split, self.min_samples_leaf, self.min_gain)
+
+
+DEFAULT_PARAMS = TreeParams()
 
 
 def entropy(probability):
     """
     calculates the entropy given a probability of an event occurring
+    works element wise if probability is a numpy array
 
     :param probability: probability of an event occurring
     :return: corresponding entropy
     """
     q = 1 - probability
-    return -(probability * math.log(probability + np.finfo(float).eps, 2) + q * math.log(q + np.finfo(float).eps, 2))
+    return -(probability * (np.log(probability + np.finfo(float).eps) / math.log(2)) +
+             q * (np.log(q + np.finfo(float).eps) / math.log(2)))
 
 
 def split_by_feat(data_list, feat_name):
@@ -114,6 +178,131 @@ def remainder(feat_pos, feat_neg):
     return sum_prob
 
 
+def label_counts(matrix, labels, weights=None, rows=None):
+    """
+    counts the is_nl and is_en rows where each feature is True, using one matrix product
+    of the feature matrix with the label vectors
+
+    :param matrix: uint8 array of 0 and 1 with shape (rows, features), a PackedMatrix or a SparseMatrix
+    :param labels: boolean array, True for is_nl
+    :param weights: optional weight of every row, sums of weights are returned instead of counts
+    :param rows: optional integer array, only these rows are counted
+
+    :return: array of shape (features, 2), column 0 has the is_nl counts and column 1 the is_en counts
+    """
+    if isinstance(matrix, SparseMatrix):
+        return sparse_label_counts(matrix, labels, weights, rows)
+    count_rows = len(labels) if rows is None else len(rows)
+    counts = np.zeros((matrix.shape[1], 2))
+    for start in range(0, count_rows, COUNT_CHUNK_SIZE):
+        chunk = slice(start, start + COUNT_CHUNK_SIZE)
+        if rows is not None:
+            chunk = rows[chunk]
+        chunk_labels = labels[chunk]
+        targets = np.column_stack((chunk_labels, ~chunk_labels)).astype(float)
+        if weights is not None:
+            targets *= weights[chunk][:, None]
+        counts += matrix[chunk].T @ targets
+    return counts
+
+
+def sparse_label_counts(matrix, labels, weights=None, rows=None):
+    """
+    label_counts of a SparseMatrix, the label or weight of the row of every one is added to the count
+    of its column, so the work follows the number of ones of the rows and not the number of features
+
+    :param matrix: SparseMatrix
+    :param labels: boolean array, True for is_nl
+    :param weights: optional weight of every row
+    :param rows: optional integer array, only these rows are counted
+
+    :return: array of shape (features, 2), column 0 has the is_nl counts and column 1 the is_en counts
+    """
+    if rows is not None:
+        matrix = matrix.take(rows)
+        labels = labels[rows]
+        weights = None if weights is None else weights[rows]
+    row_labels = labels[matrix.row_ids()]
+    row_weights = np.ones(len(row_labels)) if weights is None else weights[matrix.row_ids()]
+    counts = np.empty((matrix.shape[1], 2))
+    counts[:, 0] = np.bincount(matrix.indices, row_weights * row_labels, minlength=matrix.shape[1])
+    counts[:, 1] = np.bincount(matrix.indices, row_weights * ~row_labels, minlength=matrix.shape[1])
+    return counts
+
+
+def information_gains(pos_counts, total_counts):
+    """
+    calculates the information gain of every feature from the label counts of the rows where it is True
+
+    :param pos_counts: array of shape (features, 2) from label_counts
+    :param total_counts: is_nl and is_en counts of all the rows
+
+    :return: array with the gain of every feature
+    """
+    total_counts = np.asarray(total_counts, dtype=float)
+    neg_counts = total_counts - pos_counts
+    count_all = total_counts.sum()
+    count_ratio_pos = pos_counts.sum(axis=1) / count_all
+    count_ratio_neg = neg_counts.sum(axis=1) / count_all
+    rem = count_ratio_pos * entropy(calculate_probability(pos_counts[:, 0], pos_counts[:, 1])) + \
+        count_ratio_neg * entropy(calculate_probability(neg_counts[:, 0], neg_counts[:, 1]))
+    return entropy(calculate_probability(total_counts[0], total_counts[1])) - rem
+
+
+def find_best_feature(matrix, labels, weights=None, rows=None, used=(), min_samples_leaf=MIN_SAMPLES_LEAF,
+                      min_gain=MIN_GAIN):
+    """
+    finds the column with the highest information gain, the first one is taken if there is a tie
+
+    :param matrix: uint8 array of 0 and 1 with shape (rows, features)
+    :param labels: boolean array, True for is_nl
+    :param weights: optional weight of every row
+    :param rows: optional integer array, only these rows are considered
+    :param used: indices of columns which can not be chosen
+    :param min_samples_leaf: fewest rows each side of the split needs
+    :param min_gain: information gain the split needs, only gains above it count
+
+    :return: index of the column, None if no split has a gain above min_gain
+    """
+    node_labels = labels if rows is None else labels[rows]
+    if not len(node_labels) or len(used) == matrix.shape[1]:
+        return None
+    if weights is None:
+        a_count = np.count_nonzero(node_labels)
+        total_counts = (a_count, len(node_labels) - a_count)
+    else:
+        node_weights = weights if rows is None else weights[rows]
+        a_count = np.dot(node_weights, node_labels)
+        total_counts = (a_count, np.sum(node_weights) - a_count)
+    return best_feature_of_counts(label_counts(matrix, labels, weights, rows), total_counts, used,
+                                  min_samples_leaf, min_gain)
+
+
+def best_feature_of_counts(pos_counts, total_counts, used=(), min_samples_leaf=MIN_SAMPLES_LEAF, min_gain=MIN_GAIN):
+    """
+    finds the feature with the highest information gain from the label counts of a node,
+    the first one is taken if there is a tie
+
+    :param pos_counts: array of shape (features, 2) from label_counts
+    :param total_counts: is_nl and is_en counts of all the rows of the node
+    :param used: indices of features which can not be chosen
+    :param min_samples_leaf: fewest rows each side of the split needs, with weights it is a weight
+    :param min_gain: information gain the split needs, only gains above it count
+
+    :return: index of the feature, None if no split has a gain above min_gain
+    """
+    gains = information_gains(pos_counts, total_counts)
+    gains[list(used)] = -np.inf
+    if min_samples_leaf > 1:
+        pos_rows = pos_counts.sum(axis=1)
+        neg_rows = np.sum(total_counts) - pos_rows
+        gains[(pos_rows < min_samples_leaf) | (neg_rows < min_samples_leaf)] = -np.inf
+    index = int(np.argmax(gains))
+    if gains[index] > min_gain:
+        return index
+    return None
+
+
 def find_feature_with_highest_information_gain(data_list):
     """
     calculates information gain for all possible feature splits and returns the name of the feature
@@ -123,22 +312,17 @@ def find_feature_with_highest_information_gain(data_list):
 
     :return: name of feature
     """
-    max_gain = 0
-    first_feat = None
-    gains = []
     if not data_list:
         return
-    for key in data_list[0].keys():
-        if key == "res" or key == "sent":
-            continue
-        feat_pos, feat_neg = split_by_feat(data_list, key)
-        a_prob = calculate_a_b_probability(data_list)
-        gain = calculate_gain(a_prob, feat_pos, feat_neg)
-        gains.append(gain)
-        if gain > max_gain:
-            max_gain = gain
-            first_feat = key
-    return first_feat
+    keys = [key for key in data_list[0].keys() if key != "res" and key != "sent"]
+    if not keys:
+        return
+    matrix = np.array([[row[key] for key in keys] for row in data_list], dtype=np.uint8)
+    labels = np.array([row["res"] for row in data_list], dtype=bool)
+    index = find_best_feature(matrix, labels)
+    if index is None:
+        return
+    return keys[index]
 
 
 def calculate_gain(a_prob, feat_pos, feat_neg):
@@ -172,95 +356,318 @@ def remove_feat(data_list, feat_name):
     return data_list
 
 
-def make_decision_tree(data_list):
+def make_decision_tree(data_list, workers=1, params=DEFAULT_PARAMS):
     """
-    setup function which creates the empty dictionary and calls the recursive method
-    data_process
+    setup function which creates the empty node list and calls the recursive method
+    data_process, or parallel_process with more than one worker
 
-    :param data_list: input data
+    :param data_list: input data, a Dataset or a list of feature dictionaries, it is not changed
+    :param workers: number of processes building the tree, the tree is the same for any number
+    :param params: TreeParams limiting the growth of the tree
 
-    :return: filled dictionary with the parent as the key and a list as the value
-    children are elements of the list
+    :return: TreeModel with the nodes of the tree
     """
-    feat_dict = {}
-    data_process(data_list, feat_dict, None, MAX_DEPTH)
+    if not isinstance(data_list, Dataset):
+        data_list = Dataset.from_rows(data_list)
+    nodes = []
+    rows = np.arange(len(data_list))
+    matrix = data_list.packed()
+    if workers > 1 and len(rows) >= SUBTREE_MIN_ROWS:
+        subtrees = {}
+        with ProcessPoolExecutor(workers, initializer=load_worker_data, initargs=(matrix, data_list.labels)) as executor:
+            parallel_process(executor, workers, matrix, data_list.labels, rows, frozenset(), nodes,
+                             params.max_depth, subtrees, params)
+            nodes = preorder(nodes, subtrees)
+    else:
+        data_process(matrix, data_list.labels, rows, frozenset(), nodes, params.max_depth, params)
 
-    return feat_dict
+    return TreeModel.from_nodes(nodes, data_list.spec)
 
 
-def data_process(data, feat_dict, parent_feat, depth):
+def partition(matrix, rows, feat_index):
     """
-    recursive function where the tree dictionary is populated
+    reorders rows in place so that the rows where the feature is True come first
 
-    :param data: input data
-    :param feat_dict: current state of dictionary
-    :param parent_feat: feature which you are finding children of
-    :param depth: depth levels left to explore, till we reach MAX_DEPTH
+    :param matrix: uint8 array of 0 and 1 with shape (rows, features), or a SparseMatrix
+    :param rows: integer array of row indices, changed in place
+    :param feat_index: column of the feature
 
-    :return: None
+    :return: number of rows where the feature is True
     """
+    is_pos = matrix[rows, feat_index].astype(bool)
+    feat_pos = rows[is_pos]
+    feat_neg = rows[~is_pos]
+    rows[:len(feat_pos)] = feat_pos
+    rows[len(feat_pos):] = feat_neg
+    return len(feat_pos)
 
-    feat_name = find_feature_with_highest_information_gain(data)
-    if feat_name is None:
-        return
-    if depth == 0:
-        return True
 
-    add_child(feat_dict, parent_feat, feat_name, len(data))
-    feat_pos, feat_neg = split_by_feat(data, feat_name)
-    prob_pos = calculate_a_b_probability(feat_pos)
-    prob_neg = calculate_a_b_probability(feat_neg)
+def data_process(matrix, labels, rows, used, nodes, depth, params=DEFAULT_PARAMS):
+    """
+    recursive function where the node list is populated
+    the rows of a node are a slice of one permutation array which is partitioned in place,
+    the matrix and labels are never changed
+
+    :param matrix: PackedMatrix or uint8 array of 0 and 1 with a column for every feature, or a SparseMatrix
+    :param labels: boolean array, True for is_nl
+    :param rows: integer array of the rows which reach this node
+    :param used: indices of features already used on the path to this node
+    :param nodes: list of [feature, left, right, value] lists, the new nodes are appended
+    :param depth: depth levels left to explore, till we reach the maximum depth
+    :param params: TreeParams limiting the growth of the tree
+
+    :return: index of the node made for rows
+    """
+
+    a_count = np.count_nonzero(labels[rows])
+    prob = calculate_probability(a_count, len(rows) - a_count)
+    feat_index = None
 
     # if we know the probability is 0 or 1, we can stop
 
-    if prob_pos != 0 and prob_pos != 1:
-        feat_pos = remove_feat(feat_pos, feat_name)
-        is_fin = data_process(feat_pos, feat_dict, feat_name, depth - 1)
-        if is_fin:
-            if prob_pos >= 0.5:
-                add_child(feat_dict, feat_name, "True", "is_nl")
-            else:
-                add_child(feat_dict, feat_name, "True", "is_en")
-
-    elif prob_pos == 1:
-        add_child(feat_dict, feat_name, "True", "is_nl")
-    else:
-        add_child(feat_dict, feat_name, "True", "is_en")
+    if prob != 0 and prob != 1 and depth != 0 and len(rows) >= params.min_samples_split:
+        with METRICS.timer("split_search"):
+            feat_index = find_best_feature(matrix, labels, rows=rows, used=used,
+                                           min_samples_leaf=params.min_samples_leaf, min_gain=params.min_gain)
+    METRICS.count("nodes_built")
+    node = len(nodes)
+    if feat_index is None:
+        nodes.append([-1, -1, -1, int(prob >= 0.5)])
+        return node
+
+    nodes.append([feat_index, -1, -1, -1])
+    count_pos = partition(matrix, rows, feat_index)
+    child_used = used | {feat_index}
+    nodes[node][1] = data_process(matrix, labels, rows[:count_pos], child_used, nodes, depth - 1, params)
+    nodes[node][2] = data_process(matrix, labels, rows[count_pos:], child_used, nodes, depth - 1, params)
+    return node
+
+
+def load_worker_data(matrix, labels):
+    """
+    initializer of the tree building workers
+    """
+    global worker_matrix, worker_labels
+    worker_matrix = matrix
+    worker_labels = labels
 
-    # if the probability is 0 or 1, we can stop
 
-    if prob_neg != 0 and prob_neg != 1:
-        feat_neg = remove_feat(feat_neg, feat_name)
-        is_fin = data_process(feat_neg, feat_dict, feat_name, depth - 1)
-        if is_fin:
-            if prob_neg >= 0.5:
-                add_child(feat_dict, feat_name, "False", "is_nl")
-            else:
-                add_child(feat_dict, feat_name, "False", "is_en")
+def count_shard(rows):
+    """
+    :param rows: integer array of rows of the worker data
+    :return: label_counts of the rows
+    """
+    return label_counts(worker_matrix, worker_labels, rows=rows)
 
-    elif prob_neg == 1:
-        add_child(feat_dict, feat_name, "False", "is_nl")
-    else:
-        add_child(feat_dict, feat_name, "False", "is_en")
 
+def build_subtree(rows, used, depth, params=DEFAULT_PARAMS):
+    """
+    builds a subtree of the worker data with data_process
 
-def add_child(feat_dict, parent_feat, child_feat, final_outcome):
+    :param rows: integer array of the rows which reach the root of the subtree
+    :param used: indices of features already used on the path to the root of the subtree
+    :param depth: depth levels left to explore
+    :param params: TreeParams limiting the growth of the tree
+    :return: list of [feature, left, right, value] lists, the root is node 0
     """
-    add child to the dictionary key specified in the parent_feat variable
+    nodes = []
+    data_process(worker_matrix, worker_labels, rows, used, nodes, depth, params)
+    return nodes
 
-    :param feat_dict: current tree dictionary
-    :param parent_feat: node to which children are being added
-    :param child_feat: node to which children are being added
-    :param final_outcome: result if child is chosen, can be is_nl or is_en
 
-    :return: None
+def parallel_best_feature(executor, workers, labels, rows, used, n_features, params=DEFAULT_PARAMS):
     """
+    find_best_feature with the counting shared by the workers, every worker counts a shard of the rows
+    for all the features and the shards are added up, the counts are whole numbers so the sum is exact
+    and the feature is the one find_best_feature finds
+
+    :param executor: ProcessPoolExecutor whose workers have the matrix and labels
+    :param workers: number of workers
+    :param labels: boolean array, True for is_nl
+    :param rows: integer array of the rows of the node
+    :param used: indices of features already used on the path to the node
+    :param n_features: number of features
+    :param params: TreeParams limiting the growth of the tree
+    :return: index of the feature, None if no split has a gain above the minimum
+    """
+    if len(used) == n_features:
+        return None
+    pos_counts = sum(executor.map(count_shard, np.array_split(rows, workers)))
+    a_count = np.count_nonzero(labels[rows])
+    return best_feature_of_counts(pos_counts, (a_count, len(rows) - a_count), used, params.min_samples_leaf,
+                                  params.min_gain)
 
-    append_string = child_feat
-    if child_feat == "True" or child_feat == "False":
-        append_string += ":" + final_outcome
-    if parent_feat not in feat_dict.keys():
-        feat_dict[parent_feat] = [append_string]
-    else:
-        feat_dict[parent_feat].append(append_string)
 
+def parallel_process(executor, workers, matrix, labels, rows, used, nodes, depth, subtrees, params=DEFAULT_PARAMS):
+    """
+    data_process with a pool of workers, nodes with at least PARALLEL_MIN_ROWS rows are split in the main process
+    with the counting shared by the workers, smaller nodes are built as whole subtrees by one worker each
+    while the main process goes on with the other nodes, and subtrees below SUBTREE_MIN_ROWS are built in place,
+    a subtree being built by a worker gets a None node and its future in subtrees
+
+    :param executor: ProcessPoolExecutor whose workers have the matrix and labels
+    :param workers: number of workers
+    :param matrix: uint8 array of 0 and 1 with a column for every feature, or a SparseMatrix
+    :param labels: boolean array, True for is_nl
+    :param rows: integer array of the rows which reach this node
+    :param used: indices of features already used on the path to this node
+    :param nodes: list of [feature, left, right, value] lists, the new nodes are appended
+    :param depth: depth levels left to explore
+    :param subtrees: dictionary of node index to the future of the nodes of its subtree, the new subtrees are added
+    :param params: TreeParams limiting the growth of the tree
+
+    :return: index of the node made for rows
+    """
+    if len(rows) < SUBTREE_MIN_ROWS:
+        return data_process(matrix, labels, rows, used, nodes, depth, params)
+    node = len(nodes)
+    if len(rows) < PARALLEL_MIN_ROWS:
+        subtrees[node] = executor.submit(build_subtree, rows, used, depth, params)
+        nodes.append(None)
+        return node
+
+    a_count = np.count_nonzero(labels[rows])
+    prob = calculate_probability(a_count, len(rows) - a_count)
+    feat_index = None
+    if prob != 0 and prob != 1 and depth != 0 and len(rows) >= params.min_samples_split:
+        with METRICS.timer("split_search"):
+            feat_index = parallel_best_feature(executor, workers, labels, rows, used, matrix.shape[1], params)
+    METRICS.count("nodes_built")
+    if feat_index is None:
+        nodes.append([-1, -1, -1, int(prob >= 0.5)])
+        return node
+
+    nodes.append([feat_index, -1, -1, -1])
+    count_pos = partition(matrix, rows, feat_index)
+    child_used = used | {feat_index}
+    nodes[node][1] = parallel_process(executor, workers, matrix, labels, rows[:count_pos], child_used, nodes,
+                                      depth - 1, subtrees, params)
+    nodes[node][2] = parallel_process(executor, workers, matrix, labels, rows[count_pos:], child_used, nodes,
+                                      depth - 1, subtrees, params)
+    return node
+
+
+def preorder(nodes, subtrees=None):
+    """
+    renumbers the nodes of a tree in the depth first order data_process makes them in, with the nodes of the
+    subtrees built elsewhere put in place of their node
+
+    :param nodes: list of [feature, left, right, value] lists, node 0 is the root
+    :param subtrees: optional dictionary of node index to the nodes of its subtree, or a future of them,
+                     the nodes of a subtree are in depth first order with its root as node 0
+    :return: list of [feature, left, right, value] lists in depth first order
+    """
+    subtrees = subtrees or {}
+    ordered = []
+
+    def add_node(node):
+        index = len(ordered)
+        if node in subtrees:
+            subtree = subtrees[node]
+            if not isinstance(subtree, list):
+                subtree = subtree.result()
+            for feature, left, right, value in subtree:
+                if feature >= 0:
+                    left += index
+                    right += index
+                ordered.append([feature, left, right, value])
+            return index
+        feature, left, right, value = nodes[node]
+        ordered.append([feature, -1, -1, value])
+        if feature >= 0:
+            ordered[index][1] = add_node(left)
+            ordered[index][2] = add_node(right)
+        return index
+
+    add_node(0)
+    return ordered
+
+
+def node_order(model):
+    """
+    :param model: TreeModel
+    :return: list of the nodes reachable from the root, every node comes before its children
+    """
+    order = []
+    stack = [0]
+    while stack:
+        node = stack.pop()
+        order.append(node)
+        if model.feature[node] >= 0:
+            stack.extend((int(model.right[node]), int(model.left[node])))
+    return order
+
+
+def node_counts(model, chunks):
+    """
+    counts the is_nl and is_en rows which pass through every node of a tree, the rows are walked to their leaf
+    once and the counts of the leaves are added up to the root
+
+    :param model: TreeModel
+    :param chunks: iterable of (matrix, labels) pairs, like data.chunks()
+    :return: array of shape (nodes, 2) with the is_nl and is_en count of every node
+    """
+    counts = np.zeros((len(model.feature), 2))
+    for matrix, labels in chunks:
+        leaves = model.leaves(matrix)
+        labels = np.asarray(labels, dtype=bool)
+        counts[:, 0] += np.bincount(leaves[labels], minlength=len(counts))
+        counts[:, 1] += np.bincount(leaves[~labels], minlength=len(counts))
+    for node in reversed(node_order(model)):
+        if model.feature[node] >= 0:
+            counts[node] = counts[model.left[node]] + counts[model.right[node]]
+    return counts
+
+
+def prune_tree(model, train_counts, validation_counts):
+    """
+    reduced error pruning, going up from the leaves a node becomes a leaf when that makes no more mistakes
+    on the held out rows than its subtree, the leaf gets the label data_process would have given it
+    everything comes from the counts of node_counts, so no row is looked at again for any candidate
+
+    :param model: TreeModel
+    :param train_counts: node_counts of the training data
+    :param validation_counts: node_counts of the held out data
+    :return: TreeModel of the pruned tree
+    """
+    value = np.where(model.feature < 0, model.value,
+                     calculate_probability(train_counts[:, 0], train_counts[:, 1]) >= 0.5).astype(int)
+    leaf_errors = np.where(value == 1, validation_counts[:, 1], validation_counts[:, 0])
+    subtree_errors = leaf_errors.copy()
+    nodes = [[int(model.feature[node]), int(model.left[node]), int(model.right[node]), int(model.value[node])]
+             for node in range(len(model.feature))]
+    for node in reversed(node_order(model)):
+        feature, left, right, _ = nodes[node]
+        if feature < 0:
+            continue
+        subtree_errors[node] = subtree_errors[left] + subtree_errors[right]
+        if leaf_errors[node] <= subtree_errors[node]:
+            nodes[node] = [-1, -1, -1, int(value[node])]
+            subtree_errors[node] = leaf_errors[node]
+    return TreeModel.from_nodes(preorder(nodes), model.spec)
+
+
+def truncate_tree(model, max_depth, train_counts):
+    """
+    cuts a tree at a depth, the nodes at max_depth become leaves with the label data_process would have given them,
+    split choices do not depend on the depth left, so the tree is the one make_decision_tree builds with max_depth
+
+    :param model: TreeModel
+    :param max_depth: depth of the new leaves
+    :param train_counts: node_counts of the training data of the tree
+    :return: TreeModel of the cut tree
+    """
+    value = calculate_probability(train_counts[:, 0], train_counts[:, 1]) >= 0.5
+    nodes = [[int(model.feature[node]), int(model.left[node]), int(model.right[node]), int(model.value[node])]
+             for node in range(len(model.feature))]
+    stack = [(0, 0)]
+    while stack:
+        node, depth = stack.pop()
+        feature, left, right, _ = nodes[node]
+        if feature < 0:
+            continue
+        if depth >= max_depth:
+            nodes[node] = [-1, -1, -1, int(value[node])]
+            continue
+        stack.extend(((right, depth + 1), (left, depth + 1)))
+    return TreeModel.from_nodes(preorder(nodes), model.spec)
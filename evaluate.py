@@ -0,0 +1,234 @@
+import argparse
+import json
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import adaboost as ada
+import decision_tree as dt
+import ingest
+import store
+from make_features import DEFAULT_SPEC, FeatureSpec
+from model import predict_batch
+
+
+# number of folds when none is given
+FOLDS = 5
+LEARNERS = ("dt", "ada")
+# order of the cells of a confusion matrix, true language first, predicted language second
+CELLS = ("nl_nl", "nl_en", "en_nl", "en_en")
+
+# dataset shared by the fold workers, and by the workers of search.py
+worker_data = None
+
+
+def load_worker_data(data):
+    """
+    initializer of the fold workers and of the search workers
+    """
+    global worker_data
+    worker_data = data
+
+
+def fold_indices(n_rows, folds=FOLDS, seed=0):
+    """
+    :param n_rows: number of rows
+    :param folds: number of folds
+    :param seed: seed of the shuffle, the same seed gives the same folds
+    :return: list of integer arrays, the rows held out in every fold, in increasing order
+    """
+    order = np.random.RandomState(seed).permutation(n_rows)
+    return [np.sort(rows) for rows in np.array_split(order, folds)]
+
+
+def confusion(labels, predictions):
+    """
+    :param labels: boolean array, True for is_nl
+    :param predictions: boolean array, True for is_nl
+    :return: dictionary with the number of rows of every cell of CELLS
+    """
+    counts = np.bincount((~labels).astype(np.intp) * 2 + (~predictions), minlength=4)
+    return dict(zip(CELLS, counts.tolist()))
+
+
+def scores(cells):
+    """
+    :param cells: confusion dictionary
+    :return: dictionary with the accuracy and the precision and recall of both languages
+    """
+    def ratio(part, whole):
+        return part / whole if whole else 0.0
+
+    total = sum(cells.values())
+    return {"accuracy": ratio(cells["nl_nl"] + cells["en_en"], total),
+            "nl_precision": ratio(cells["nl_nl"], cells["nl_nl"] + cells["en_nl"]),
+            "nl_recall": ratio(cells["nl_nl"], cells["nl_nl"] + cells["nl_en"]),
+            "en_precision": ratio(cells["en_en"], cells["en_en"] + cells["nl_en"]),
+            "en_recall": ratio(cells["en_en"], cells["en_en"] + cells["en_nl"])}
+
+
+def run_fold(learn_type, fold, test_rows, rounds=ada.NUMBER_OF_STUMPS, params=dt.DEFAULT_PARAMS):
+    """
+    trains a model on the rows of worker_data outside the fold and scores the rows of the fold
+
+    :param learn_type: dt or ada
+    :param fold: number of the fold
+    :param test_rows: integer array of the rows held out
+    :param rounds: number of adaboost stumps
+    :param params: TreeParams of the decision tree
+    :return: dictionary with the fold, its confusion cells, its scores and the seconds of training and scoring
+    """
+    is_test = np.zeros(len(worker_data), dtype=bool)
+    is_test[test_rows] = True
+    train = worker_data.take(np.flatnonzero(~is_test))
+    start = time.perf_counter()
+    if learn_type == "dt":
+        model = dt.make_decision_tree(train, params=params)
+    else:
+        model = ada.make_stumps(train, rounds)
+    train_seconds = time.perf_counter() - start
+    start = time.perf_counter()
+    predictions = predict_batch(model, worker_data.matrix(test_rows))
+    score_seconds = time.perf_counter() - start
+    cells = confusion(worker_data.labels[test_rows], predictions)
+    result = {"learner": learn_type, "fold": fold, "train_rows": len(train), "test_rows": len(test_rows),
+              "train_seconds": train_seconds, "score_seconds": score_seconds, "confusion": cells}
+    result.update(scores(cells))
+    return result
+
+
+def cross_validate(data, learners=LEARNERS, folds=FOLDS, rounds=ada.NUMBER_OF_STUMPS, params=dt.DEFAULT_PARAMS,
+                   workers=1, seed=0):
+    """
+    k-fold cross validation of the learners on one extracted dataset, every fold of every learner is a job and
+    the jobs run in a pool of processes which get the dataset once
+
+    :param data: Dataset with labels
+    :param learners: dt and ada
+    :param folds: number of folds
+    :param rounds: number of adaboost stumps
+    :param params: TreeParams of the decision tree
+    :param workers: number of processes, the jobs run in this process if 1
+    :param seed: seed of the shuffle which makes the folds
+    :return: list of the results of run_fold, by learner and fold
+    """
+    jobs = [(learn_type, fold, test_rows, rounds, params)
+            for learn_type in learners for fold, test_rows in enumerate(fold_indices(len(data), folds, seed))]
+    if workers <= 1:
+        load_worker_data(data)
+        try:
+            return [run_fold(*job) for job in jobs]
+        finally:
+            load_worker_data(None)
+    with ProcessPoolExecutor(workers, initializer=load_worker_data, initargs=(data,)) as executor:
+        futures = [executor.submit(run_fold, *job) for job in jobs]
+        return [future.result() for future in futures]
+
+
+def summary(results):
+    """
+    :param results: list of the results of run_fold
+    :return: dictionary of every learner with its cells added up over the folds, their scores and the mean and
+             standard deviation of the accuracy of the folds
+    """
+    learners = {}
+    for result in results:
+        learner = learners.setdefault(result["learner"], {"confusion": dict.fromkeys(CELLS, 0), "accuracies": [],
+                                                          "train_seconds": 0.0, "score_seconds": 0.0})
+        for cell in CELLS:
+            learner["confusion"][cell] += result["confusion"][cell]
+        learner["accuracies"].append(result["accuracy"])
+        learner["train_seconds"] += result["train_seconds"]
+        learner["score_seconds"] += result["score_seconds"]
+    for learner in learners.values():
+        learner.update(scores(learner["confusion"]))
+        accuracies = learner.pop("accuracies")
+        learner["accuracy_mean"] = float(np.mean(accuracies))
+        learner["accuracy_std"] = float(np.std(accuracies))
+    return learners
+
+
+def format_report(results):
+    """
+    :param results: list of the results of run_fold
+    :return: table of the folds and the summary of every learner
+    """
+    header = "%-8s %5s %9s %8s %8s %8s %8s %8s %9s %9s" % (
+        "learner", "fold", "rows", "accuracy", "nl prec", "nl rec", "en prec", "en rec", "train s", "score s")
+    lines = [header, "-" * len(header)]
+    for result in results:
+        lines.append("%-8s %5d %9d %8.4f %8.4f %8.4f %8.4f %8.4f %9.3f %9.3f" % (
+            result["learner"], result["fold"], result["test_rows"], result["accuracy"], result["nl_precision"],
+            result["nl_recall"], result["en_precision"], result["en_recall"], result["train_seconds"],
+            result["score_seconds"]))
+    lines.append("-" * len(header))
+    learners = summary(results)
+    for name, learner in learners.items():
+        lines.append("%-8s %5s %9d %8.4f %8.4f %8.4f %8.4f %8.4f %9.3f %9.3f" % (
+            name, "all", sum(learner["confusion"].values()), learner["accuracy"], learner["nl_precision"],
+            learner["nl_recall"], learner["en_precision"], learner["en_recall"], learner["train_seconds"],
+            learner["score_seconds"]))
+    for name, learner in learners.items():
+        cells = learner["confusion"]
+        lines.append("%s: accuracy %.4f +- %.4f over the folds, true nl predicted nl %d en %d, "
+                     "true en predicted nl %d en %d" % (name, learner["accuracy_mean"], learner["accuracy_std"],
+                                                         cells["nl_nl"], cells["nl_en"], cells["en_nl"],
+                                                         cells["en_en"]))
+    return "\n".join(lines)
+
+
+def main():
+    """
+    cross validates the decision tree and adaboost on a labelled file and prints the scores of every fold
+    the features are extracted once and every fold trains on the other folds
+
+    :return: None
+    """
+    parser = argparse.ArgumentParser(description="k-fold cross validation of the decision tree and adaboost")
+    parser.add_argument("examples", help="file with the labelled data")
+    parser.add_argument("--folds", type=int, default=FOLDS, help="number of folds")
+    parser.add_argument("--learners", default=",".join(LEARNERS), help="comma separated learners, dt and ada")
+    parser.add_argument("--rounds", type=int, default=ada.NUMBER_OF_STUMPS, help="number of adaboost stumps")
+    parser.add_argument("--max-depth", type=int, help="maximum depth of the decision tree")
+    parser.add_argument("--min-samples-split", type=int, help="fewest rows a node of the decision tree needs to split")
+    parser.add_argument("--min-samples-leaf", type=int, help="fewest rows each side of a split needs")
+    parser.add_argument("--min-gain", type=float, help="information gain a split needs, only gains above it count")
+    parser.add_argument("--workers", type=int, default=1, help="number of processes running the folds")
+    parser.add_argument("--seed", type=int, default=0, help="seed of the shuffle which makes the folds")
+    parser.add_argument("--features", metavar="SPEC", help="json file declaring the features, see features.json")
+    parser.add_argument("--input-format", choices=ingest.FORMATS, help="layout of the lines")
+    parser.add_argument("--label-field", help="tsv column or jsonl key with the language")
+    parser.add_argument("--text-field", help="tsv column or jsonl key with the text")
+    parser.add_argument("--feature-store", action="store_true", help="read the features from the store of examples")
+    parser.add_argument("--output", help="json file the results of every fold are written to")
+    args = parser.parse_args()
+
+    learners = tuple(args.learners.split(","))
+    if not learners or any(learner not in LEARNERS for learner in learners):
+        parser.error("--learners has to list dt and ada")
+    if args.folds < 2:
+        parser.error("--folds has to be at least 2")
+    spec = FeatureSpec.from_file(args.features) if args.features else DEFAULT_SPEC
+    input_format = ingest.InputFormat.for_file(args.examples, args.input_format, args.label_field, args.text_field)
+    params = dt.TreeParams.from_args(args)
+
+    start = time.perf_counter()
+    if args.feature_store:
+        data = store.load_dataset(args.examples, None, spec, input_format, args.workers)
+    else:
+        data = store.read_corpus(args.examples, args.workers, spec, input_format)
+    if len(data) < args.folds:
+        sys.exit("%d rows can not be split in %d folds" % (len(data), args.folds))
+    print("read %d rows in %.2fs" % (len(data), time.perf_counter() - start))
+    start = time.perf_counter()
+    results = cross_validate(data, learners, args.folds, args.rounds, params, args.workers, args.seed)
+    print(format_report(results))
+    print("cross validated in %.2fs" % (time.perf_counter() - start))
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump({"examples": args.examples, "folds": args.folds, "rounds": args.rounds, "seed": args.seed,
+                       "params": repr(params), "results": results, "summary": summary(results)}, file, indent=2)
+
+
+if __name__ == "__main__":
+    main()
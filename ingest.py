@@ -0,0 +1,273 @@
+import bz2
+import gzip
+import json
+import locale
+import lzma
+import os
+import sys
+from itertools import islice
+from metrics import METRICS
+
+
+# encoding used by open() for the text files everywhere else
+ENCODING = locale.getpreferredencoding(False)
+
+# bytes of a plain file read and decoded at a time
+BLOCK_SIZE = 1 << 23
+# lines handed on together when no batch size is given
+BATCH_SIZE = 1 << 16
+
+# first bytes of the compressed formats and the module which opens them
+COMPRESSED = ((b"\x1f\x8b", gzip), (b"BZh", bz2), (b"\xfd7zXZ\x00", lzma))
+COMPRESSED_EXTENSIONS = (".gz", ".bz2", ".xz")
+
+FORMATS = ("prefix", "tsv", "jsonl")
+# label and text fields of a format when none are given
+DEFAULT_FIELDS = {"tsv": ("0", "1"), "jsonl": ("label", "text")}
+# values of the label field which mean dutch and english, compared lowercased
+NL_LABELS = ("nl", "is_nl", "dutch")
+EN_LABELS = ("en", "is_en", "english")
+
+
+class InputFormat:
+    """
+    layout of the lines of a corpus
+    prefix: the language and a | before the text, "nl|de kat", the format of train.dat
+    tsv: tab separated columns, fields are column numbers from 0, or names of the columns of a header line,
+         with numbers a first line whose label column is not a language is taken for a header and skipped
+    jsonl: a json object per line, fields are keys
+    """
+    __slots__ = "kind", "label_field", "text_field"
+
+    def __init__(self, kind="prefix", label_field=None, text_field=None):
+        """
+        :param kind: prefix, tsv or jsonl
+        :param label_field: field with the language, the default of the kind if None
+        :param text_field: field with the text, the default of the kind if None
+        """
+        if kind not in FORMATS:
+            raise ValueError("input format has to be one of %s, not %s" % (", ".join(FORMATS), kind))
+        default_label, default_text = DEFAULT_FIELDS.get(kind, (None, None))
+        self.kind = kind
+        self.label_field = default_label if label_field is None else label_field
+        self.text_field = default_text if text_field is None else text_field
+
+    @classmethod
+    def for_file(cls, file_name, kind=None, label_field=None, text_field=None):
+        """
+        :param file_name: name of the corpus, the kind is guessed from its extension if not given
+        :param kind: prefix, tsv or jsonl, or None
+        :param label_field: field with the language
+        :param text_field: field with the text
+        :return: the format
+        """
+        if kind is None:
+            root, extension = os.path.splitext(file_name)
+            if extension in COMPRESSED_EXTENSIONS:
+                extension = os.path.splitext(root)[1]
+            kind = {".tsv": "tsv", ".jsonl": "jsonl"}.get(extension, "prefix")
+        return cls(kind, label_field, text_field)
+
+
+DEFAULT_FORMAT = InputFormat()
+
+
+def compression_of(file_name):
+    """
+    :param file_name: name of the file
+    :return: module which decompresses the file, gzip, bz2 or lzma, None for a plain file or standard input
+    """
+    if file_name == "-":
+        return None
+    with open(file_name, "rb") as file:
+        start = file.read(6)
+    for magic, module in COMPRESSED:
+        if start.startswith(magic):
+            return module
+    return None
+
+
+def is_plain(file_name, input_format=DEFAULT_FORMAT):
+    """
+    :return: True if the file can be split in byte ranges of prefix lines, like parallel.line_shards does
+    """
+    return file_name != "-" and input_format.kind == "prefix" and compression_of(file_name) is None
+
+
+def open_text(file_name, encoding=ENCODING):
+    """
+    opens a corpus for reading lines, compressed files are decompressed as they are read and plain files get a
+    buffer of BLOCK_SIZE bytes, so the text is decoded a large block at a time by the io module,
+    which splits lines faster than memory mapping the file and splitting the blocks in python does
+
+    :param file_name: name of a plain, gzip, bz2 or xz file, - for standard input
+    :param encoding: encoding of the file
+    :return: open text file, lines keep their newline like with open()
+    """
+    if file_name == "-":
+        return open(sys.stdin.fileno(), encoding=encoding, buffering=BLOCK_SIZE, closefd=False)
+    module = compression_of(file_name)
+    if module is not None:
+        return module.open(file_name, "rt", encoding=encoding)
+    return open(file_name, encoding=encoding, buffering=BLOCK_SIZE)
+
+
+def language_prefix(value):
+    """
+    :param value: value of a label field
+    :return: nl| or en|, None if the value is not a language
+    """
+    label = str(value).strip().lower()
+    if label in NL_LABELS:
+        return "nl|"
+    if label in EN_LABELS:
+        return "en|"
+    return None
+
+
+def field_reader(input_format, is_test=False):
+    """
+    :param input_format: InputFormat of the lines
+    :param is_test: True to keep only the text
+    :return: function which turns a list of lines into lines in the prefix format, or texts with is_test,
+             None for the prefix format, whose lines are used as they are
+    """
+    if input_format.kind == "prefix":
+        return None
+    state = {"columns": None}
+
+    def label_prefix(value, line):
+        prefix = language_prefix(value)
+        if prefix is None:
+            raise ValueError("unknown language %r in %r" % (value, line))
+        return prefix
+
+    def label_cell(fields):
+        column = state["columns"][0]
+        return fields[column] if column < len(fields) else ""
+
+    def is_header(fields, following):
+        """
+        with column numbers, the first line is a header when its label cell is not a language,
+        for test data the labels may be missing altogether, so the next line also has to have a language
+        """
+        if language_prefix(label_cell(fields)) is not None:
+            return False
+        if not is_test:
+            return True
+        return bool(following) and language_prefix(label_cell(following[0].rstrip("\r\n").split("\t"))) is not None
+
+    def convert_tsv(lines):
+        converted = []
+        for index, line in enumerate(lines):
+            fields = line.rstrip("\r\n").split("\t")
+            if state["columns"] is None:
+                names = (input_format.label_field, input_format.text_field)
+                if all(name.isdigit() for name in names):
+                    state["columns"] = [int(name) for name in names]
+                    if is_header(fields, lines[index + 1:index + 2]):
+                        continue
+                else:
+                    # test data needs no language column
+                    names = (None if is_test else names[0], names[1])
+                    for name in names:
+                        if name is not None and not name.isdigit() and name not in fields:
+                            raise ValueError("no column %s in the header %r" % (name, line))
+                    state["columns"] = [None if name is None else int(name) if name.isdigit() else fields.index(name)
+                                        for name in names]
+                    continue
+            label_column, text_column = state["columns"]
+            text = fields[text_column] + "\n"
+            converted.append(text if is_test else label_prefix(fields[label_column], line) + text)
+        return converted
+
+    def convert_jsonl(lines):
+        converted = []
+        for line in lines:
+            if not line.strip():
+                continue
+            row = json.loads(line)
+            text = str(row[input_format.text_field]).replace("\r", " ").replace("\n", " ") + "\n"
+            converted.append(text if is_test else label_prefix(row[input_format.label_field], line) + text)
+        return converted
+
+    return convert_tsv if input_format.kind == "tsv" else convert_jsonl
+
+
+def convert_lines(lines, input_format=DEFAULT_FORMAT, is_test=False):
+    """
+    turns lines which are read one at a time, like the lines of standard input, into the prefix format
+
+    :param lines: iterable of lines
+    :param input_format: InputFormat of the lines
+    :param is_test: with tsv and jsonl, True to give only the texts
+    :return: generator of lines
+    """
+    convert = field_reader(input_format, is_test)
+    if convert is None:
+        yield from lines
+        return
+    lines = iter(lines)
+    # the first two lines go together, so a tsv header can be told from data
+    yield from convert(list(islice(lines, 2)))
+    for line in lines:
+        yield from convert([line])
+
+
+def line_blocks(file_name, input_format=DEFAULT_FORMAT, is_test=False, size=BATCH_SIZE, encoding=ENCODING):
+    """
+    :param file_name: name of a plain, gzip, bz2 or xz file, - for standard input
+    :param input_format: InputFormat of the lines
+    :param is_test: with tsv and jsonl, True to give only the texts, which are then read with is_test
+    :param size: number of lines of the file read at a time
+    :param encoding: encoding of the file
+    :return: generator of lists of lines in the prefix format, tsv headers and empty jsonl lines leave them shorter
+    """
+    convert = field_reader(input_format, is_test)
+    with open_text(file_name, encoding) as file:
+        while True:
+            lines = list(islice(file, size))
+            if not lines:
+                return
+            yield lines if convert is None else convert(lines)
+
+
+def read_batches(file_name, input_format=DEFAULT_FORMAT, is_test=False, batch_size=BATCH_SIZE, encoding=ENCODING):
+    """
+    reads a corpus in lists of lines, the lines of the tsv and jsonl formats are turned into lines of the prefix
+    format, so the lists can go straight to feature extraction
+
+    :param file_name: name of a plain, gzip, bz2 or xz file, - for standard input
+    :param input_format: InputFormat of the lines
+    :param is_test: with tsv and jsonl, True to give only the texts, which are then read with is_test
+    :param batch_size: number of lines in every list but the last
+    :param encoding: encoding of the file
+    :return: generator of lists of lines
+    """
+    pending = []
+    for lines in line_blocks(file_name, input_format, is_test, batch_size, encoding):
+        if not pending and len(lines) == batch_size:
+            METRICS.count("lines_read", batch_size)
+            yield lines
+            continue
+        pending.extend(lines)
+        if len(pending) < batch_size:
+            continue
+        full = len(pending) - len(pending) % batch_size
+        for start in range(0, full, batch_size):
+            METRICS.count("lines_read", batch_size)
+            yield pending[start:start + batch_size]
+        pending = pending[full:]
+    if pending:
+        METRICS.count("lines_read", len(pending))
+        yield pending
+
+
+def read_lines(file_name, input_format=DEFAULT_FORMAT, is_test=False, encoding=ENCODING):
+    """
+    lines of read_batches one by one, for readers which make their own batches and count the lines read
+
+    :return: generator of lines
+    """
+    for lines in line_blocks(file_name, input_format, is_test, encoding=encoding):
+        yield from lines
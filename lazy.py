@@ -0,0 +1,86 @@
+import numpy as np
+from adaboost import ConfidenceScorer
+from make_features import LazyFeatures, parse_line
+from metrics import METRICS
+from model import TreeModel
+
+
+class LazyPredicter:
+    """
+    predicts lines computing only the features the model looks at
+    a tree computes the features on the path the line takes, adaboost computes the features with a weight,
+    largest weight first, and stops once the label is known unless the exact margin is asked for
+    """
+    __slots__ = "spec", "scorer", "feature", "left", "right", "value"
+
+    def __init__(self, model, confidence=False):
+        """
+        :param model: TreeModel or BoostModel
+        :param confidence: True if the exact adaboost margin is needed, which turns off the early exit
+        """
+        self.spec = model.spec
+        self.scorer = None
+        if isinstance(model, TreeModel):
+            self.feature = model.feature.tolist()
+            self.left = model.left.tolist()
+            self.right = model.right.tolist()
+            self.value = model.value.tolist()
+        else:
+            self.scorer = ConfidenceScorer(model, early_exit=not confidence)
+
+    def margin(self, features):
+        """
+        :param features: LazyFeatures of a line
+        :return: adaboost margin of the line, positive for is_nl
+        """
+        return self.scorer.decide(features)[1]
+
+    def predict(self, features):
+        """
+        :param features: LazyFeatures of a line
+        :return: True for is_nl
+        """
+        if self.scorer is not None:
+            return self.margin(features) > 0
+        node = 0
+        feature = self.feature
+        while feature[node] >= 0:
+            if features[feature[node]]:
+                node = self.left[node]
+            else:
+                node = self.right[node]
+        return self.value[node] == 1
+
+    def predict_lines(self, lines, is_test=False):
+        """
+        :param lines: list of lines
+        :param is_test: True if the lines do not have the language at the start
+        :return: boolean array, True for is_nl
+        """
+        features = [LazyFeatures(parse_line(line, is_test)[1], self.spec) for line in lines]
+        with METRICS.timer("predict"):
+            predictions = np.array([self.predict(line_features) for line_features in features], dtype=bool)
+        self.count(features)
+        return predictions
+
+    def margins_lines(self, lines, is_test=False):
+        """
+        :param lines: list of lines
+        :param is_test: True if the lines do not have the language at the start
+        :return: array of adaboost margins
+        """
+        features = [LazyFeatures(parse_line(line, is_test)[1], self.spec) for line in lines]
+        with METRICS.timer("predict"):
+            margins = np.array([self.margin(line_features) for line_features in features], dtype=float)
+        self.count(features)
+        return margins
+
+    @staticmethod
+    def count(features):
+        """
+        :param features: list of the LazyFeatures of the lines predicted
+        :return: None
+        """
+        if METRICS.enabled:
+            METRICS.count("lines_predicted", len(features))
+            METRICS.count("features_computed", sum(line_features.computed() for line_features in features))
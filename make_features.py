@@ -1,3 +1,516 @@
+import functools
+import hashlib
+import json
+import numpy as np
+
+
+# characters with an accent, circumflex and graves are left out as they are used with loan words,
+# and dutch, as well as english have loan words
+ACCENT_CHARS = frozenset(chr(o) for o in [193, 196, 201, 203, 205, 207, 211, 214, 218, 220, 221, 225, 228, 233,
+                                          235, 237, 239, 243, 246, 250, 252, 253, 255])
+
+# dutch prepositions which are not also english words
+DUTCH_PREPOSITIONS = ["naar", "voor", "achter", "naast", "beneden", "boven", "onder", "op", "tussen", "het midden",
+                      "bij", "binnen", "buiten", "tegen", "rond", "sinds", "zonder", "na", "om"]
+
+ENGLISH_PREPOSITIONS = ["with", "from", "to", "in front of", "behind", "next to", "down", "downstairs",
+                        "above", "upstairs", "below", "on top", "between", "middle", "about", "over", "near",
+                        "inside", "outside", "against", "around", "since", "without", "before", "after"]
+
+# features used when no feature spec is given, in the order of every feature vector,
+# a keyword feature is True if one of its words is surrounded by spaces in the line
+# and a charset feature is True if the line has one of its characters
+DEFAULT_FEATURES = [{"name": "nl_article", "type": "keyword", "words": ["het", "de"]},
+                    {"name": "nl_prepos", "type": "keyword", "words": DUTCH_PREPOSITIONS},
+                    {"name": "en_article", "type": "keyword", "words": ["the", "a", "an"]},
+                    {"name": "en_prepos", "type": "keyword", "words": ENGLISH_PREPOSITIONS},
+                    {"name": "accent", "type": "charset", "chars": "".join(sorted(ACCENT_CHARS))},
+                    {"name": "als_present", "type": "keyword", "words": ["als"]},
+                    {"name": "as_present", "type": "keyword", "words": ["as"]},
+                    {"name": "dat_present", "type": "keyword", "words": ["dat"]},
+                    {"name": "that_present", "type": "keyword", "words": ["that"]},
+                    {"name": "also_present", "type": "keyword", "words": ["also"]},
+                    ]
+
+# shortest and longest character ngram of hashed_ngrams features
+HASH_MIN_N = 1
+HASH_MAX_N = 4
+
+# multiplier of the rolling hash of the characters of an ngram, and the multiplier which spreads the hashes
+# over the buckets, both odd so the uint32 multiplications lose no bits
+HASH_MULTIPLIER = np.uint32(0x01000193)
+HASH_MIXER = np.uint32(0x9E3779B1)
+
+# order of the features in Features.features and in every feature vector of the default spec
+FEATURE_NAMES = tuple(feature["name"] for feature in DEFAULT_FEATURES)
+
+
+def check_strings(definition, key):
+    """
+    :param definition: feature dictionary
+    :param key: key of a list of strings in the definition, like words or ngrams
+    :return: None, raises a ValueError if the value is not a list of strings which are not empty
+    """
+    values = definition[key]
+    if not isinstance(values, list) or not all(isinstance(value, str) and value for value in values):
+        raise ValueError("feature %s needs a list of %s, strings which are not empty" % (definition["name"], key))
+
+
+def lowercase(values):
+    """
+    :param values: list of words, phrases or ngrams of a definition
+    :return: the values lowercased, lines are lowercased before they are matched, so capitals would never match
+    """
+    return [value.lower() for value in values]
+
+
+def compile_keywords(keyword_features):
+    """
+    builds the lookup tables of the keyword matcher
+    single words go in a table of word -> feature indices, phrases are keyed by their first word
+    and are confirmed with a search of the whole phrase
+
+    :param keyword_features: list of (feature index, list of words) pairs
+    :return:    word_table: dictionary of word to tuple of feature indices
+                phrase_table: dictionary of first word to list of (" phrase ", feature index)
+    """
+    word_table = {}
+    phrase_table = {}
+    for index, words in keyword_features:
+        for word in words:
+            if " " in word:
+                phrase_table.setdefault(word.split(" ")[0], []).append((" " + word + " ", index))
+            elif index not in word_table.get(word, ()):
+                word_table[word] = word_table.get(word, ()) + (index,)
+    return word_table, phrase_table
+
+
+def keyword_evaluator(words):
+    """
+    makes a function which checks a line for a list of words the same way the keyword matcher does,
+    with one search per word which stops at the first hit
+
+    :param words: list of words and phrases
+    :return: function of a lowercased line which returns True if one of the words is surrounded by spaces
+    """
+    test_terms = tuple(" " + word + " " for word in words)
+
+    def evaluate(line):
+        for test_term in test_terms:
+            if line.find(test_term) != -1:
+                return True
+        return False
+    return evaluate
+
+
+class Matcher:
+    """
+    matcher of a type of feature, it is made from all the features of its type in a spec
+    and finds the columns which are True for a line
+    """
+    __slots__ = ()
+    # key every definition of the type needs
+    key = None
+    # True if the type makes so many columns that rows are kept as the indices of their True columns
+    sparse = False
+
+    @staticmethod
+    def columns(definition):
+        """
+        :param definition: feature dictionary
+        :return: names of the columns the feature makes
+        """
+        return [definition["name"]]
+
+    @classmethod
+    def evaluators(cls, definition):
+        """
+        :param definition: feature dictionary
+        :return: list with a function per column, computing only that column for a lowercased line
+        """
+        return [cls.evaluator(definition)]
+
+    def match(self, line, found):
+        """
+        :param line: a single lowercased line of words, without the language prefix
+        :param found: set of column indices, the columns which are True for the line are added
+        :return: None
+        """
+        raise NotImplementedError
+
+    def match_lines(self, lines):
+        """
+        :param lines: list of lowercased lines
+        :return: integer arrays with the row and the column of every True value
+        """
+        rows = []
+        cols = []
+        for row, line in enumerate(lines):
+            found = set()
+            self.match(line, found)
+            rows.extend([row] * len(found))
+            cols.extend(found)
+        return np.array(rows, dtype=np.int64), np.array(cols, dtype=np.int64)
+
+
+class KeywordMatcher(Matcher):
+    """
+    all keyword features of a spec, the line is split on spaces once and every word is looked up in one table,
+    so the cost follows the length of the line and not the number of keywords
+    a word is only counted if it has a space on both sides, so the first and the last piece of the split are left out
+    """
+    __slots__ = "word_table", "phrase_table", "words", "first_words"
+    key = "words"
+
+    def __init__(self, features):
+        """
+        :param features: list of (column index, definition) pairs
+        """
+        self.word_table, self.phrase_table = compile_keywords(
+            [(index, lowercase(definition["words"])) for index, definition in features])
+        # sets of the keys, intersecting with a set walks the smaller side where a dictionary is walked whole
+        self.words = frozenset(self.word_table)
+        self.first_words = frozenset(self.phrase_table)
+
+    def match(self, line, found):
+        words = set(line.split(" ")[1:-1])
+        for word in words.intersection(self.words):
+            found.update(self.word_table[word])
+        for word in words.intersection(self.first_words):
+            for test_term, index in self.phrase_table[word]:
+                if index not in found and line.find(test_term) != -1:
+                    found.add(index)
+
+    @staticmethod
+    def columns(definition):
+        check_strings(definition, "words")
+        return [definition["name"]]
+
+    @staticmethod
+    def evaluator(definition):
+        return keyword_evaluator(lowercase(definition["words"]))
+
+
+class CharsetMatcher(Matcher):
+    """
+    all charset features of a spec, the characters of the line are looked up in one table
+    """
+    __slots__ = "char_table", "chars"
+    key = "chars"
+
+    def __init__(self, features):
+        """
+        :param features: list of (column index, definition) pairs
+        """
+        self.char_table = {}
+        for index, definition in features:
+            for char in definition["chars"].lower():
+                if index not in self.char_table.get(char, ()):
+                    self.char_table[char] = self.char_table.get(char, ()) + (index,)
+        self.chars = frozenset(self.char_table)
+
+    def match(self, line, found):
+        if self.chars.isdisjoint(line):
+            return
+        for char in self.chars.intersection(line):
+            found.update(self.char_table[char])
+
+    @staticmethod
+    def columns(definition):
+        if not isinstance(definition["chars"], str):
+            raise ValueError("feature %s needs a string of chars" % definition["name"])
+        return [definition["name"]]
+
+    @staticmethod
+    def evaluator(definition):
+        chars = frozenset(definition["chars"].lower())
+        return lambda line: not chars.isdisjoint(line)
+
+
+class NgramMatcher(Matcher):
+    """
+    all ngram features of a spec, a feature is True if one of its character ngrams is anywhere in the line
+    every ngram of the line is looked up in one table per length, so the cost follows the length of the line
+    and the number of different ngram lengths, not the number of ngrams
+    """
+    __slots__ = "tables", "ngrams"
+    key = "ngrams"
+
+    def __init__(self, features):
+        """
+        :param features: list of (column index, definition) pairs
+        """
+        self.tables = {}
+        for index, definition in features:
+            for ngram in lowercase(definition["ngrams"]):
+                table = self.tables.setdefault(len(ngram), {})
+                if index not in table.get(ngram, ()):
+                    table[ngram] = table.get(ngram, ()) + (index,)
+        self.ngrams = {length: frozenset(table) for length, table in self.tables.items()}
+
+    def match(self, line, found):
+        for length, table in self.tables.items():
+            ngrams = {line[i:i + length] for i in range(len(line) - length + 1)}
+            for ngram in ngrams.intersection(self.ngrams[length]):
+                found.update(table[ngram])
+
+    @staticmethod
+    def columns(definition):
+        check_strings(definition, "ngrams")
+        return [definition["name"]]
+
+    @staticmethod
+    def evaluator(definition):
+        ngrams = tuple(lowercase(definition["ngrams"]))
+        return lambda line: any(ngram in line for ngram in ngrams)
+
+
+def hash_ngrams(lines, buckets, min_n=HASH_MIN_N, max_n=HASH_MAX_N):
+    """
+    hashes every character ngram of the lines into a bucket, all lines are done together in one pass
+    over their characters, the hash of an ngram is extended by a character to give the hash of the next length
+
+    :param lines: list of lowercased lines
+    :param buckets: number of buckets
+    :param min_n: shortest ngram
+    :param max_n: longest ngram
+    :return: integer arrays with the row and the bucket of every bucket which is hit, sorted and without repeats
+    """
+    lengths = np.fromiter(map(len, lines), dtype=np.int64, count=len(lines))
+    codes = np.frombuffer("".join(lines).encode("utf-32-le"), dtype=np.uint32)
+    line_of = np.repeat(np.arange(len(lines), dtype=np.int64), lengths)
+    hashes = np.zeros(len(codes), dtype=np.uint32)
+    keys = []
+    for n in range(max_n):
+        # hashes[i] is the hash of the ngram of length n + 1 starting at i, the multiplications wrap at 32 bits
+        hashes = hashes[:len(codes) - n] * HASH_MULTIPLIER + codes[n:]
+        if n + 1 < min_n:
+            continue
+        in_line = line_of[:len(hashes)] == line_of[n:]
+        bucket = (hashes[in_line] * HASH_MIXER) % np.uint32(buckets)
+        keys.append(line_of[:len(hashes)][in_line] * buckets + bucket)
+    keys = np.sort(np.concatenate(keys + [np.zeros(0, dtype=np.int64)]))
+    keys = keys[np.append(True, keys[1:] != keys[:-1])[:len(keys)]]
+    return keys // buckets, keys % buckets
+
+
+class HashedNgramMatcher(Matcher):
+    """
+    hashed character ngram features, every ngram of a line from min_n to max_n characters sets one of a fixed number
+    of bucket columns, so the memory of a row and of a model is bounded by the number of buckets
+    whatever ngrams the data has
+    """
+    __slots__ = "features"
+    key = "buckets"
+    sparse = True
+
+    def __init__(self, features):
+        """
+        :param features: list of (index of the first column, definition) pairs
+        """
+        self.features = [(index, definition["buckets"], definition.get("min_n", HASH_MIN_N),
+                          definition.get("max_n", HASH_MAX_N)) for index, definition in features]
+
+    @staticmethod
+    def columns(definition):
+        buckets = definition["buckets"]
+        min_n = definition.get("min_n", HASH_MIN_N)
+        max_n = definition.get("max_n", HASH_MAX_N)
+        if not isinstance(buckets, int) or not isinstance(min_n, int) or not isinstance(max_n, int):
+            raise ValueError("feature %s needs whole numbers for buckets, min_n and max_n" % definition["name"])
+        if buckets < 1 or not 1 <= min_n <= max_n:
+            raise ValueError("feature %s needs buckets >= 1 and 1 <= min_n <= max_n" % definition["name"])
+        return ["%s_%d" % (definition["name"], bucket) for bucket in range(buckets)]
+
+    @classmethod
+    def evaluators(cls, definition):
+        buckets = definition["buckets"]
+        min_n = definition.get("min_n", HASH_MIN_N)
+        max_n = definition.get("max_n", HASH_MAX_N)
+
+        # the buckets of the last line are kept, so looking up several columns of a line hashes it once
+        @functools.lru_cache(maxsize=1)
+        def buckets_of(line):
+            return frozenset(hash_ngrams([line], buckets, min_n, max_n)[1].tolist())
+
+        return [functools.partial(bucket_evaluator, buckets_of, bucket) for bucket in range(buckets)]
+
+    def match(self, line, found):
+        for index, buckets, min_n, max_n in self.features:
+            found.update((hash_ngrams([line], buckets, min_n, max_n)[1] + index).tolist())
+
+    def match_lines(self, lines):
+        rows = []
+        cols = []
+        for index, buckets, min_n, max_n in self.features:
+            feature_rows, feature_cols = hash_ngrams(lines, buckets, min_n, max_n)
+            rows.append(feature_rows)
+            cols.append(feature_cols + index)
+        return np.concatenate(rows), np.concatenate(cols)
+
+
+def bucket_evaluator(buckets_of, bucket, line):
+    """
+    :param buckets_of: function of a line which returns the set of its buckets
+    :param bucket: bucket of the column
+    :param line: a single lowercased line of words
+    :return: True if an ngram of the line is hashed to the bucket
+    """
+    return bucket in buckets_of(line)
+
+
+# matcher class of every type of feature, a new type is a Matcher with the key its definition needs,
+# a match method for all features of the type at once and an evaluator for a single column
+FEATURE_TYPES = {"keyword": KeywordMatcher,
+                 "charset": CharsetMatcher,
+                 "ngram": NgramMatcher,
+                 "hashed_ngrams": HashedNgramMatcher,
+                 }
+
+
+class FeatureSpec:
+    """
+    ordered list of declared features, compiled into one shared matcher per type of feature
+    a spec is read from a json file of the form {"features": [{"name": ..., "type": ..., ...}, ...]}
+    and is stored in the model file, so predictions compute the features the model was trained on
+    a feature makes one column, apart from hashed_ngrams which makes a column per bucket
+    """
+    __slots__ = "definitions", "names", "matchers", "evaluators", "sparse", "version"
+
+    def __init__(self, definitions):
+        """
+        :param definitions: list of feature dictionaries with a name, a type of FEATURE_TYPES and the key of the type
+        """
+        self.definitions = [dict(definition) for definition in definitions]
+        names = []
+        feature_names = set()
+        evaluators = []
+        features_per_type = {}
+        for index, definition in enumerate(self.definitions):
+            name = definition.get("name")
+            type_name = definition.get("type")
+            if not isinstance(name, str) or not name or name in feature_names:
+                raise ValueError("feature %d needs a unique name" % index)
+            if type_name not in FEATURE_TYPES:
+                raise ValueError("feature %s has an unknown type %r" % (name, type_name))
+            matcher = FEATURE_TYPES[type_name]
+            if not definition.get(matcher.key):
+                raise ValueError("feature %s of type %s needs %s" % (name, type_name, matcher.key))
+            feature_names.add(name)
+            features_per_type.setdefault(type_name, []).append((len(names), definition))
+            names.extend(matcher.columns(definition))
+            evaluators.extend(matcher.evaluators(definition))
+        if len(set(names)) != len(names):
+            raise ValueError("names of the columns of the features are not unique")
+        self.names = tuple(names)
+        self.matchers = [FEATURE_TYPES[type_name](features) for type_name, features in features_per_type.items()]
+        self.evaluators = evaluators
+        self.sparse = any(FEATURE_TYPES[type_name].sparse for type_name in features_per_type)
+        self.version = hashlib.sha1(self.to_json().encode("utf-8")).hexdigest()[:16]
+
+    @classmethod
+    def from_json(cls, text):
+        """
+        :param text: json of a dictionary with a list of features, or of the list itself
+        :return: the spec
+        """
+        data = json.loads(text)
+        if isinstance(data, dict):
+            data = data.get("features")
+        if not isinstance(data, list):
+            raise ValueError("feature spec needs a list of features")
+        return cls(data)
+
+    @classmethod
+    def from_file(cls, file_name):
+        """
+        :param file_name: name of a json feature spec
+        :return: the spec
+        """
+        with open(file_name, encoding="utf-8") as file:
+            return cls.from_json(file.read())
+
+    def to_json(self):
+        return json.dumps({"features": self.definitions}, ensure_ascii=False, sort_keys=True)
+
+    def extract(self, line):
+        """
+        computes all the features of a lowercased line, one pass per type of feature
+
+        :param line: a single lowercased line of words, without the language prefix
+        :return: list of booleans in the order of the names
+        """
+        found = set()
+        for matcher in self.matchers:
+            matcher.match(line, found)
+        values = [False] * len(self.names)
+        for index in found:
+            values[index] = True
+        return values
+
+    def extract_lines(self, lines):
+        """
+        computes all the features of a list of lowercased lines, keeping only the True values
+
+        :param lines: list of lowercased lines, without the language prefix
+        :return: integer arrays with the row and the column of every True value, ordered by row and column
+        """
+        rows = []
+        cols = []
+        for matcher in self.matchers:
+            matcher_rows, matcher_cols = matcher.match_lines(lines)
+            rows.append(matcher_rows)
+            cols.append(matcher_cols)
+        keys = np.sort(np.concatenate(rows + [np.zeros(0, dtype=np.int64)]) * len(self.names) +
+                       np.concatenate(cols + [np.zeros(0, dtype=np.int64)]))
+        return keys // len(self.names), keys % len(self.names)
+
+    def __len__(self):
+        return len(self.names)
+
+    def __eq__(self, other):
+        return isinstance(other, FeatureSpec) and self.version == other.version
+
+    def __hash__(self):
+        return hash(self.version)
+
+    def __reduce__(self):
+        # the evaluators are closures, so the spec is pickled as its json and compiled again
+        return FeatureSpec.from_json, (self.to_json(),)
+
+
+DEFAULT_SPEC = FeatureSpec(DEFAULT_FEATURES)
+
+
+def extract_features(line):
+    """
+    computes all the features of the default spec of a lowercased line
+
+    :param line: a single lowercased line of words, without the language prefix
+    :return: list of booleans in the order of FEATURE_NAMES
+    """
+    return DEFAULT_SPEC.extract(line)
+
+
+def parse_line(line, is_test=False):
+    """
+    lowercases a line and splits off the language at the start of it
+
+    :param line: a single line of words
+    :param is_test: is required to know if the data has the language of the line at the start, test data has them
+    :return:    res: True if the line is dutch, False if it is english, None for test data
+                line: the lowercased line without the language
+    """
+    line = str(line)
+    line = line.lower()
+    res = None
+    if not is_test:
+        lang = line[0:2]
+        line = line[3:]
+        res = lang == "nl"
+    return res, line
+
+
 def is_it_dutch_accent(line):
     """
     checks if the line has characters with an accent
@@ -7,13 +520,7 @@ def is_it_dutch_accent(line):
     :param line: a single line of words
     :return: true if word have a character with an accent
     """
-    accent_char_ord = [193, 196, 201, 203, 205, 207, 211, 214, 218, 220, 221, 225, 228, 233,
-                       235, 237, 239, 243, 246, 250, 252, 253, 255]
-
-    for ch in line:
-        if ord(ch) in accent_char_ord:
-            return True
-    return False
+    return not ACCENT_CHARS.isdisjoint(line)
 
 
 def is_dutch_preposition_is_not_english_word(line):
@@ -23,14 +530,7 @@ def is_dutch_preposition_is_not_english_word(line):
     :param line: a single line of words
     :return: true if line has a dutch preposition which is not a english word, false otherwise
     """
-    dutch_prepositions = ["naar", "voor", "achter", "naast", "beneden", "boven", "onder", "op", "tussen", "het midden",
-                          "bij", "binnen", "buiten", "tegen", "rond", "sinds", "zonder", "na", "om"]
-    for word in dutch_prepositions:
-        test_term = " " + word + " "
-        if line.find(test_term) != -1:
-            return True
-
-    return False
+    return DEFAULT_SPEC.evaluators[FEATURE_NAMES.index("nl_prepos")](line)
 
 
 def is_english_preposition(line):
@@ -40,31 +540,43 @@ def is_english_preposition(line):
     :param line: a single line of words
     :return: true if the line has a preposition, false otherwise
     """
-    english_prepositions = ["with", "from", "to", "in front of", "behind", "next to", "down", "downstairs",
-                            "above", "upstairs", "below", "on top", "between", "middle", "about", "over", "near",
-                            "inside", "outside", "against", "around", "since", "without", "before", "after"]
-    for word in english_prepositions:
-        test_term = " " + word + " "
-        if line.find(test_term) != -1:
-            return True
-    return False
+    return DEFAULT_SPEC.evaluators[FEATURE_NAMES.index("en_prepos")](line)
+
+
+class LazyFeatures:
+    """
+    features of a single line which are only computed when they are looked up, by index in the names of the spec,
+    so a model which looks at a few features does not pay for the others
+    """
+    __slots__ = "line", "values", "evaluators"
+
+    def __init__(self, line, spec=DEFAULT_SPEC):
+        """
+        :param line: a single lowercased line of words, without the language prefix
+        :param spec: FeatureSpec the indices refer to
+        """
+        self.line = line
+        self.values = [None] * len(spec)
+        self.evaluators = spec.evaluators
+
+    def __getitem__(self, index):
+        value = self.values[index]
+        if value is None:
+            value = self.values[index] = self.evaluators[index](self.line)
+        return value
+
+    def computed(self):
+        """
+        :return: number of features computed so far
+        """
+        return len(self.values) - self.values.count(None)
 
 
 class Features:
     __slots__ = "features"
 
     def __init__(self):
-        self.features = {"nl_article": False,
-                         "nl_prepos": False,
-                         "en_article": False,
-                         "en_prepos": False,
-                         "accent": False,
-                         "als_present": False,
-                         "as_present": False,
-                         "dat_present": False,
-                         "that_present": False,
-                         "also_present": False,
-                         }
+        self.features = dict.fromkeys(FEATURE_NAMES, False)
 
     def make_features(self, line, is_test=False):
         """
@@ -74,36 +586,12 @@ class Features:
         :param is_test: is required to know if the data has the language of the line at the start, test data has them
         :return: None
         """
-        line = str(line)
-        line = line.lower()
+        res, line = parse_line(line, is_test)
         if not is_test:
-            lang = line[0:2]
-            line = line[3:]
-            if lang == "nl":
-                self.features["res"] = True
-            else:
-                self.features["res"] = False
+            self.features["res"] = res
         self.features["sent"] = line
-        if line.find(" het ") != -1 or line.find(" de ") != -1:
-            self.features["nl_article"] = True
-        if is_dutch_preposition_is_not_english_word(line):
-            self.features["nl_prepos"] = True
-        if line.find(" the ") != -1 or line.find(" a ") != -1 or line.find(" an ") != -1:
-            self.features["en_article"] = True
-        if is_english_preposition(line):
-            self.features["en_prepos"] = True
-        if is_it_dutch_accent(line):
-            self.features["accent"] = True
-        if line.find(" als ") != -1:
-            self.features["als_present"] = True
-        if line.find(" as ") != -1:
-            self.features["as_present"] = True
-        if line.find(" dat ") != -1:
-            self.features["dat_present"] = True
-        if line.find(" that ") != -1:
-            self.features["that_present"] = True
-        if line.find(" also ") != -1:
-            self.features["also_present"] = True
+        for feat_name, value in zip(FEATURE_NAMES, extract_features(line)):
+            self.features[feat_name] = value
 
     def __str__(self):
         """
@@ -0,0 +1,191 @@
+import cProfile
+import pstats
+import sys
+import time
+from sections import replace_file
+
+
+# prefix of the names of the metrics in the prometheus text format
+METRIC_PREFIX = "langdetect_"
+# seconds between two dumps of the metrics file in the long running modes
+DUMP_INTERVAL = 10.0
+
+# help text of every counter, counters which are not listed are still counted
+COUNTERS = {"lines_read": "lines read from the input files",
+            "lines_predicted": "lines given a label",
+            "features_computed": "feature values computed",
+            "nodes_built": "decision tree nodes made",
+            "stumps_evaluated": "candidate adaboost stumps whose error was computed",
+            "rounds": "adaboost rounds made",
+            "requests": "requests answered by the server",
+            }
+
+
+class NullTimer:
+    """
+    timer of disabled metrics, it does nothing
+    """
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+NULL_TIMER = NullTimer()
+
+
+class Timer:
+    """
+    adds the time spent in a with block to a stage of a Metrics
+    """
+    __slots__ = "metrics", "stage", "start"
+
+    def __init__(self, metrics, stage):
+        self.metrics = metrics
+        self.stage = stage
+        self.start = 0.0
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.metrics.add_time(self.stage, time.perf_counter() - self.start)
+        return False
+
+
+class Metrics:
+    """
+    counters and per stage timers of the hot paths, disabled until enable is called,
+    when disabled count is one attribute check and timer gives back a shared timer which does nothing,
+    the hooks are placed per chunk, node or round and never per feature of a line
+    """
+    __slots__ = "enabled", "counters", "seconds", "calls", "started", "file_name", "last_dump"
+
+    def __init__(self):
+        self.enabled = False
+        self.counters = {}
+        self.seconds = {}
+        self.calls = {}
+        self.started = time.time()
+        self.file_name = None
+        self.last_dump = 0.0
+
+    def enable(self, file_name=None):
+        """
+        :param file_name: optional file the prometheus text is dumped to by dump and dump_if_due
+        :return: None
+        """
+        self.enabled = True
+        self.file_name = file_name
+
+    def count(self, name, amount=1):
+        """
+        :param name: name of the counter
+        :param amount: number added to it
+        :return: None
+        """
+        if self.enabled:
+            self.counters[name] = self.counters.get(name, 0) + amount
+
+    def timer(self, stage):
+        """
+        :param stage: name of the stage
+        :return: context manager which adds the time of its block to the stage
+        """
+        if self.enabled:
+            return Timer(self, stage)
+        return NULL_TIMER
+
+    def add_time(self, stage, seconds):
+        self.seconds[stage] = self.seconds.get(stage, 0.0) + seconds
+        self.calls[stage] = self.calls.get(stage, 0) + 1
+
+    def format_prometheus(self):
+        """
+        :return: the metrics in the prometheus text exposition format
+        """
+        lines = []
+        for name in sorted(self.counters):
+            metric = METRIC_PREFIX + name + "_total"
+            lines.append("# HELP %s %s" % (metric, COUNTERS.get(name, name.replace("_", " "))))
+            lines.append("# TYPE %s counter" % metric)
+            lines.append("%s %d" % (metric, self.counters[name]))
+        if self.seconds:
+            for metric, help_text, values, number in (
+                    ("stage_seconds_total", "seconds spent in every stage", self.seconds, "%.6f"),
+                    ("stage_calls_total", "times every stage was timed", self.calls, "%d")):
+                lines.append("# HELP %s%s %s" % (METRIC_PREFIX, metric, help_text))
+                lines.append("# TYPE %s%s counter" % (METRIC_PREFIX, metric))
+                for stage in sorted(values):
+                    lines.append(('%s%s{stage="%s"} ' + number) % (METRIC_PREFIX, metric, stage, values[stage]))
+        lines.append("# HELP %sstart_time_seconds unix time the process started" % METRIC_PREFIX)
+        lines.append("# TYPE %sstart_time_seconds gauge" % METRIC_PREFIX)
+        lines.append("%sstart_time_seconds %.3f" % (METRIC_PREFIX, self.started))
+        return "\n".join(lines) + "\n"
+
+    def format_summary(self):
+        """
+        :return: table of the stages and counters for people
+        """
+        lines = ["%-20s %10.4fs %8d calls" % (stage, self.seconds[stage], self.calls[stage])
+                 for stage in sorted(self.seconds, key=self.seconds.get, reverse=True)]
+        lines += ["%-20s %12d" % (name, self.counters[name]) for name in sorted(self.counters)]
+        return "\n".join(lines)
+
+    def dump(self, file_name=None):
+        """
+        writes the prometheus text to a file with sections.replace_file
+
+        :param file_name: name of the file, the one given to enable if None
+        :return: None
+        """
+        file_name = file_name or self.file_name
+        if not self.enabled or file_name is None:
+            return
+        with replace_file(file_name, "w") as file:
+            file.write(self.format_prometheus())
+        self.last_dump = time.monotonic()
+
+    def dump_if_due(self):
+        """
+        dumps the metrics when DUMP_INTERVAL seconds passed since the last dump, for the long running modes
+        """
+        if self.enabled and self.file_name is not None and time.monotonic() - self.last_dump >= DUMP_INTERVAL:
+            self.dump()
+
+
+# metrics of the process, the modules count into it
+METRICS = Metrics()
+
+
+class Profile:
+    """
+    runs cProfile around a with block and writes the statistics to a file which pstats and snakeviz read,
+    the functions with the most cumulative time are printed to standard error
+    """
+    __slots__ = "file_name", "profiler", "top"
+
+    def __init__(self, file_name, top=20):
+        """
+        :param file_name: file the statistics are written to, nothing is profiled if None
+        :param top: number of functions printed
+        """
+        self.file_name = file_name
+        self.profiler = None if file_name is None else cProfile.Profile()
+        self.top = top
+
+    def __enter__(self):
+        if self.profiler is not None:
+            self.profiler.enable()
+        return self
+
+    def __exit__(self, *exc_info):
+        if self.profiler is not None:
+            self.profiler.disable()
+            self.profiler.dump_stats(self.file_name)
+            pstats.Stats(self.profiler, stream=sys.stderr).sort_stats("cumulative").print_stats(self.top)
+        return False
@@ -0,0 +1,416 @@
+import hashlib
+import pickle
+import struct
+import sys
+import numpy as np
+from dataset import Dataset, PackedMatrix, SparseMatrix
+from make_features import DEFAULT_SPEC, FeatureSpec
+from metrics import METRICS
+from sections import read_sections, write_sections
+
+
+# first bytes of every compiled model file
+MAGIC = b"LDMODEL\0"
+# version 2 added the feature spec, version 1 files were trained on the default features
+FORMAT_VERSION = 2
+
+KIND_TREE = 1
+KIND_BOOST = 2
+
+# magic, format version, kind of model, number of sections
+HEADER = struct.Struct("<8sIII")
+
+SECTION_DTYPES = {"names": np.uint8,
+                  "spec": np.uint8,
+                  "feature": np.dtype("<i4"),
+                  "left": np.dtype("<i4"),
+                  "right": np.dtype("<i4"),
+                  "value": np.int8,
+                  "weights": np.dtype("<f8"),
+                  "bias": np.dtype("<f8"),
+                  "s_feat": np.dtype("<i4"),
+                  "s_true": np.uint8,
+                  "s_false": np.uint8,
+                  "s_say": np.dtype("<f8"),
+                  }
+
+# rows scored at a time by BoostModel.margins
+BATCH_SIZE = 1 << 16
+
+LEAVES = {"True:is_nl": True, "False:is_nl": True, "True:is_en": False, "False:is_en": False}
+
+
+def label_name(is_nl):
+    """
+    :param is_nl: True for dutch
+    :return: is_nl or is_en
+    """
+    if is_nl:
+        return "is_nl"
+    return "is_en"
+
+
+class TreeModel:
+    """
+    decision tree stored as flat node arrays, node 0 is the root
+    feature is -1 for leaves, left is the child when the feature is True and right when it is False,
+    value is 1 for an is_nl leaf, 0 for an is_en leaf and -1 for the other nodes
+    """
+    __slots__ = "feature", "left", "right", "value", "spec", "feature_names"
+
+    def __init__(self, feature, left, right, value, spec=DEFAULT_SPEC):
+        self.feature = feature
+        self.left = left
+        self.right = right
+        self.value = value
+        self.spec = spec
+        self.feature_names = spec.names
+
+    @classmethod
+    def from_nodes(cls, nodes, spec=DEFAULT_SPEC):
+        """
+        :param nodes: list of [feature, left, right, value] lists
+        :param spec: FeatureSpec of the features the indices refer to
+        :return: the model
+        """
+        nodes = np.array(nodes, dtype=np.int64).reshape(-1, 4)
+        return cls(nodes[:, 0].astype("<i4"), nodes[:, 1].astype("<i4"), nodes[:, 2].astype("<i4"),
+                   nodes[:, 3].astype(np.int8), spec)
+
+    def predict_row(self, values):
+        """
+        walks the tree for a single row
+
+        :param values: sequence with the value of every feature
+        :return: True for is_nl
+        """
+        node = 0
+        while self.feature[node] >= 0:
+            if values[self.feature[node]]:
+                node = self.left[node]
+            else:
+                node = self.right[node]
+        return bool(self.value[node])
+
+    def depth(self):
+        """
+        :return: number of edges on the longest path from the root to a leaf
+        """
+        depths = np.zeros(len(self.feature), dtype=np.intp)
+        for node in range(len(self.feature)):
+            if self.feature[node] >= 0:
+                depths[self.left[node]] = depths[node] + 1
+                depths[self.right[node]] = depths[node] + 1
+        return int(depths.max(initial=0))
+
+    def leaves(self, matrix):
+        """
+        walks the tree for all rows at the same time, every step moves each row one level down,
+        leaves point to themselves so rows which reached a leaf stay there
+
+        :param matrix: array of 0 and 1 with shape (rows, features), or a SparseMatrix
+        :return: array with the leaf every row reaches
+        """
+        is_leaf = self.feature < 0
+        node_range = np.arange(len(self.feature))
+        feature = np.where(is_leaf, 0, self.feature).astype(np.intp)
+        left = np.where(is_leaf, node_range, self.left).astype(np.intp)
+        right = np.where(is_leaf, node_range, self.right).astype(np.intp)
+        nodes = np.zeros(len(matrix), dtype=np.intp)
+        if isinstance(matrix, SparseMatrix):
+            row_range = np.arange(len(matrix))
+            for _ in range(self.depth()):
+                nodes = np.where(matrix.contains(row_range, feature[nodes]), left[nodes], right[nodes])
+            return nodes
+        matrix = np.ascontiguousarray(matrix)
+        values = matrix.reshape(-1)
+        row_starts = np.arange(len(matrix)) * matrix.shape[-1]
+        for _ in range(self.depth()):
+            nodes = np.where(values[row_starts + feature[nodes]], left[nodes], right[nodes])
+        return nodes
+
+    def predict_batch(self, matrix):
+        """
+        :param matrix: array of 0 and 1 with shape (rows, features), or a SparseMatrix
+        :return: boolean array, True for is_nl
+        """
+        return self.value[self.leaves(matrix)] == 1
+
+    def sections(self):
+        return {"feature": self.feature, "left": self.left, "right": self.right, "value": self.value}
+
+    def __str__(self):
+        lines = []
+        for node in range(len(self.feature)):
+            if self.feature[node] >= 0:
+                lines.append("%d: %s -> %d, %d" % (node, self.feature_names[self.feature[node]],
+                                                     self.left[node], self.right[node]))
+            else:
+                lines.append("%d: %s" % (node, label_name(self.value[node])))
+        return "\n".join(lines)
+
+
+class BoostModel:
+    """
+    adaboost model stored as a signed weight per feature and a bias,
+    the margin of a row is bias + sum of the weights of its True features and is positive for is_nl
+    the stumps it was made from are kept in order as well
+    """
+    __slots__ = ("weights", "bias", "stump_feature", "stump_true", "stump_false", "stump_say", "spec",
+                 "feature_names")
+
+    def __init__(self, weights, bias, stump_feature, stump_true, stump_false, stump_say, spec=DEFAULT_SPEC):
+        self.weights = weights
+        self.bias = float(bias)
+        self.stump_feature = stump_feature
+        self.stump_true = stump_true
+        self.stump_false = stump_false
+        self.stump_say = stump_say
+        self.spec = spec
+        self.feature_names = spec.names
+
+    @classmethod
+    def from_stumps(cls, stumps, spec=DEFAULT_SPEC):
+        """
+        folds the stumps into the weight vector and bias
+
+        :param stumps: list of (feature index, conclusion if True, conclusion if False, amount_of_say),
+                       conclusions are True for is_nl
+        :param spec: FeatureSpec of the features the indices refer to
+        :return: the model
+        """
+        weights = np.zeros(len(spec))
+        bias = 0.0
+        for feat_index, pos_conclusion, neg_conclusion, amount_of_say in stumps:
+            pos_say = amount_of_say if pos_conclusion else -amount_of_say
+            neg_say = amount_of_say if neg_conclusion else -amount_of_say
+            weights[feat_index] += pos_say - neg_say
+            bias += neg_say
+        stumps = list(zip(*stumps)) or [(), (), (), ()]
+        return cls(weights, bias, np.array(stumps[0], dtype="<i4"), np.array(stumps[1], dtype=np.uint8),
+                   np.array(stumps[2], dtype=np.uint8), np.array(stumps[3], dtype="<f8"), spec)
+
+    def stumps(self):
+        """
+        :return: list of (feature index, conclusion if True, conclusion if False, amount_of_say)
+        """
+        return list(zip(self.stump_feature.tolist(), map(bool, self.stump_true), map(bool, self.stump_false),
+                        self.stump_say.tolist()))
+
+    def margin_row(self, values):
+        """
+        :param values: sequence with the value of every feature
+        :return: margin of the row, positive for is_nl
+        """
+        return self.bias + float(np.dot(np.asarray(values, dtype=float), self.weights))
+
+    def predict_row(self, values):
+        """
+        :param values: sequence with the value of every feature
+        :return: True for is_nl
+        """
+        return self.margin_row(values) > 0
+
+    def margins(self, matrix):
+        """
+        :param matrix: array of 0 and 1 with shape (rows, features), a PackedMatrix or a SparseMatrix
+        :return: margin of every row, positive for is_nl
+        """
+        if isinstance(matrix, SparseMatrix):
+            margins = np.bincount(matrix.row_ids(), self.weights[matrix.indices], minlength=len(matrix))
+            return margins + self.bias
+        if not isinstance(matrix, PackedMatrix):
+            matrix = np.asarray(matrix)
+        margins = np.empty(len(matrix))
+        for start in range(0, len(matrix), BATCH_SIZE):
+            margins[start:start + BATCH_SIZE] = matrix[start:start + BATCH_SIZE] @ self.weights
+        margins += self.bias
+        return margins
+
+    def predict_batch(self, matrix):
+        """
+        :param matrix: array of 0 and 1 with shape (rows, features)
+        :return: boolean array, True for is_nl
+        """
+        return self.margins(matrix) > 0
+
+    def sections(self):
+        return {"weights": self.weights, "bias": np.array([self.bias]), "s_feat": self.stump_feature,
+                "s_true": self.stump_true, "s_false": self.stump_false, "s_say": self.stump_say}
+
+    def __str__(self):
+        lines = ["bias: %r" % self.bias]
+        for feat_index, pos_conclusion, neg_conclusion, amount_of_say in self.stumps():
+            lines.append("%s: amount_of_say %r, True: %s, False: %s" % (
+                self.feature_names[feat_index], amount_of_say, label_name(pos_conclusion),
+                label_name(neg_conclusion)))
+        return "\n".join(lines)
+
+
+def predict_batch(model, matrix):
+    """
+    predicts every row of a feature matrix in one call
+
+    :param model: TreeModel or BoostModel
+    :param matrix: array of 0 and 1 with shape (rows, features), or a Dataset
+    :return: boolean array, True for is_nl
+    """
+    if isinstance(matrix, Dataset):
+        matrix = matrix.matrix()
+    METRICS.count("lines_predicted", len(matrix))
+    with METRICS.timer("predict"):
+        return model.predict_batch(matrix)
+
+
+def label_names(predictions):
+    """
+    :param predictions: boolean array, True for is_nl
+    :return: list of is_nl and is_en
+    """
+    return [label_name(is_nl) for is_nl in predictions.tolist()]
+
+
+def model_version(model):
+    """
+    :param model: TreeModel or BoostModel
+    :return: digest of the kind, the feature spec and the arrays of the model, it changes whenever the model does
+    """
+    digest = hashlib.sha1(type(model).__name__.encode("ascii"))
+    digest.update(model.spec.to_json().encode("utf-8"))
+    for name, array in model.sections().items():
+        digest.update(name.encode("ascii"))
+        digest.update(np.ascontiguousarray(array, dtype=SECTION_DTYPES[name]).tobytes())
+    return digest.hexdigest()[:16]
+
+
+def save_model(model, file_name):
+    """
+    writes a model in the compiled binary format
+
+    :param model: TreeModel or BoostModel
+    :param file_name: name of the output file
+    :return: None
+    """
+    kind = KIND_TREE if isinstance(model, TreeModel) else KIND_BOOST
+    sections = {"names": np.frombuffer("\n".join(model.feature_names).encode("utf-8"), dtype=np.uint8),
+                "spec": np.frombuffer(model.spec.to_json().encode("utf-8"), dtype=np.uint8)}
+    sections.update(model.sections())
+    write_sections(file_name, HEADER, (MAGIC, FORMAT_VERSION, kind), sections, SECTION_DTYPES)
+
+
+def load_model(file_name):
+    """
+    loads a compiled model, the arrays are memory mapped from the file
+    models pickled by older versions are converted with load_legacy
+
+    :param file_name: name of the model file
+    :return: TreeModel or BoostModel
+    """
+    compiled = read_sections(file_name, HEADER, MAGIC, SECTION_DTYPES)
+    if compiled is None:
+        return load_legacy(file_name)
+    (version, kind), sections = compiled
+    if version > FORMAT_VERSION:
+        raise ValueError("model format version %d is newer than the supported version %d"
+                         % (version, FORMAT_VERSION))
+    feature_names = tuple(sections.pop("names").tobytes().decode("utf-8").split("\n"))
+    spec = DEFAULT_SPEC
+    if "spec" in sections:
+        spec = FeatureSpec.from_json(sections.pop("spec").tobytes().decode("utf-8"))
+    if spec.names != feature_names:
+        raise ValueError("feature names of the model do not match its feature spec")
+    if kind == KIND_TREE:
+        return TreeModel(sections["feature"], sections["left"], sections["right"], sections["value"], spec)
+    if kind == KIND_BOOST:
+        return BoostModel(sections["weights"], sections["bias"][0], sections["s_feat"], sections["s_true"],
+                          sections["s_false"], sections["s_say"], spec)
+    raise ValueError("unknown kind of model %d" % kind)
+
+
+class LegacyUnpickler(pickle.Unpickler):
+    """
+    unpickler for the old model files, which only hold dictionaries, lists, strings and floats
+    no classes or functions are looked up, so loading can not run code from the file
+    """
+
+    def find_class(self, module, name):
+        raise pickle.UnpicklingError("legacy model refers to " + module + "." + name)
+
+
+def load_legacy(file_name):
+    """
+    reads a model pickled by older versions of train.py and converts it
+
+    :param file_name: name of the pickled model
+    :return: TreeModel or BoostModel
+    """
+    with open(file_name, "rb") as file:
+        model_dict = LegacyUnpickler(file).load()
+    if None in model_dict:
+        return tree_from_dict(model_dict)
+    return boost_from_dict(model_dict)
+
+
+def tree_from_dict(dt_dict, spec=DEFAULT_SPEC):
+    """
+    converts a decision tree dictionary, following the children in the same way the old predicter did
+
+    :param dt_dict: dictionary with the parent as the key and a list of children as the value
+    :param spec: FeatureSpec with the names of the features
+    :return: TreeModel
+    """
+    feature_names = spec.names
+    nodes = []
+
+    def add_node(key, depth):
+        if key in LEAVES:
+            nodes.append([-1, -1, -1, int(LEAVES[key])])
+            return len(nodes) - 1
+        if depth > len(feature_names) or len(dt_dict.get(key, ())) < 2:
+            raise ValueError("decision tree dictionary is incomplete at " + str(key))
+        node = len(nodes)
+        nodes.append([feature_names.index(key), -1, -1, -1])
+        nodes[node][1] = add_node(dt_dict[key][0], depth + 1)
+        nodes[node][2] = add_node(dt_dict[key][1], depth + 1)
+        return node
+
+    if dt_dict.get(None):
+        add_node(dt_dict[None][0], 0)
+    else:
+        nodes.append([-1, -1, -1, 0])
+    return TreeModel.from_nodes(nodes, spec)
+
+
+def boost_from_dict(ada_dict, spec=DEFAULT_SPEC):
+    """
+    converts an adaboost dictionary of amount_of_say, True and False per feature
+
+    :param ada_dict: adaboost dictionary
+    :param spec: FeatureSpec with the names of the features
+    :return: BoostModel
+    """
+    stumps = []
+    for key, value in ada_dict.items():
+        if isinstance(value, dict):
+            value = [value]
+        for stump in value:
+            stumps.append((spec.names.index(key), stump["True"] == "is_nl", stump["False"] == "is_nl",
+                           stump["amount_of_say"]))
+    return BoostModel.from_stumps(stumps, spec)
+
+
+def main():
+    """
+    converts a pickled model to the compiled format
+    first command line argument: file_name of the pickled model
+    second command line argument: file_name of the compiled model
+
+    :return: None
+    """
+    model = load_legacy(sys.argv[1])
+    print(model)
+    save_model(model, sys.argv[2])
+
+
+if __name__ == "__main__":
+    main()
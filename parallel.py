@@ -0,0 +1,123 @@
+import io
+import os
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from dataset import Dataset, extract_matrix
+from ingest import ENCODING
+from lazy import LazyPredicter
+from make_features import DEFAULT_SPEC
+from model import load_model, predict_batch
+
+
+# shards made per worker, more shards than workers keeps every worker busy when lines have different lengths
+SHARDS_PER_WORKER = 4
+
+# model loaded once by every prediction worker
+worker_model = None
+# LazyPredicter of the worker model, None when every feature is extracted
+worker_predicter = None
+
+
+def line_shards(file_name, count):
+    """
+    splits a file in byte ranges which start at the beginning of a line
+
+    :param file_name: name of the file
+    :param count: number of shards wanted
+    :return: list of (start, stop) byte offsets, empty ranges are left out
+    """
+    size = os.path.getsize(file_name)
+    bounds = [0]
+    with open(file_name, "rb") as file:
+        for i in range(1, count):
+            file.seek(max(size * i // count, bounds[-1]))
+            if file.tell() > 0:
+                file.seek(file.tell() - 1)
+                file.readline()
+            bounds.append(max(file.tell(), bounds[-1]))
+    bounds.append(size)
+    return [(start, stop) for start, stop in zip(bounds, bounds[1:]) if stop > start]
+
+
+def read_shard(file_name, start, stop):
+    """
+    reads the lines which start in the byte range
+
+    :param file_name: name of the file
+    :param start: offset of the first line
+    :param stop: offset after the last line
+    :return: list of lines, with the newlines translated like open() does, so \r\n ends a line in \n
+    """
+    lines = []
+    with open(file_name, "rb") as file:
+        file.seek(start)
+        while file.tell() < stop:
+            lines.append(file.readline())
+    return list(io.StringIO(b"".join(lines).decode(ENCODING), newline=None))
+
+
+def extract_shard(file_name, start, stop, is_test=False, spec=DEFAULT_SPEC):
+    """
+    :return: Dataset with the lines of the byte range
+    """
+    matrix, labels = extract_matrix(read_shard(file_name, start, stop), is_test, spec)
+    return Dataset.from_matrix(matrix, None if is_test else labels, spec, file_name, is_test)
+
+
+def load_worker_model(model_file_name, all_features=False):
+    """
+    initializer of the prediction workers
+    """
+    global worker_model, worker_predicter
+    worker_model = load_model(model_file_name)
+    worker_predicter = None if all_features else LazyPredicter(worker_model)
+
+
+def predict_shard(file_name, start, stop):
+    """
+    :return: boolean array with the prediction of every line of the byte range, True for is_nl
+    """
+    lines = read_shard(file_name, start, stop)
+    if worker_predicter is not None:
+        return worker_predicter.predict_lines(lines)
+    matrix, _ = extract_matrix(lines, spec=worker_model.spec)
+    return predict_batch(worker_model, matrix)
+
+
+def read_dataset(file_name, workers, is_test=False, spec=DEFAULT_SPEC):
+    """
+    extracts the features of a file in a pool of processes
+
+    :param file_name: name of the file
+    :param workers: number of processes
+    :param is_test: True if the lines do not have the language at the start
+    :param spec: FeatureSpec of the features which are extracted
+    :return: Dataset with the rows in the order of the file
+    """
+    shards = line_shards(file_name, workers * SHARDS_PER_WORKER)
+    with ProcessPoolExecutor(workers) as executor:
+        futures = [executor.submit(extract_shard, file_name, start, stop, is_test, spec) for start, stop in shards]
+        datasets = [future.result() for future in futures]
+    data = Dataset.concatenate(datasets)
+    data.source = file_name
+    return data
+
+
+def predict_file(model_file_name, file_name, workers, all_features=False):
+    """
+    extracts the features of a file and predicts its lines in a pool of processes,
+    every process loads the model once
+
+    :param model_file_name: name of the model file
+    :param file_name: name of the test data file
+    :param workers: number of processes
+    :param all_features: True to extract every feature instead of only the ones the model looks at
+    :return: boolean array with the prediction of every line, True for is_nl
+    """
+    shards = line_shards(file_name, workers * SHARDS_PER_WORKER)
+    with ProcessPoolExecutor(workers, initializer=load_worker_model, initargs=(model_file_name, all_features)) as executor:
+        futures = [executor.submit(predict_shard, file_name, start, stop) for start, stop in shards]
+        predictions = [future.result() for future in futures]
+    if not predictions:
+        return np.zeros(0, dtype=bool)
+    return np.concatenate(predictions)
@@ -1,76 +1,289 @@
+import argparse
+import os
 import sys
-import pickle
-from make_features import Features
 import adaboost as ada
+import ingest
+import parallel
+import server
+from cache import CACHE_SIZE, CachedPredicter, FeatureCache
+from lazy import LazyPredicter
+from dataset import Dataset, as_dataset, extract_matrix, read_chunks
+from metrics import METRICS, Profile
+from model import BoostModel, TreeModel, label_name, label_names, load_model, predict_batch
+
+
+# largest number of lines scored together in stream mode
+STREAM_BATCH_SIZE = 4096
 
 
 def main():
     """
     runs the algorithm on test data using the model stored in file_name 'hypothesis' and prints out the results
-    tree with root = None is a decision tree and tree without None is an adaboost dictionary
+    the model file is in the compiled format, models pickled by older versions are converted when loaded
 
     first command line argument: file_name of file which has the serialized version of the model
-    second command line argument: file_name of file which has the test_data
+    second command line argument: file_name of file which has the test_data, - or nothing reads standard input
+    --stream: print one label per line while the input is read instead of one list at the end
+    --line-numbers: start every streamed label with the number of its line
+    --confidence: follow every streamed label with the probability of is_nl, adaboost models only
+    --batch-size: largest number of lines scored together in stream mode
+    --workers: number of processes extracting features and scoring, the file is split in line aligned shards
+    --all-features: extract every feature of every line in batches instead of only the features the model looks at
+    --cache-size: keep the features and the score of this many lines in memory, so repeated lines are not extracted
+    --cache-file: sqlite file which keeps the cached lines between runs
+    --cache-stats: print the hits and misses of the cache to standard error
+    --serve: path of a unix socket, the model is loaded once and predictions are served until stopped
+    --profile: file the cProfile statistics of the run are written to, the slowest functions are printed
+    --metrics: print the time of every stage and the counters to standard error at the end
+    --metrics-file: file the metrics are written to in the prometheus text format, at the end, and every
+                    metrics.DUMP_INTERVAL seconds in stream mode and by the server
+    --input-format: prefix, tsv or jsonl, see ingest.InputFormat, the language of tsv and jsonl lines is not read
+    --text-field: tsv column or jsonl key with the text
+
+    :return: None
+    """
+    parser = argparse.ArgumentParser(description="predicts the language of every line of the test data")
+    parser.add_argument("hypothesis", help="file with the model")
+    parser.add_argument("test_data", nargs="?", default="-", help="file with the test data, - for standard input")
+    parser.add_argument("--stream", action="store_true", help="print one label per line as the input is read")
+    parser.add_argument("--line-numbers", action="store_true", help="start every streamed label with its line number")
+    parser.add_argument("--confidence", action="store_true",
+                        help="follow every streamed label with the probability of is_nl, adaboost only")
+    parser.add_argument("--batch-size", type=int, default=STREAM_BATCH_SIZE,
+                        help="largest number of lines scored together in stream mode")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="number of processes extracting features and scoring, not used in stream mode")
+    parser.add_argument("--all-features", action="store_true",
+                        help="extract every feature instead of only the ones the model looks at")
+    parser.add_argument("--cache-size", type=int, default=0,
+                        help="lines kept in the cache, no cache if 0, %d is a good size" % CACHE_SIZE)
+    parser.add_argument("--cache-file", help="sqlite file which keeps the cache between runs")
+    parser.add_argument("--cache-stats", action="store_true", help="print the statistics of the cache")
+    parser.add_argument("--serve", metavar="SOCKET", help="serve predictions on a unix socket, see server.py")
+    parser.add_argument("--profile", metavar="FILE", help="write the cProfile statistics of the run to FILE")
+    parser.add_argument("--metrics", action="store_true", help="print the stage timers and counters at the end")
+    parser.add_argument("--metrics-file", help="file the metrics are written to in the prometheus text format")
+    parser.add_argument("--input-format", choices=ingest.FORMATS,
+                        help="layout of the lines, guessed from the extension of test_data if not given")
+    parser.add_argument("--text-field", help="tsv column or jsonl key with the text")
+    args = parser.parse_args()
+
+    if args.serve:
+        with Profile(args.profile):
+            server.serve(args.hypothesis, args.serve, cache_size=args.cache_size, cache_file=args.cache_file,
+                         metrics=args.metrics, metrics_file=args.metrics_file)
+        return
 
+    if args.metrics or args.metrics_file:
+        METRICS.enable(args.metrics_file)
+    with Profile(args.profile):
+        predict_model(args, parser)
+    if args.metrics:
+        print(METRICS.format_summary(), file=sys.stderr)
+    METRICS.dump()
+
+
+def predict_model(args, parser):
+    """
+    loads the model and the cache and prints the predictions
+
+    :param args: parsed command line arguments of main
+    :param parser: the argument parser, for errors
     :return: None
     """
-    hypothesis = sys.argv[1]
-    test_data = sys.argv[2]
-    with open(hypothesis, "rb") as dt:
-        dt_dict = pickle.load(dt)
-    feature_value_mapping = []
-    with open(test_data) as file:
-        for line in file:
-            features = Features()
-            features.make_features(line)
-            feature_value_mapping.append(features.features)
-
-    if None in dt_dict.keys():
-        results = decision_tree_predicter(feature_value_mapping, dt_dict)
+
+    model = load_model(args.hypothesis)
+    if args.confidence and not isinstance(model, BoostModel):
+        parser.error("--confidence needs an adaboost model")
+    cache = None
+    if args.cache_size or args.cache_file:
+        if args.workers > 1:
+            parser.error("the cache can not be used with --workers")
+        cache = FeatureCache(args.cache_size, args.cache_file)
+    try:
+        predict_to_output(args, model, cache)
+    finally:
+        if cache is not None:
+            cache.close()
+            if args.cache_stats:
+                print(cache.format_stats(), file=sys.stderr)
+
+
+def predict_to_output(args, model, cache=None):
+    """
+    prints the predictions of the test data in the way the command line arguments ask for
+
+    :param args: parsed command line arguments of main
+    :param model: TreeModel or BoostModel
+    :param cache: optional FeatureCache
+    :return: None
+    """
+    input_format = ingest.InputFormat.for_file(args.test_data, args.input_format, text_field=args.text_field)
+    # lines of the tsv and jsonl formats are read as their text alone
+    is_test = input_format.kind != "prefix"
+    if args.stream or args.test_data == "-":
+        if args.test_data == "-":
+            # standard input is read line by line so every batch is scored as soon as it comes in
+            lines = ingest.convert_lines(sys.stdin, input_format, is_test)
+        else:
+            lines = ingest.read_lines(args.test_data, input_format, is_test)
+        try:
+            stream_predicter(model, lines, sys.stdout, args.line_numbers, args.batch_size, args.confidence,
+                             args.all_features, cache, is_test)
+        except BrokenPipeError:
+            # the reader of the labels went away, like head does after its lines, so the rest is not predicted
+            # and standard output is pointed at devnull, or python reports the pipe again when it flushes at exit
+            os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
+            sys.exit(1)
+        return
+
+    if cache is not None:
+        print(cached_predicter(model, ingest.read_lines(args.test_data, input_format, is_test), cache, is_test))
+        return
+
+    if args.workers > 1 and ingest.is_plain(args.test_data, input_format):
+        print(label_names(parallel.predict_file(args.hypothesis, args.test_data, args.workers,
+                                                args.all_features)))
+        return
+
+    if not args.all_features:
+        print(lazy_predicter(model, ingest.read_lines(args.test_data, input_format, is_test), is_test))
+        return
+
+    data = Dataset.from_file(args.test_data, is_test, model.spec, input_format)
+
+    if isinstance(model, TreeModel):
+        results = decision_tree_predicter(model, data)
     else:
-        results = adaboost_predicter(dt_dict, feature_value_mapping)
+        results = adaboost_predicter(model, data)
 
     print(results)
 
 
-def adaboost_predicter(dt_dict, feature_value_mapping):
+def adaboost_predicter(model, feature_value_mapping):
     """
-    Calls the adaboost predictor class
+    returns the results of the adaboost predictions
 
-    :param dt_dict: model in the form of a dictionary
-    :param feature_value_mapping: dictionary obtained from make_features
+    :param model: BoostModel
+    :param feature_value_mapping: Dataset or list of dictionaries obtained from make_features
     :return: results of the language classification of the data
     """
-    results = []
-    for entry in feature_value_mapping:
-        results.append(ada.decide(dt_dict, entry))
-    return results
+    return label_names(predict_batch(model, as_dataset(feature_value_mapping)))
 
 
-def decision_tree_predicter(dt_dict, feature_value_mapping):
+def decision_tree_predicter(model, feature_value_mapping):
     """
     returns the results of the decision tree predictions
 
-    :param dt_dict: model in the form of a dictionary
-    :param feature_value_mapping: dictionary obtained from make_features
+    :param model: TreeModel
+    :param feature_value_mapping: Dataset or list of dictionaries obtained from make_features
     :return: results of the language classification of the data
     """
+    return label_names(predict_batch(model, as_dataset(feature_value_mapping)))
+
+
+def lazy_predicter(model, lines, is_test=False):
+    """
+    returns the results of the predictions, only the features the model looks at are computed for a line
+
+    :param model: TreeModel or BoostModel
+    :param lines: iterable of lines
+    :param is_test: True if the lines do not have the language at the start
+    :return: results of the language classification of the lines
+    """
+    return label_names(LazyPredicter(model).predict_lines(lines, is_test))
+
+
+def cached_predicter(model, lines, cache, is_test=False):
+    """
+    returns the results of the predictions, lines which are in the cache are not extracted again
+
+    :param model: TreeModel or BoostModel
+    :param lines: iterable of lines
+    :param cache: FeatureCache
+    :param is_test: True if the lines do not have the language at the start
+    :return: results of the language classification of the lines
+    """
+    predicter = CachedPredicter(model, cache)
     results = []
-    for entry in feature_value_mapping:
-        key = dt_dict[None][0]
-        while True:
-            if key == "True:is_nl" or key == "False:is_nl" or key == "True:is_en" \
-                    or key == "False:is_en":
-                break
-            else:
-                if entry[key]:
-                    key = dt_dict[key][0]
-                else:
-                    key = dt_dict[key][1]
-
-        results.append(key.split(":")[1])
+    for chunk in read_chunks(lines):
+        results.extend(label_names(predicter.predict_lines(chunk, is_test)))
     return results
 
 
+def growing_batches(file, max_size=STREAM_BATCH_SIZE):
+    """
+    reads an open file in lists of lines, the first list has one line and every next list is twice as long
+    up to max_size, so the first result is not held back waiting for a full batch
+
+    :param file: open text file
+    :param max_size: largest number of lines in a list
+    :return: generator of lists of lines
+    """
+    size = 1
+    lines = []
+    for line in file:
+        lines.append(line)
+        if len(lines) >= size:
+            METRICS.count("lines_read", len(lines))
+            yield lines
+            lines = []
+            size = min(size * 2, max_size)
+    if lines:
+        METRICS.count("lines_read", len(lines))
+        yield lines
+
+
+def stream_predicter(model, file, output, line_numbers=False, batch_size=STREAM_BATCH_SIZE, confidence=False,
+                     all_features=False, cache=None, is_test=False):
+    """
+    reads the test data in batches and writes one label per line as soon as its batch is scored,
+    memory does not grow with the size of the input
+
+    :param model: TreeModel or BoostModel
+    :param file: open text file with the test data, or any iterable of its lines
+    :param output: open text file the labels are written to
+    :param line_numbers: True to start every label with the number of its line
+    :param batch_size: largest number of lines scored together
+    :param confidence: True to follow every label with the probability of is_nl, model has to be a BoostModel
+    :param all_features: True to extract every feature instead of only the ones the model looks at
+    :param cache: optional FeatureCache, lines which are in it are not extracted again
+    :param is_test: True if the lines do not have the language at the start
+    :return: number of lines predicted
+    """
+    if cache is not None:
+        predicter = CachedPredicter(model, cache)
+    elif all_features:
+        predicter = None
+    else:
+        predicter = LazyPredicter(model, confidence)
+    line_number = 0
+    for lines in growing_batches(file, batch_size):
+        if predicter is not None and confidence:
+            margins = predicter.margins_lines(lines, is_test)
+        elif predicter is not None:
+            predictions = predicter.predict_lines(lines, is_test)
+        elif confidence:
+            matrix, _ = extract_matrix(lines, is_test, model.spec)
+            margins = model.margins(matrix)
+        else:
+            matrix, _ = extract_matrix(lines, is_test, model.spec)
+            predictions = predict_batch(model, matrix)
+        if confidence:
+            probabilities = ada.margin_to_probability(margins)
+            predictions = margins > 0
+        for i, is_nl in enumerate(predictions.tolist()):
+            line_number += 1
+            result = label_name(is_nl)
+            if confidence:
+                result += "\t%.6f" % probabilities[i]
+            if line_numbers:
+                result = "%d\t%s" % (line_number, result)
+            output.write(result + "\n")
+        output.flush()
+        METRICS.dump_if_due()
+    return line_number
+
+
 if __name__ == "__main__":
     main()
@@ -0,0 +1,299 @@
+import argparse
+import json
+import math
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import adaboost as ada
+import decision_tree as dt
+import evaluate
+import ingest
+import store
+from make_features import DEFAULT_SPEC, FeatureSpec
+from model import BoostModel, predict_batch, save_model
+
+
+# grids searched when none are given, none is a tree without a depth limit
+DEPTHS = "1,2,3,4,6,none"
+ROUNDS = "5,10,20,30"
+# number of folds every configuration is scored on
+FOLDS = 3
+
+class Config:
+    """
+    one point of the search, a learner with its depth or rounds and the features it may use
+    """
+    __slots__ = "learner", "value", "subset"
+
+    def __init__(self, learner, value, subset):
+        """
+        :param learner: dt or ada
+        :param value: maximum depth of dt, math.inf for no limit, or number of rounds of ada
+        :param subset: name of the feature subset
+        """
+        self.learner = learner
+        self.value = value
+        self.subset = subset
+
+    @property
+    def key(self):
+        return self.learner, self.value, self.subset
+
+    def describe(self):
+        if self.learner == "dt":
+            return "depth %s" % ("none" if self.value == math.inf else int(self.value))
+        return "rounds %d" % self.value
+
+
+def parse_grid(text, allow_none=False):
+    """
+    :param text: comma separated integers, and none for no limit if allow_none
+    :return: sorted list of the values, math.inf for none
+    """
+    values = set()
+    for item in text.split(","):
+        item = item.strip().lower()
+        if allow_none and item == "none":
+            values.add(math.inf)
+        elif item:
+            value = int(item)
+            if value < (0 if allow_none else 1):
+                raise ValueError("%s is out of range" % item)
+            values.add(value)
+    return sorted(values)
+
+
+def feature_subsets(spec, subsets=(), drop_one=False):
+    """
+    :param spec: FeatureSpec of the dataset
+    :param subsets: lists of names of features of the spec
+    :param drop_one: True to add every subset which leaves out one feature
+    :return: dictionary of the name of every subset to its FeatureSpec, all is the whole spec
+    """
+    definitions = {definition["name"]: definition for definition in spec.definitions}
+    specs = {"all": spec}
+    if drop_one and len(definitions) > 1:
+        for name in definitions:
+            specs["-" + name] = FeatureSpec([definition for definition in spec.definitions
+                                             if definition["name"] != name])
+    for names in subsets:
+        unknown = [name for name in names if name not in definitions]
+        if unknown:
+            raise ValueError("unknown features " + ", ".join(unknown))
+        specs[",".join(names)] = FeatureSpec([definitions[name] for name in names])
+    return specs
+
+
+def run_job(subset, spec, fold, test_rows, depths, rounds):
+    """
+    scores every depth and every number of rounds of one feature subset on one fold, sharing the work between them:
+    the tree is grown once to the deepest depth and cut at the others with the node counts of its training rows,
+    and adaboost runs the most rounds once, the models with fewer rounds are the first stumps of it
+
+    :param subset: name of the feature subset
+    :param spec: FeatureSpec of the subset
+    :param fold: number of the fold
+    :param test_rows: integer array of the rows held out
+    :param depths: sorted list of depths, may be empty
+    :param rounds: sorted list of rounds, may be empty
+    :return: list of (learner, value, subset, fold, confusion, seconds) tuples, seconds is the share of the job
+    """
+    is_test = np.zeros(len(evaluate.worker_data), dtype=bool)
+    is_test[test_rows] = True
+    data = evaluate.worker_data
+    if spec != data.spec:
+        data = data.select(spec)
+    train = data.take(np.flatnonzero(~is_test))
+    test_matrix = data.matrix(test_rows)
+    test_labels = data.labels[test_rows]
+    results = []
+    if depths:
+        start = time.perf_counter()
+        params = dt.TreeParams()
+        params.max_depth = depths[-1]
+        tree = dt.make_decision_tree(train, params=params)
+        counts = dt.node_counts(tree, train.chunks())
+        for depth in depths:
+            model = tree if depth >= tree.depth() else dt.truncate_tree(tree, depth, counts)
+            results.append(("dt", depth, subset, fold,
+                            evaluate.confusion(test_labels, predict_batch(model, test_matrix))))
+        seconds = (time.perf_counter() - start) / len(depths)
+        results = [result + (seconds,) for result in results]
+    if rounds:
+        start = time.perf_counter()
+        stumps = ada.make_stumps(train, rounds[-1]).stumps()
+        boost_results = []
+        for count in rounds:
+            model = BoostModel.from_stumps(stumps[:count], spec)
+            boost_results.append(("ada", count, subset, fold,
+                                  evaluate.confusion(test_labels, predict_batch(model, test_matrix))))
+        seconds = (time.perf_counter() - start) / len(rounds)
+        results += [result + (seconds,) for result in boost_results]
+    return results
+
+
+def search(data, configs, specs, folds=FOLDS, workers=1, seed=0):
+    """
+    scores configurations with k-fold cross validation, one job per feature subset and fold runs all the
+    depths and rounds of the subset, the jobs run in a pool of processes which get the dataset once
+
+    :param data: Dataset with labels
+    :param configs: list of Config
+    :param specs: dictionary of the name of every subset to its FeatureSpec
+    :param folds: number of folds
+    :param workers: number of processes, the jobs run in this process if 1
+    :param seed: seed of the shuffle which makes the folds
+    :return: list of (Config, scores dictionary) pairs, best first
+    """
+    jobs = []
+    for subset in sorted({config.subset for config in configs}):
+        depths = sorted({config.value for config in configs if config.subset == subset and config.learner == "dt"})
+        rounds = sorted({config.value for config in configs if config.subset == subset and config.learner == "ada"})
+        for fold, test_rows in enumerate(evaluate.fold_indices(len(data), folds, seed)):
+            jobs.append((subset, specs[subset], fold, test_rows, depths, rounds))
+    if workers <= 1:
+        evaluate.load_worker_data(data)
+        try:
+            job_results = [run_job(*job) for job in jobs]
+        finally:
+            evaluate.load_worker_data(None)
+    else:
+        with ProcessPoolExecutor(workers, initializer=evaluate.load_worker_data, initargs=(data,)) as executor:
+            futures = [executor.submit(run_job, *job) for job in jobs]
+            job_results = [future.result() for future in futures]
+
+    wanted = {config.key: config for config in configs}
+    totals = {}
+    for learner, value, subset, fold, cells, seconds in (result for results in job_results for result in results):
+        total = totals.setdefault((learner, value, subset), {"confusion": dict.fromkeys(evaluate.CELLS, 0),
+                                                             "accuracies": [], "seconds": 0.0})
+        for cell in evaluate.CELLS:
+            total["confusion"][cell] += cells[cell]
+        total["accuracies"].append(evaluate.scores(cells)["accuracy"])
+        total["seconds"] += seconds
+    ranked = []
+    for key, total in totals.items():
+        result = evaluate.scores(total["confusion"])
+        result["accuracy_std"] = float(np.std(total["accuracies"]))
+        result["seconds"] = total["seconds"]
+        ranked.append((wanted[key], result))
+    # ties go to the smaller model, fewer features first, then the lower depth or fewer rounds
+    ranked.sort(key=lambda pair: (-pair[1]["accuracy"], len(specs[pair[0].subset]), pair[0].value,
+                                  pair[0].learner))
+    return ranked
+
+
+def format_table(ranked, top=None):
+    """
+    :param ranked: list of (Config, scores dictionary) pairs from search
+    :param top: number of rows printed, all if None
+    :return: table of the configurations, best first
+    """
+    header = "%4s %-8s %-12s %-24s %8s %8s %8s %8s %8s" % ("rank", "learner", "setting", "features", "accuracy",
+                                                        "std", "nl rec", "en rec", "seconds")
+    lines = [header, "-" * len(header)]
+    for rank, (config, result) in enumerate(ranked[:top], 1):
+        lines.append("%4d %-8s %-12s %-24s %8.4f %8.4f %8.4f %8.4f %8.3f" % (
+            rank, config.learner, config.describe(), config.subset[:24], result["accuracy"], result["accuracy_std"],
+            result["nl_recall"], result["en_recall"], result["seconds"]))
+    return "\n".join(lines)
+
+
+def train_best(data, config, spec):
+    """
+    trains the model of a configuration on all the rows
+
+    :param data: Dataset with labels
+    :param config: Config
+    :param spec: FeatureSpec of the feature subset of the configuration
+    :return: TreeModel or BoostModel
+    """
+    if spec != data.spec:
+        data = data.select(spec)
+    if config.learner == "dt":
+        params = dt.TreeParams()
+        params.max_depth = config.value
+        return dt.make_decision_tree(data, params=params)
+    return ada.make_stumps(data, config.value)
+
+
+def main():
+    """
+    searches depths of the decision tree, rounds of adaboost and feature subsets with cross validation,
+    prints the configurations ranked by accuracy and saves the model of the best one trained on all the rows
+
+    :return: None
+    """
+    parser = argparse.ArgumentParser(description="hyperparameter search for the decision tree and adaboost")
+    parser.add_argument("examples", help="file with the labelled data")
+    parser.add_argument("--model-out", help="file the model of the best configuration is written to")
+    parser.add_argument("--learners", default=",".join(evaluate.LEARNERS), help="comma separated learners")
+    parser.add_argument("--depths", default=DEPTHS, help="comma separated depths of the tree, none for no limit")
+    parser.add_argument("--rounds", default=ROUNDS, help="comma separated numbers of adaboost rounds")
+    parser.add_argument("--subset", action="append", default=[], metavar="NAMES",
+                        help="comma separated features to try on their own, can be given more than once")
+    parser.add_argument("--drop-one", action="store_true", help="also try every set of features but one")
+    parser.add_argument("--samples", type=int, help="score this many configurations picked at random from the grid")
+    parser.add_argument("--folds", type=int, default=FOLDS, help="number of folds")
+    parser.add_argument("--workers", type=int, default=1, help="number of processes running the jobs")
+    parser.add_argument("--seed", type=int, default=0, help="seed of the folds and of --samples")
+    parser.add_argument("--top", type=int, help="number of configurations printed")
+    parser.add_argument("--features", metavar="SPEC", help="json file declaring the features, see features.json")
+    parser.add_argument("--input-format", choices=ingest.FORMATS, help="layout of the lines")
+    parser.add_argument("--label-field", help="tsv column or jsonl key with the language")
+    parser.add_argument("--text-field", help="tsv column or jsonl key with the text")
+    parser.add_argument("--feature-store", action="store_true", help="read the features from the store of examples")
+    parser.add_argument("--output", help="json file the ranked configurations are written to")
+    args = parser.parse_args()
+
+    learners = tuple(args.learners.split(","))
+    if not learners or any(learner not in evaluate.LEARNERS for learner in learners):
+        parser.error("--learners has to list dt and ada")
+    if args.folds < 2:
+        parser.error("--folds has to be at least 2")
+    try:
+        depths = parse_grid(args.depths, allow_none=True)
+        rounds = parse_grid(args.rounds)
+    except ValueError as error:
+        parser.error("bad grid: %s" % error)
+    spec = FeatureSpec.from_file(args.features) if args.features else DEFAULT_SPEC
+    try:
+        specs = feature_subsets(spec, [names.split(",") for names in args.subset], args.drop_one)
+    except ValueError as error:
+        parser.error(str(error))
+    configs = [Config(learner, value, subset) for subset in specs for learner in learners
+               for value in (depths if learner == "dt" else rounds)]
+    if args.samples is not None and args.samples < len(configs):
+        picked = np.random.RandomState(args.seed).choice(len(configs), args.samples, replace=False)
+        configs = [configs[i] for i in sorted(picked)]
+    if not configs:
+        parser.error("the grid is empty")
+    input_format = ingest.InputFormat.for_file(args.examples, args.input_format, args.label_field, args.text_field)
+
+    start = time.perf_counter()
+    if args.feature_store:
+        data = store.load_dataset(args.examples, None, spec, input_format, args.workers)
+    else:
+        data = store.read_corpus(args.examples, args.workers, spec, input_format)
+    if len(data) < args.folds:
+        sys.exit("%d rows can not be split in %d folds" % (len(data), args.folds))
+    print("read %d rows in %.2fs" % (len(data), time.perf_counter() - start))
+    start = time.perf_counter()
+    ranked = search(data, configs, specs, args.folds, args.workers, args.seed)
+    print(format_table(ranked, args.top))
+    print("searched %d configurations in %.2fs" % (len(ranked), time.perf_counter() - start))
+    best, result = ranked[0]
+    print("best: %s %s with features %s, accuracy %.4f" % (best.learner, best.describe(), best.subset,
+                                                            result["accuracy"]))
+    if args.model_out:
+        save_model(train_best(data, best, specs[best.subset]), args.model_out)
+        print("saved the best model to " + args.model_out)
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump([dict(result, learner=config.learner, setting=config.describe(), features=config.subset)
+                       for config, result in ranked], file, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+import mmap
+import os
+import struct
+from contextlib import contextmanager
+import numpy as np
+
+
+# name of the section and its length in bytes, the data follows and is padded to 8 bytes
+SECTION = struct.Struct("<8sQ")
+
+
+@contextmanager
+def replace_file(file_name, mode="wb"):
+    """
+    opens a file next to file_name for writing, it replaces file_name at once when the with block ends,
+    so a reader never sees half of it, and is removed if the block fails
+
+    :param file_name: name of the output file
+    :param mode: wb or w
+    :return: context manager of the open file
+    """
+    temp_name = file_name + ".tmp"
+    try:
+        with open(temp_name, mode) as file:
+            yield file
+    except BaseException:
+        os.remove(temp_name)
+        raise
+    os.replace(temp_name, file_name)
+
+
+def write_sections(file_name, header, fields, sections, dtypes):
+    """
+    writes a file of a header and named arrays, the model files and the feature stores use this layout
+
+    :param file_name: name of the output file
+    :param header: struct.Struct of the header, the magic comes first and the number of sections last
+    :param fields: values of the header fields before the number of sections
+    :param sections: dictionary with the name of every section, at most 8 ascii characters, and its array
+    :param dtypes: dictionary with the dtype every section is kept in
+    :return: None
+    """
+    with replace_file(file_name) as file:
+        file.write(header.pack(*fields, len(sections)))
+        for name, array in sections.items():
+            data = np.ascontiguousarray(array, dtype=dtypes[name]).tobytes()
+            file.write(SECTION.pack(name.encode("ascii"), len(data)))
+            file.write(data)
+            file.write(b"\0" * (-len(data) % 8))
+
+
+def read_sections(file_name, header, magic, dtypes):
+    """
+    opens a file written by write_sections, the arrays are memory mapped from the file
+
+    :param file_name: name of the file
+    :param header: struct.Struct of the header
+    :param magic: first bytes of the file
+    :param dtypes: dictionary with the dtype of every section
+    :return: tuple of the header fields between the magic and the number of sections, and a dictionary of the
+             arrays by name, None if the file does not start with magic
+    """
+    with open(file_name, "rb") as file:
+        if file.read(len(magic)) != magic:
+            return None
+        buffer = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+    fields = header.unpack_from(buffer, 0)
+    offset = header.size
+    sections = {}
+    for _ in range(fields[-1]):
+        name, length = SECTION.unpack_from(buffer, offset)
+        name = name.rstrip(b"\0").decode("ascii")
+        offset += SECTION.size
+        dtype = np.dtype(dtypes[name])
+        sections[name] = np.frombuffer(buffer, dtype=dtype, count=length // dtype.itemsize, offset=offset)
+        offset += length + (-length % 8)
+    return fields[1:-1], sections
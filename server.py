@@ -0,0 +1,291 @@
+import argparse
+import asyncio
+import json
+import os
+import socket
+import sys
+from cache import CachedPredicter, FeatureCache
+from lazy import LazyPredicter
+from metrics import METRICS
+from model import label_names, load_model
+
+
+# most texts scored together by the server
+MAX_BATCH_SIZE = 1024
+# longest time in milliseconds a request waits for other requests to share its batch
+MAX_WAIT_MS = 2.0
+# longest request line the server reads
+MAX_LINE_LENGTH = 1 << 24
+
+
+class MicroBatcher:
+    """
+    collects the texts of concurrent requests and scores them together,
+    a batch is scored when it has max_batch_size texts or its first request has waited max_wait_ms
+    """
+
+    def __init__(self, model, max_batch_size=MAX_BATCH_SIZE, max_wait_ms=MAX_WAIT_MS, cache=None):
+        self.model = model
+        self.predicter = LazyPredicter(model) if cache is None else CachedPredicter(model, cache)
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.queue = asyncio.Queue()
+
+    async def predict(self, texts):
+        """
+        :param texts: list of texts without the language at the start
+        :return: list of is_nl and is_en
+        """
+        future = asyncio.get_running_loop().create_future()
+        await self.queue.put((texts, future))
+        return await future
+
+    async def run(self):
+        """
+        scores batches until it is cancelled
+        """
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self.queue.get()]
+            count_texts = len(batch[0][0])
+            deadline = loop.time() + self.max_wait
+            while count_texts < self.max_batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0 and self.queue.empty():
+                    break
+                try:
+                    request = await asyncio.wait_for(self.queue.get(), max(timeout, 0))
+                except asyncio.TimeoutError:
+                    break
+                batch.append(request)
+                count_texts += len(request[0])
+            self.score(batch)
+
+    def score(self, batch):
+        """
+        :param batch: list of (texts, future) pairs, every future gets the labels of its texts
+        :return: None
+        """
+        texts = [text for request_texts, _ in batch for text in request_texts]
+        METRICS.count("requests", len(batch))
+        try:
+            with METRICS.timer("batch"):
+                labels = label_names(self.predicter.predict_lines(texts, is_test=True))
+        except Exception as error:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(error)
+            return
+        finally:
+            METRICS.dump_if_due()
+        start = 0
+        for request_texts, future in batch:
+            if not future.done():
+                future.set_result(labels[start:start + len(request_texts)])
+            start += len(request_texts)
+
+
+async def handle_connection(batcher, reader, writer):
+    """
+    answers the requests of one connection, every request and every response is a line of json
+    {"text": "..."} is answered with {"label": "is_nl"} and {"texts": [...]} with {"labels": [...]}
+    {"metrics": true} is answered with {"metrics": "..."}, the metrics in the prometheus text format
+    and a request which is not one of those with {"error": "..."}
+
+    :param batcher: MicroBatcher
+    :param reader: stream of the connection
+    :param writer: stream of the connection
+    :return: None
+    """
+    try:
+        while True:
+            try:
+                line = await reader.readline()
+            except (ValueError, asyncio.LimitOverrunError):
+                # the rest of an over long line can not be told apart from the next request, so the connection ends
+                response = {"error": "request is longer than %d bytes" % MAX_LINE_LENGTH}
+                writer.write((json.dumps(response) + "\n").encode("utf-8"))
+                await writer.drain()
+                break
+            if not line:
+                break
+            try:
+                request = json.loads(line)
+                if not isinstance(request, dict):
+                    response = {"error": "request must be a json object"}
+                elif "texts" in request:
+                    texts = request["texts"]
+                    if isinstance(texts, list) and all(isinstance(text, str) for text in texts):
+                        response = {"labels": await batcher.predict(texts)}
+                    else:
+                        response = {"error": "texts must be a list of strings"}
+                elif "text" in request:
+                    if isinstance(request["text"], str):
+                        response = {"label": (await batcher.predict([request["text"]]))[0]}
+                    else:
+                        response = {"error": "text must be a string"}
+                elif "metrics" in request:
+                    if METRICS.enabled:
+                        response = {"metrics": METRICS.format_prometheus()}
+                    else:
+                        response = {"error": "the server was started without metrics"}
+                else:
+                    response = {"error": "request needs text or texts"}
+            except (ValueError, TypeError) as error:
+                response = {"error": str(error)}
+            writer.write((json.dumps(response) + "\n").encode("utf-8"))
+            await writer.drain()
+    except ConnectionError:
+        pass
+    finally:
+        writer.close()
+
+
+async def serve_forever(model, socket_path, max_batch_size=MAX_BATCH_SIZE, max_wait_ms=MAX_WAIT_MS, cache=None):
+    """
+    listens on a unix socket until the process is stopped
+
+    :param model: TreeModel or BoostModel
+    :param socket_path: path of the unix socket, an old socket file is replaced
+    :param max_batch_size: most texts scored together
+    :param max_wait_ms: longest time a request waits for other requests
+    :param cache: optional FeatureCache of the texts
+    :return: None
+    """
+    batcher = MicroBatcher(model, max_batch_size, max_wait_ms, cache)
+    batch_task = asyncio.ensure_future(batcher.run())
+    if os.path.exists(socket_path):
+        os.unlink(socket_path)
+    server = await asyncio.start_unix_server(lambda reader, writer: handle_connection(batcher, reader, writer),
+                                             socket_path, limit=MAX_LINE_LENGTH)
+    print("serving on " + socket_path, file=sys.stderr)
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        batch_task.cancel()
+
+
+def serve(model_file_name, socket_path, max_batch_size=MAX_BATCH_SIZE, max_wait_ms=MAX_WAIT_MS, cache_size=0,
+          cache_file=None, metrics=False, metrics_file=None):
+    """
+    loads the model once and serves predictions on a unix socket
+
+    :param model_file_name: name of the model file
+    :param socket_path: path of the unix socket
+    :param max_batch_size: most texts scored together
+    :param max_wait_ms: longest time a request waits for other requests
+    :param cache_size: texts kept in the cache, no cache if 0 and there is no cache_file
+    :param cache_file: optional sqlite file which keeps the cache between runs
+    :param metrics: True to count and time the requests, they are answered to {"metrics": true}
+    :param metrics_file: optional file the metrics are written to every metrics.DUMP_INTERVAL seconds and on exit,
+                         it turns on metrics
+    :return: None
+    """
+    if metrics or metrics_file:
+        METRICS.enable(metrics_file)
+    model = load_model(model_file_name)
+    cache = None
+    if cache_size or cache_file:
+        cache = FeatureCache(cache_size, cache_file)
+    try:
+        asyncio.run(serve_forever(model, socket_path, max_batch_size, max_wait_ms, cache))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if cache is not None:
+            cache.close()
+            print(cache.format_stats(), file=sys.stderr)
+        METRICS.dump()
+
+
+class Client:
+    """
+    blocking client for the prediction server, for testing and scripts
+    """
+
+    def __init__(self, socket_path):
+        self.socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.socket.connect(socket_path)
+        self.file = self.socket.makefile("rwb")
+
+    def request(self, request):
+        """
+        :param request: dictionary sent as a line of json
+        :return: dictionary of the response
+        """
+        self.file.write((json.dumps(request) + "\n").encode("utf-8"))
+        self.file.flush()
+        response = json.loads(self.file.readline())
+        if "error" in response:
+            raise ValueError(response["error"])
+        return response
+
+    def predict(self, text):
+        """
+        :param text: a single text
+        :return: is_nl or is_en
+        """
+        return self.request({"text": text})["label"]
+
+    def predict_many(self, texts):
+        """
+        :param texts: list of texts
+        :return: list of is_nl and is_en
+        """
+        return self.request({"texts": list(texts)})["labels"]
+
+    def metrics(self):
+        """
+        :return: metrics of the server in the prometheus text format
+        """
+        return self.request({"metrics": True})["metrics"]
+
+    def close(self):
+        self.file.close()
+        self.socket.close()
+
+
+def main():
+    """
+    serve: loads the model and answers requests on the unix socket
+    client: sends the texts given on the command line, or the lines of standard input, and prints the labels,
+            or prints the metrics of the server with --metrics
+
+    :return: None
+    """
+    parser = argparse.ArgumentParser(description="prediction server with a model which is loaded once")
+    commands = parser.add_subparsers(dest="command")
+    serve_parser = commands.add_parser("serve", help="serve predictions on a unix socket")
+    serve_parser.add_argument("hypothesis", help="file with the model")
+    serve_parser.add_argument("socket", help="path of the unix socket")
+    serve_parser.add_argument("--max-batch-size", type=int, default=MAX_BATCH_SIZE)
+    serve_parser.add_argument("--max-wait-ms", type=float, default=MAX_WAIT_MS)
+    serve_parser.add_argument("--cache-size", type=int, default=0, help="texts kept in the cache, no cache if 0")
+    serve_parser.add_argument("--cache-file", help="sqlite file which keeps the cache between runs")
+    serve_parser.add_argument("--metrics", action="store_true", help="count and time the requests")
+    serve_parser.add_argument("--metrics-file", help="file the metrics are written to in the prometheus text format")
+    client_parser = commands.add_parser("client", help="send texts to a running server")
+    client_parser.add_argument("socket", help="path of the unix socket")
+    client_parser.add_argument("texts", nargs="*", help="texts to predict, standard input is read if none are given")
+    client_parser.add_argument("--metrics", action="store_true", help="print the metrics of the server")
+    args = parser.parse_args()
+
+    if args.command == "serve":
+        serve(args.hypothesis, args.socket, args.max_batch_size, args.max_wait_ms, args.cache_size, args.cache_file,
+              args.metrics, args.metrics_file)
+    elif args.command == "client":
+        client = Client(args.socket)
+        if args.metrics:
+            print(client.metrics(), end="")
+        else:
+            texts = args.texts or [line.rstrip("\n") for line in sys.stdin]
+            for label in client.predict_many(texts):
+                print(label)
+        client.close()
+    else:
+        parser.print_help()
+
+
+if __name__ == "__main__":
+    main()
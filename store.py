@@ -0,0 +1,290 @@
+import argparse
+import hashlib
+import json
+import os
+import struct
+import sys
+import time
+import numpy as np
+import ingest
+import parallel
+from dataset import Dataset, SparseMatrix
+from make_features import DEFAULT_SPEC, FeatureSpec
+from sections import read_sections, write_sections
+
+
+# first bytes of every feature store file
+MAGIC = b"LDFEATS\0"
+FORMAT_VERSION = 1
+
+# magic, format version, number of sections
+HEADER = struct.Struct("<8sII")
+
+SECTION_DTYPES = {"meta": np.uint8,
+                  "spec": np.uint8,
+                  "labels": np.uint8,
+                  "bits": np.uint8,
+                  "indptr": np.dtype("<i8"),
+                  "indices": np.dtype("<i4"),
+                  }
+
+# bytes of the corpus hashed at a time
+HASH_BLOCK_SIZE = 1 << 20
+# extension of the store next to the corpus, after the version of the feature spec
+STORE_EXTENSION = ".features"
+
+
+class FeatureStore:
+    """
+    features and labels of a training corpus extracted once and kept in a file next to it, the arrays are memory
+    mapped when it is opened, so training another model on the same corpus skips the extraction
+    the store belongs to the content of the corpus, the feature spec and the input format, see key
+    """
+    __slots__ = "file_name", "meta", "data"
+
+    def __init__(self, file_name, meta, data):
+        """
+        :param file_name: name of the store file
+        :param meta: dictionary with the key, the source and the number of rows
+        :param data: Dataset of the rows
+        """
+        self.file_name = file_name
+        self.meta = meta
+        self.data = data
+
+    @property
+    def key(self):
+        return self.meta["corpus_hash"], self.meta["spec_version"], self.meta["input_format"]
+
+    def is_fresh(self, corpus_file_name, spec, input_format=ingest.DEFAULT_FORMAT):
+        """
+        :return: True if the store holds the features of the corpus as it is now
+        """
+        return self.key == key(corpus_file_name, spec, input_format)
+
+
+def corpus_hash(file_name):
+    """
+    :param file_name: name of the corpus
+    :return: digest of the bytes of the file, as they are on disk
+    """
+    digest = hashlib.blake2b(digest_size=16)
+    with open(file_name, "rb") as file:
+        while True:
+            block = file.read(HASH_BLOCK_SIZE)
+            if not block:
+                break
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def format_name(input_format):
+    """
+    :param input_format: ingest.InputFormat
+    :return: the kind and the fields of the format in one string
+    """
+    return "%s:%s:%s" % (input_format.kind, input_format.label_field, input_format.text_field)
+
+
+def key(file_name, spec, input_format=ingest.DEFAULT_FORMAT):
+    """
+    :return: what a store of the corpus has to match, the hash of the corpus, the version of the spec and the format
+    """
+    return corpus_hash(file_name), spec.version, format_name(input_format)
+
+
+def store_path(file_name, spec=DEFAULT_SPEC):
+    """
+    :param file_name: name of the corpus
+    :param spec: FeatureSpec of the features
+    :return: name of the store next to the corpus, every spec has its own
+    """
+    return "%s.%s%s" % (file_name, spec.version, STORE_EXTENSION)
+
+
+def read_corpus(file_name, workers=1, spec=DEFAULT_SPEC, input_format=ingest.DEFAULT_FORMAT):
+    """
+    extracts the features of a training corpus, in a pool of processes when workers is above 1 and the file
+    can be split in shards of lines
+
+    :return: Dataset
+    """
+    if workers > 1 and ingest.is_plain(file_name, input_format):
+        return parallel.read_dataset(file_name, workers, spec=spec)
+    return Dataset.from_file(file_name, spec=spec, input_format=input_format)
+
+
+def write_store(file_name, data, meta):
+    """
+    writes the rows of a dataset with write_sections
+
+    :param file_name: name of the store file
+    :param data: Dataset with labels
+    :param meta: dictionary which is kept as json
+    :return: None
+    """
+    sections = {"meta": np.frombuffer(json.dumps(meta, sort_keys=True).encode("utf-8"), dtype=np.uint8),
+                "spec": np.frombuffer(data.spec.to_json().encode("utf-8"), dtype=np.uint8),
+                "labels": np.packbits(data.labels)}
+    if isinstance(data.bits, SparseMatrix):
+        sections["indptr"] = data.bits.indptr
+        sections["indices"] = data.bits.indices
+    else:
+        sections["bits"] = data.bits
+    write_sections(file_name, HEADER, (MAGIC, FORMAT_VERSION), sections, SECTION_DTYPES)
+
+
+def open_store(file_name):
+    """
+    opens a store, the feature arrays are memory mapped from the file
+
+    :param file_name: name of the store file
+    :return: FeatureStore
+    """
+    stored = read_sections(file_name, HEADER, MAGIC, SECTION_DTYPES)
+    if stored is None:
+        raise ValueError(file_name + " is not a feature store")
+    (version,), sections = stored
+    if version > FORMAT_VERSION:
+        raise ValueError("feature store format version %d is newer than the supported version %d"
+                         % (version, FORMAT_VERSION))
+    meta = json.loads(sections["meta"].tobytes().decode("utf-8"))
+    spec = FeatureSpec.from_json(sections["spec"].tobytes().decode("utf-8"))
+    n_rows = meta["n_rows"]
+    labels = np.unpackbits(sections["labels"], count=n_rows).astype(bool)
+    if "indptr" in sections:
+        bits = SparseMatrix(sections["indptr"], sections["indices"], len(spec))
+    else:
+        bits = sections["bits"].reshape(-1, len(spec))
+    input_format = ingest.InputFormat(*meta["input_format"].split(":", 2))
+    return FeatureStore(file_name, meta, Dataset(bits, labels, n_rows, spec, meta["source"], input_format=input_format))
+
+
+def build_store(corpus_file_name, file_name=None, spec=DEFAULT_SPEC, input_format=ingest.DEFAULT_FORMAT, workers=1,
+                corpus_key=None):
+    """
+    extracts the features of a corpus and writes them to a store
+
+    :param corpus_file_name: name of the training corpus
+    :param file_name: name of the store file, store_path of the corpus if None
+    :param spec: FeatureSpec of the features
+    :param input_format: ingest.InputFormat of the lines of the corpus
+    :param workers: number of processes extracting the features
+    :param corpus_key: key of the corpus when the caller has it already, the corpus is hashed if None
+    :return: FeatureStore, opened from the file
+    """
+    if corpus_file_name == "-":
+        raise ValueError("standard input can not be kept in a feature store")
+    file_name = file_name or store_path(corpus_file_name, spec)
+    corpus_key = corpus_key or key(corpus_file_name, spec, input_format)
+    data = read_corpus(corpus_file_name, workers, spec, input_format)
+    meta = {"corpus_hash": corpus_key[0], "spec_version": corpus_key[1], "input_format": corpus_key[2],
+            "source": os.path.abspath(corpus_file_name), "n_rows": len(data), "n_features": len(spec),
+            "created": time.time()}
+    write_store(file_name, data, meta)
+    return open_store(file_name)
+
+
+def load_dataset(corpus_file_name, file_name=None, spec=DEFAULT_SPEC, input_format=ingest.DEFAULT_FORMAT, workers=1):
+    """
+    gives the rows of a corpus from its store, the store is made, or made again when the corpus, the spec or the
+    format changed since it was written
+
+    :param corpus_file_name: name of the training corpus
+    :param file_name: name of the store file, store_path of the corpus if None
+    :param spec: FeatureSpec of the features
+    :param input_format: ingest.InputFormat of the lines of the corpus
+    :param workers: number of processes extracting the features when the store is made
+    :return: Dataset, memory mapped from the store
+    """
+    file_name = file_name or store_path(corpus_file_name, spec)
+    corpus_key = key(corpus_file_name, spec, input_format)
+    if os.path.exists(file_name):
+        feature_store = open_store(file_name)
+        if feature_store.key == corpus_key:
+            return feature_store.data
+    return build_store(corpus_file_name, file_name, spec, input_format, workers, corpus_key).data
+
+
+def describe(feature_store):
+    """
+    :param feature_store: FeatureStore
+    :return: lines about the store and whether the corpus it was made from changed since
+    """
+    meta = feature_store.meta
+    data = feature_store.data
+    lines = ["store         %s" % feature_store.file_name,
+             "source        %s" % meta["source"],
+             "rows          %d (%d is_nl)" % (meta["n_rows"], int(data.labels.sum())),
+             "features      %d%s" % (meta["n_features"], ", sparse" if data.spec.sparse else ""),
+             "spec version  %s" % meta["spec_version"],
+             "input format  %s" % meta["input_format"],
+             "corpus hash   %s" % meta["corpus_hash"],
+             "size          %d bytes" % os.path.getsize(feature_store.file_name),
+             "created       %s" % time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(meta["created"]))]
+    if not os.path.exists(meta["source"]):
+        state = "source missing"
+    elif corpus_hash(meta["source"]) == meta["corpus_hash"]:
+        state = "fresh"
+    else:
+        state = "stale, the source changed"
+    lines.append("state         %s" % state)
+    return "\n".join(lines)
+
+
+def main():
+    """
+    build: extracts the features of a corpus into its store
+    inspect: prints what a store holds and whether its corpus changed
+    invalidate: removes the store of a corpus, the next training with --feature-store extracts again
+
+    :return: None
+    """
+    parser = argparse.ArgumentParser(description="feature stores which keep the extracted features of a corpus")
+    commands = parser.add_subparsers(dest="command")
+    build_parser = commands.add_parser("build", help="extract the features of a corpus into a store")
+    inspect_parser = commands.add_parser("inspect", help="print what a store holds")
+    invalidate_parser = commands.add_parser("invalidate", help="remove the store of a corpus")
+    for command_parser in (build_parser, invalidate_parser):
+        command_parser.add_argument("examples", help="file with the training data")
+        command_parser.add_argument("--store-file", help="file of the store, next to the corpus by default")
+        command_parser.add_argument("--features", metavar="SPEC", help="json file declaring the features")
+    build_parser.add_argument("--workers", type=int, default=1, help="number of processes extracting the features")
+    build_parser.add_argument("--input-format", choices=ingest.FORMATS, help="layout of the lines")
+    build_parser.add_argument("--label-field", help="tsv column or jsonl key with the language")
+    build_parser.add_argument("--text-field", help="tsv column or jsonl key with the text")
+    inspect_parser.add_argument("store_file", help="file of the store, or a corpus whose store is next to it")
+    inspect_parser.add_argument("--features", metavar="SPEC", help="json file declaring the features of a corpus")
+    args = parser.parse_args()
+
+    if args.command is None:
+        parser.print_help()
+        return
+    spec = FeatureSpec.from_file(args.features) if args.features else DEFAULT_SPEC
+    if args.command == "build":
+        input_format = ingest.InputFormat.for_file(args.examples, args.input_format, args.label_field,
+                                                   args.text_field)
+        start = time.perf_counter()
+        feature_store = build_store(args.examples, args.store_file, spec, input_format, args.workers)
+        print(describe(feature_store))
+        print("built in %.2fs" % (time.perf_counter() - start))
+    elif args.command == "inspect":
+        file_name = args.store_file
+        if os.path.exists(file_name):
+            with open(file_name, "rb") as file:
+                if file.read(len(MAGIC)) != MAGIC:
+                    file_name = store_path(file_name, spec)
+        if not os.path.exists(file_name):
+            sys.exit("no feature store " + file_name)
+        print(describe(open_store(file_name)))
+    else:
+        file_name = args.store_file or store_path(args.examples, spec)
+        if os.path.exists(file_name):
+            os.remove(file_name)
+            print("removed " + file_name)
+        else:
+            print("no feature store " + file_name)
+
+
+if __name__ == "__main__":
+    main()
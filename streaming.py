@@ -0,0 +1,293 @@
+import math
+import os
+import tempfile
+import numpy as np
+import adaboost as ada
+import decision_tree as dt
+import ingest
+from dataset import CHUNK_SIZE, SparseMatrix, extract_matrix
+from make_features import DEFAULT_SPEC
+from metrics import METRICS
+from model import BoostModel, TreeModel
+
+
+# feature values unpacked at a time in a pass over the data, bounds the memory of a pass whatever the number of rows
+PASS_CHUNK_VALUES = 1 << 22
+
+
+def chunk_rows(n_features):
+    """
+    :param n_features: number of features
+    :return: number of rows read at a time, a multiple of 8 so packed chunks line up
+    """
+    return max(8, min(CHUNK_SIZE, PASS_CHUNK_VALUES // max(n_features, 1)) // 8 * 8)
+
+
+def dense_chunks(file_name, spec, input_format=ingest.DEFAULT_FORMAT):
+    """
+    reads a training file in chunks and extracts their features
+
+    :param file_name: name of the training file, lines start with the language
+    :param spec: FeatureSpec of the features
+    :param input_format: ingest.InputFormat of the lines
+    :return: generator of (uint8 array of 0 and 1 with shape (rows, features), boolean label array) pairs
+    """
+    for lines in ingest.read_batches(file_name, input_format, batch_size=chunk_rows(len(spec))):
+        matrix, labels = extract_matrix(lines, spec=spec)
+        if isinstance(matrix, SparseMatrix):
+            matrix = matrix.toarray()
+        yield matrix.astype(np.uint8), labels
+
+
+class TextSource:
+    """
+    training data which is read from the text file and extracted again in every pass,
+    the rows are counted by the first pass, so n_rows is None until then
+    """
+    __slots__ = "file_name", "spec", "n_rows", "input_format"
+
+    def __init__(self, file_name, spec=DEFAULT_SPEC, input_format=ingest.DEFAULT_FORMAT):
+        self.file_name = file_name
+        self.spec = spec
+        self.input_format = input_format
+        self.n_rows = None
+
+    def chunks(self):
+        n_rows = 0
+        for matrix, labels in dense_chunks(self.file_name, self.spec, self.input_format):
+            n_rows += len(labels)
+            yield matrix, labels
+        self.n_rows = n_rows
+
+
+class SpillFile:
+    """
+    training data extracted once and spilled to a file of fixed size records, every record is a label byte
+    followed by the features of the row packed 8 to a byte, so a pass reads bits instead of text
+    """
+    __slots__ = "file_name", "spec", "n_rows", "record_size"
+
+    def __init__(self, file_name, spec, n_rows):
+        self.file_name = file_name
+        self.spec = spec
+        self.n_rows = n_rows
+        self.record_size = 1 + (len(spec) + 7) // 8
+
+    @classmethod
+    def write(cls, text_file_name, file_name, spec=DEFAULT_SPEC, input_format=ingest.DEFAULT_FORMAT):
+        """
+        extracts the features of a training file chunk by chunk and writes the records
+
+        :param text_file_name: name of the training file, lines start with the language
+        :param file_name: name of the spill file
+        :param spec: FeatureSpec of the features
+        :param input_format: ingest.InputFormat of the lines of the training file
+        :return: the spill file
+        """
+        n_rows = 0
+        with open(file_name, "wb") as file:
+            for matrix, labels in dense_chunks(text_file_name, spec, input_format):
+                records = np.column_stack((labels.astype(np.uint8), np.packbits(matrix, axis=1)))
+                file.write(records.tobytes())
+                n_rows += len(labels)
+        return cls(file_name, spec, n_rows)
+
+    def chunks(self):
+        """
+        :return: generator of (uint8 array of 0 and 1 with shape (rows, features), boolean label array) pairs
+        """
+        rows = chunk_rows(len(self.spec))
+        with open(self.file_name, "rb") as file:
+            while True:
+                records = np.fromfile(file, dtype=np.uint8, count=rows * self.record_size)
+                if not len(records):
+                    break
+                records = records.reshape(-1, self.record_size)
+                yield np.unpackbits(records[:, 1:], axis=1, count=len(self.spec)), records[:, 0].astype(bool)
+
+
+def route(nodes, matrix, levels):
+    """
+    walks the rows of a chunk down the tree built so far
+
+    :param nodes: list of [feature, left, right, value] lists, nodes which are not split yet have feature -1
+    :param matrix: uint8 array of 0 and 1 with shape (rows, features)
+    :param levels: number of levels the tree has so far
+    :return: array with the node every row reaches
+    """
+    nodes = np.array(nodes, dtype=np.intp).reshape(-1, 4)
+    is_leaf = nodes[:, 0] < 0
+    node_range = np.arange(len(nodes))
+    feature = np.where(is_leaf, 0, nodes[:, 0])
+    left = np.where(is_leaf, node_range, nodes[:, 1])
+    right = np.where(is_leaf, node_range, nodes[:, 2])
+    row_range = np.arange(len(matrix))
+    reached = np.zeros(len(matrix), dtype=np.intp)
+    for _ in range(levels):
+        reached = np.where(matrix[row_range, feature[reached]], left[reached], right[reached])
+    return reached
+
+
+def frontier_counts(source, nodes, frontier, levels):
+    """
+    one pass over the data counting the labels of the rows which reach every node of the frontier
+
+    :param source: SpillFile or TextSource
+    :param nodes: list of [feature, left, right, value] lists
+    :param frontier: list of the nodes which are not split yet
+    :param levels: number of levels the tree has so far
+    :return:    array of shape (frontier nodes, features, 2) with the is_nl and is_en counts where a feature is True
+                array of shape (frontier nodes, 2) with the is_nl and is_en counts of all the rows of the node
+    """
+    n_features = len(source.spec)
+    position = np.full(len(nodes), -1, dtype=np.intp)
+    position[frontier] = np.arange(len(frontier))
+    pos_counts = np.zeros((len(frontier) * 2, n_features))
+    totals = np.zeros(len(frontier) * 2)
+    for matrix, labels in source.chunks():
+        group = position[route(nodes, matrix, levels)] * 2 + ~labels
+        keep = group >= 0
+        group = group[keep]
+        order = np.argsort(group, kind="stable")
+        group = group[order]
+        starts = np.flatnonzero(np.append(True, group[1:] != group[:-1])[:len(group)])
+        if len(starts):
+            pos_counts[group[starts]] += np.add.reduceat(matrix[keep][order], starts, axis=0, dtype=np.int64)
+        totals += np.bincount(group, minlength=len(totals))
+    return pos_counts.reshape(len(frontier), 2, n_features).transpose(0, 2, 1), totals.reshape(-1, 2)
+
+
+def stream_decision_tree(source, params=dt.DEFAULT_PARAMS):
+    """
+    builds the decision tree a level at a time, every level is one pass over the data which only keeps
+    the label counts of every feature in every node of the level, no row is kept in memory
+    the tree is the same as the one make_decision_tree makes from the same data
+
+    :param source: SpillFile or TextSource
+    :param params: TreeParams limiting the growth of the tree
+    :return: TreeModel
+    """
+    nodes = [[-1, -1, -1, -1]]
+    frontier = [0]
+    used = {0: frozenset()}
+    levels = 0
+    while frontier:
+        with METRICS.timer("pass"):
+            pos_counts, totals = frontier_counts(source, nodes, frontier, levels)
+        METRICS.count("nodes_built", len(frontier))
+        next_frontier = []
+        for position, node in enumerate(frontier):
+            a_count, b_count = totals[position]
+            prob = dt.calculate_probability(a_count, b_count)
+            feat_index = None
+            if prob != 0 and prob != 1 and levels < params.max_depth and \
+                    a_count + b_count >= params.min_samples_split and len(used[node]) < len(source.spec):
+                feat_index = dt.best_feature_of_counts(pos_counts[position], totals[position], used[node],
+                                                       params.min_samples_leaf, params.min_gain)
+            if feat_index is None:
+                nodes[node][3] = int(prob >= 0.5)
+                continue
+            nodes[node] = [feat_index, len(nodes), len(nodes) + 1, -1]
+            for _ in range(2):
+                used[len(nodes)] = used[node] | {feat_index}
+                next_frontier.append(len(nodes))
+                nodes.append([-1, -1, -1, -1])
+        frontier = next_frontier
+        levels += 1
+    return TreeModel.from_nodes(dt.preorder(nodes), source.spec)
+
+
+def weighted_sums(source, model):
+    """
+    one pass over the data summing the adaboost weights of the rows per feature and label,
+    the weight of a row is exp(-y * margin) with y 1 for is_nl and -1 for is_en, and the margin of the stumps so far,
+    which is the weight the rounds of make_stumps give the row, the sums are scaled so the largest weight is 1
+
+    :param source: SpillFile or TextSource
+    :param model: BoostModel of the stumps so far
+    :return:    array of shape (features, 2) with the is_nl and is_en weight of the rows where a feature is True
+                is_nl and is_en weight of all the rows
+    """
+    pos_weights = np.zeros((len(source.spec), 2))
+    totals = np.zeros(2)
+    shift = -math.inf
+    for matrix, labels in source.chunks():
+        exponents = np.where(labels, -1.0, 1.0) * model.margins(matrix)
+        if not len(exponents):
+            continue
+        if exponents.max() > shift:
+            scale = math.exp(shift - exponents.max())
+            pos_weights *= scale
+            totals *= scale
+            shift = exponents.max()
+        weights = np.exp(exponents - shift)
+        targets = np.column_stack((labels, ~labels)) * weights[:, None]
+        pos_weights += matrix.T @ targets
+        totals += targets.sum(axis=0)
+    return pos_weights, totals
+
+
+def stream_stumps(source, rounds=ada.NUMBER_OF_STUMPS):
+    """
+    makes the adaboost stumps with one pass over the data per round, which only keeps the weighted label sums
+    of every feature, the weights of the rows are worked out from the stumps so far instead of being kept
+
+    :param source: SpillFile or TextSource
+    :param rounds: number of stumps to make
+    :return: BoostModel
+    """
+    stumps = []
+    for _ in range(rounds):
+        with METRICS.timer("pass"):
+            pos_weights, totals = weighted_sums(source, BoostModel.from_stumps(stumps, source.spec))
+        if not totals.any():
+            # no rows, the largest weight is scaled to 1 otherwise
+            break
+        METRICS.count("rounds")
+        METRICS.count("stumps_evaluated", len(source.spec))
+        feat_index, pos_conclusion, neg_conclusion, error = ada.best_stump_of_weights(pos_weights, totals)
+        error /= totals.sum()
+        if error >= 0.5:
+            break
+        stumps.append((feat_index, pos_conclusion, neg_conclusion, ada.find_amount_of_say(error)))
+        if error <= 0:
+            break
+    return BoostModel.from_stumps(stumps, source.spec)
+
+
+def train(input_file_name, learn_type, rounds=ada.NUMBER_OF_STUMPS, spec=DEFAULT_SPEC, spill=True,
+          spill_file_name=None, params=dt.DEFAULT_PARAMS, validation=None, input_format=ingest.DEFAULT_FORMAT):
+    """
+    trains a model without keeping the rows in memory
+
+    :param input_file_name: name of the training file
+    :param learn_type: dt for decision tree or ada for adaboost
+    :param rounds: number of adaboost stumps
+    :param spec: FeatureSpec of the features
+    :param spill: True to extract the features once into a spill file, False to extract them again in every pass
+    :param spill_file_name: name of the spill file, a temporary file if None, it is removed after training
+    :param params: TreeParams limiting the growth of the decision tree
+    :param validation: optional Dataset of held out rows the decision tree is pruned against
+    :param input_format: ingest.InputFormat of the lines of the training file
+    :return: TreeModel or BoostModel
+    """
+    if learn_type not in ("dt", "ada"):
+        raise ValueError("type of model has to be dt or ada, not " + learn_type)
+    if not spill:
+        source = TextSource(input_file_name, spec, input_format)
+    else:
+        if spill_file_name is None:
+            handle, spill_file_name = tempfile.mkstemp(suffix=".spill")
+            os.close(handle)
+        source = SpillFile.write(input_file_name, spill_file_name, spec, input_format)
+    try:
+        if learn_type == "ada":
+            return stream_stumps(source, rounds)
+        model = stream_decision_tree(source, params)
+        if validation is not None:
+            model = dt.prune_tree(model, dt.node_counts(model, source.chunks()),
+                                  dt.node_counts(model, validation.chunks()))
+        return model
+    finally:
+        if spill:
+            os.remove(spill_file_name)
@@ -0,0 +1,41 @@
+import numpy as np
+import pytest
+import adaboost as ada
+from dataset import Dataset
+from make_features import FeatureSpec
+
+
+SPEC = FeatureSpec([{"name": "f%d" % i, "type": "keyword", "words": ["w%d" % i]} for i in range(8)])
+
+
+def noisy_dataset(seed, n_rows=1000):
+    """
+    :return: Dataset whose language follows the first four features with noise, so boosting runs many rounds
+    """
+    rng = np.random.RandomState(seed)
+    matrix = rng.rand(n_rows, len(SPEC)) < 0.4
+    labels = matrix[:, :4] @ np.array([1.0, 0.8, 0.6, 0.4]) + rng.rand(n_rows) * 1.5 > 1.5
+    return Dataset.from_matrix(matrix, labels, SPEC)
+
+
+@pytest.fixture(scope="module")
+def data():
+    return noisy_dataset(0)
+
+
+def test_warm_start_equals_training_all_rounds(data):
+    model = ada.continue_stumps(ada.make_stumps(data, 5), data, 5)
+    expected = ada.make_stumps(data, 10)
+    assert len(expected.stump_feature) == 10
+    assert np.array_equal(model.stump_feature, expected.stump_feature)
+    assert np.allclose(model.margins(data.matrix()), expected.margins(data.matrix()))
+
+
+def test_refit_without_rounds_only_changes_the_amounts_of_say(data):
+    model = ada.make_stumps(data, 5)
+    same = ada.continue_stumps(model, data, 0, refit=True)
+    assert np.allclose(same.stump_say, model.stump_say)
+    refitted = ada.continue_stumps(model, noisy_dataset(1), 0, refit=True)
+    for name in ("stump_feature", "stump_true", "stump_false"):
+        assert np.array_equal(getattr(refitted, name), getattr(model, name)), name
+    assert not np.allclose(refitted.stump_say, model.stump_say)
@@ -0,0 +1,94 @@
+import os
+import numpy as np
+import pytest
+import adaboost as ada
+import decision_tree as dt
+from cache import CachedPredicter, FeatureCache
+from dataset import Dataset, extract_matrix
+from make_features import FeatureSpec
+from model import BoostModel, predict_batch
+
+
+DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+TRAIN_FILE = os.path.join(DIRECTORY, "train.dat")
+
+
+@pytest.fixture(scope="module")
+def data():
+    return Dataset.from_file(TRAIN_FILE)
+
+
+@pytest.fixture(scope="module")
+def lines():
+    with open(os.path.join(DIRECTORY, "test.txt")) as file:
+        return file.readlines()
+
+
+def predict(model, lines, cache):
+    return CachedPredicter(model, cache).predict_lines(lines, is_test=True)
+
+
+def expected_labels(model, lines):
+    return predict_batch(model, extract_matrix(lines, is_test=True, spec=model.spec)[0])
+
+
+@pytest.mark.parametrize("learn_type", ["dt", "ada"])
+def test_cached_prediction_matches_batch(data, lines, learn_type):
+    model = dt.make_decision_tree(data) if learn_type == "dt" else ada.make_stumps(data, 10)
+    predicter = CachedPredicter(model, FeatureCache(len(lines)))
+    assert np.array_equal(predicter.predict_lines(lines, is_test=True), expected_labels(model, lines))
+    # the second call is answered from the cache
+    assert np.array_equal(predicter.predict_lines(lines, is_test=True), expected_labels(model, lines))
+    assert predicter.cache.stats["hits"] == len(lines)
+
+
+def test_second_run_hits_the_disk_tier(data, lines, tmp_path):
+    model = ada.make_stumps(data, 10)
+    file_name = str(tmp_path / "cache.sqlite")
+    cache = FeatureCache(len(lines), file_name)
+    predict(model, lines, cache)
+    cache.close()
+    cache = FeatureCache(len(lines), file_name)
+    assert np.array_equal(predict(model, lines, cache), expected_labels(model, lines))
+    assert cache.stats["disk_hits"] == len(set(lines))
+    assert cache.stats["misses"] == 0
+    cache.close()
+
+
+@pytest.mark.parametrize("reopen", [False, True])
+def test_new_spec_clears_the_cache(data, lines, tmp_path, reopen):
+    file_name = str(tmp_path / "cache.sqlite")
+    cache = FeatureCache(len(lines), file_name)
+    predict(ada.make_stumps(data, 10), lines, cache)
+    spec = FeatureSpec.from_file(os.path.join(DIRECTORY, "features_hashed.json"))
+    model = ada.make_stumps(Dataset.from_file(TRAIN_FILE, spec=spec), 10)
+    if reopen:
+        cache.close()
+        cache = FeatureCache(len(lines), file_name)
+    before = dict(cache.stats)
+    assert np.array_equal(predict(model, lines, cache), expected_labels(model, lines))
+    assert cache.stats["invalidations"] - before["invalidations"] == 1
+    assert cache.stats["misses"] - before["misses"] == len(set(lines))
+    cache.close()
+
+
+@pytest.mark.parametrize("reopen", [False, True])
+def test_new_model_scores_cached_features_again(data, lines, tmp_path, reopen):
+    model = ada.make_stumps(data, 10)
+    # the same stumps with the conclusions swapped give the opposite label for every line
+    flipped = BoostModel.from_stumps([(feat_index, not pos_conclusion, not neg_conclusion, amount_of_say)
+                                      for feat_index, pos_conclusion, neg_conclusion, amount_of_say
+                                      in model.stumps()], model.spec)
+    file_name = str(tmp_path / "cache.sqlite")
+    cache = FeatureCache(len(lines), file_name)
+    labels = predict(model, lines, cache)
+    if reopen:
+        cache.close()
+        cache = FeatureCache(len(lines), file_name)
+    before = dict(cache.stats)
+    flipped_labels = predict(flipped, lines, cache)
+    assert np.array_equal(flipped_labels, ~labels)
+    assert np.array_equal(flipped_labels, expected_labels(flipped, lines))
+    assert cache.stats["feature_hits"] - before["feature_hits"] == len(set(lines))
+    assert cache.stats["misses"] == before["misses"]
+    cache.close()
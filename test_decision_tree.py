@@ -0,0 +1,104 @@
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pytest
+import decision_tree as dt
+from dataset import Dataset
+from make_features import FeatureSpec
+from model import TreeModel
+
+
+SPEC = FeatureSpec([{"name": "f0", "type": "keyword", "words": ["a"]},
+                    {"name": "f1", "type": "keyword", "words": ["b"]}])
+
+# f0 splits the root, the f0 side splits again on f1
+TREE = [[0, 1, 4, -1],
+        [1, 2, 3, -1],
+        [-1, -1, -1, 1],
+        [-1, -1, -1, 0],
+        [-1, -1, -1, 0]]
+
+
+def dataset(rows):
+    """
+    :param rows: list of (f0, f1, is_nl, number of copies)
+    :return: Dataset of the rows
+    """
+    matrix = [[f0, f1] for f0, f1, _, copies in rows for _ in range(copies)]
+    labels = [is_nl for _, _, is_nl, copies in rows for _ in range(copies)]
+    return Dataset.from_matrix(matrix, labels, SPEC)
+
+
+def nodes_of(model):
+    return np.column_stack((model.feature, model.left, model.right, model.value)).tolist()
+
+
+@pytest.fixture
+def pruning_counts():
+    model = TreeModel.from_nodes(TREE, SPEC)
+    train = dataset([(1, 1, True, 3), (1, 0, False, 1), (0, 0, False, 4)])
+    return model, dt.node_counts(model, train.chunks())
+
+
+def test_prune_collapses_a_subtree_which_does_worse_on_held_out_rows(pruning_counts):
+    model, train_counts = pruning_counts
+    # the f1 split of the f0 side gets the f1 False rows wrong, a leaf of the majority of its training rows does not
+    validation = dataset([(1, 1, True, 2), (1, 0, True, 2), (0, 0, False, 2)])
+    pruned = dt.prune_tree(model, train_counts, dt.node_counts(model, validation.chunks()))
+    assert nodes_of(pruned) == [[0, 1, 2, -1], [-1, -1, -1, 1], [-1, -1, -1, 0]]
+
+
+def test_prune_keeps_a_subtree_which_does_better_on_held_out_rows(pruning_counts):
+    model, train_counts = pruning_counts
+    validation = dataset([(1, 1, True, 2), (1, 0, False, 2), (0, 0, False, 2)])
+    pruned = dt.prune_tree(model, train_counts, dt.node_counts(model, validation.chunks()))
+    assert nodes_of(pruned) == TREE
+
+
+def test_truncate_equals_training_with_max_depth():
+    data = dataset([(1, 1, True, 3), (1, 0, False, 1), (0, 1, False, 2), (0, 0, False, 2), (0, 1, True, 1)])
+    model = dt.make_decision_tree(data)
+    counts = dt.node_counts(model, data.chunks())
+    assert model.depth() == 2
+    for max_depth in range(model.depth() + 1):
+        expected = dt.make_decision_tree(data, params=dt.TreeParams(max_depth=max_depth))
+        assert nodes_of(dt.truncate_tree(model, max_depth, counts)) == nodes_of(expected)
+
+
+def test_params_from_args_keep_the_defaults_of_missing_limits():
+    params = dt.TreeParams.from_args(argparse.Namespace(max_depth=3, min_samples_split=None, min_samples_leaf=2,
+                                                        min_gain=None))
+    assert repr(params) == repr(dt.TreeParams(max_depth=3, min_samples_leaf=2))
+
+
+class CountingExecutor(ProcessPoolExecutor):
+    """
+    pool which records the functions it is handed, so a test can tell the workers were used
+    """
+    calls = []
+
+    def submit(self, fn, *args, **kwargs):
+        # map submits partials of its own, those are recorded by map
+        self.calls.append(getattr(fn, "__name__", None))
+        return super().submit(fn, *args, **kwargs)
+
+    def map(self, fn, *iterables, **kwargs):
+        self.calls.append(fn.__name__)
+        return super().map(fn, *iterables, **kwargs)
+
+
+def test_parallel_tree_matches_serial(monkeypatch):
+    rng = np.random.RandomState(0)
+    spec = FeatureSpec([{"name": "f%d" % i, "type": "keyword", "words": ["w%d" % i]} for i in range(8)])
+    matrix = rng.rand(2000, 8) < 0.4
+    labels = matrix[:, :4].sum(axis=1) + rng.rand(2000) * 2 > 2.5
+    data = Dataset.from_matrix(matrix, labels, spec)
+    # low enough for the root to be split with shared counting and for the nodes below it to go to workers
+    monkeypatch.setattr(dt, "PARALLEL_MIN_ROWS", 1000)
+    monkeypatch.setattr(dt, "SUBTREE_MIN_ROWS", 50)
+    monkeypatch.setattr(dt, "ProcessPoolExecutor", CountingExecutor)
+    monkeypatch.setattr(CountingExecutor, "calls", [])
+    parallel = dt.make_decision_tree(data, workers=2)
+    assert "count_shard" in CountingExecutor.calls
+    assert "build_subtree" in CountingExecutor.calls
+    assert nodes_of(parallel) == nodes_of(dt.make_decision_tree(data))
@@ -0,0 +1,87 @@
+import bz2
+import gzip
+import json
+import lzma
+import os
+import numpy as np
+import pytest
+from dataset import Dataset
+from ingest import InputFormat, compression_of
+
+
+TRAIN_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "train.dat")
+
+
+@pytest.fixture(scope="module")
+def rows():
+    """
+    :return: list of (language, text) of the lines of train.dat
+    """
+    with open(TRAIN_FILE) as file:
+        return [tuple(line.rstrip("\n").split("|", 1)) for line in file]
+
+
+@pytest.fixture(scope="module")
+def expected():
+    return Dataset.from_file(TRAIN_FILE)
+
+
+def write(file_name, lines):
+    with open(file_name, "w") as file:
+        file.writelines(line + "\n" for line in lines)
+    return file_name
+
+
+def assert_same_dataset(data, expected):
+    assert data.n_rows == expected.n_rows
+    assert np.array_equal(data.matrix(), expected.matrix())
+    assert np.array_equal(data.labels, expected.labels)
+
+
+@pytest.mark.parametrize("module", [gzip, bz2, lzma])
+def test_compression_is_detected_by_content(expected, tmp_path, module):
+    # no extension gives the compression away
+    file_name = str(tmp_path / "train.dat")
+    with open(TRAIN_FILE, "rb") as source, module.open(file_name, "wb") as file:
+        file.write(source.read())
+    assert compression_of(file_name) is module
+    assert_same_dataset(Dataset.from_file(file_name), expected)
+
+
+@pytest.mark.parametrize("header", [False, True])
+def test_tsv_with_column_numbers(rows, expected, tmp_path, header):
+    lines = ["%s\t%s" % (text, language) for language, text in rows]
+    if header:
+        lines.insert(0, "text\tlanguage")
+    file_name = write(str(tmp_path / "train.tsv"), lines)
+    input_format = InputFormat.for_file(file_name, label_field="1", text_field="0")
+    assert_same_dataset(Dataset.from_file(file_name, input_format=input_format), expected)
+
+
+def test_tsv_with_named_header(rows, expected, tmp_path):
+    lines = ["id\ttext\tlang"] + ["%d\t%s\t%s" % (i, text, language) for i, (language, text) in enumerate(rows)]
+    file_name = write(str(tmp_path / "train.tsv"), lines)
+    input_format = InputFormat("tsv", label_field="lang", text_field="text")
+    assert_same_dataset(Dataset.from_file(file_name, input_format=input_format), expected)
+
+
+@pytest.mark.parametrize("fields", [(None, None), ("language", "sentence")])
+def test_jsonl_label_and_text_fields(rows, expected, tmp_path, fields):
+    label_field, text_field = fields
+    names = {"nl": "Dutch", "en": "English"}
+    lines = [json.dumps({label_field or "label": names[language], text_field or "text": text})
+             for language, text in rows]
+    file_name = write(str(tmp_path / "train.jsonl"), lines)
+    input_format = InputFormat.for_file(file_name, label_field=label_field, text_field=text_field)
+    assert input_format.kind == "jsonl"
+    assert_same_dataset(Dataset.from_file(file_name, input_format=input_format), expected)
+
+
+@pytest.mark.parametrize("kind, line", [("tsv", "fr\tle chat"),
+                                        ("jsonl", json.dumps({"label": "fr", "text": "le chat"}))])
+def test_unknown_label_is_rejected(tmp_path, kind, line):
+    first = "nl\tde kat" if kind == "tsv" else json.dumps({"label": "nl", "text": "de kat"})
+    file_name = write(str(tmp_path / ("train." + kind)), [first, line])
+    input_format = InputFormat(kind)
+    with pytest.raises(ValueError, match="unknown language 'fr'"):
+        Dataset.from_file(file_name, input_format=input_format)
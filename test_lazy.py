@@ -0,0 +1,35 @@
+import os
+import numpy as np
+import pytest
+import adaboost as ada
+import decision_tree as dt
+from dataset import Dataset, extract_matrix
+from lazy import LazyPredicter
+from model import predict_batch
+
+
+DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+
+
+@pytest.fixture(scope="module")
+def data():
+    return Dataset.from_file(os.path.join(DIRECTORY, "train.dat"))
+
+
+@pytest.fixture(scope="module")
+def lines():
+    with open(os.path.join(DIRECTORY, "test.txt")) as file:
+        return file.readlines()
+
+
+@pytest.mark.parametrize("learn_type", ["dt", "ada"])
+def test_lazy_prediction_matches_batch(data, lines, learn_type):
+    model = dt.make_decision_tree(data) if learn_type == "dt" else ada.make_stumps(data, 10)
+    expected = predict_batch(model, extract_matrix(lines, is_test=True)[0])
+    assert np.array_equal(LazyPredicter(model).predict_lines(lines, is_test=True), expected)
+
+
+def test_lazy_margins_match_batch(data, lines):
+    model = ada.make_stumps(data, 10)
+    margins = LazyPredicter(model, confidence=True).margins_lines(lines, is_test=True)
+    assert np.allclose(margins, model.margins(extract_matrix(lines, is_test=True)[0]))
@@ -0,0 +1,59 @@
+import os
+import pytest
+from dataset import Dataset, extract_matrix
+from make_features import DEFAULT_SPEC, FEATURE_NAMES, parse_line
+
+
+TRAIN_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "train.dat")
+
+DUTCH_PREPOSITIONS = ["naar", "voor", "achter", "naast", "beneden", "boven", "onder", "op", "tussen", "het midden",
+                      "bij", "binnen", "buiten", "tegen", "rond", "sinds", "zonder", "na", "om"]
+ENGLISH_PREPOSITIONS = ["with", "from", "to", "in front of", "behind", "next to", "down", "downstairs", "above",
+                        "upstairs", "below", "on top", "between", "middle", "about", "over", "near", "inside",
+                        "outside", "against", "around", "since", "without", "before", "after"]
+ACCENT_ORDS = [193, 196, 201, 203, 205, 207, 211, 214, 218, 220, 221, 225, 228, 233, 235, 237, 239, 243, 246, 250,
+               252, 253, 255]
+
+
+def baseline_features(line):
+    """
+    the features of a lowercased line worked out the way the first version of make_features did, a search per word
+
+    :param line: a single lowercased line of words, without the language prefix
+    :return: dictionary of the features
+    """
+    def has(*words):
+        return any(line.find(" " + word + " ") != -1 for word in words)
+
+    return {"nl_article": has("het", "de"),
+            "nl_prepos": has(*DUTCH_PREPOSITIONS),
+            "en_article": has("the", "a", "an"),
+            "en_prepos": has(*ENGLISH_PREPOSITIONS),
+            "accent": any(ord(ch) in ACCENT_ORDS for ch in line),
+            "als_present": has("als"),
+            "as_present": has("as"),
+            "dat_present": has("dat"),
+            "that_present": has("that"),
+            "also_present": has("also")}
+
+
+@pytest.fixture(scope="module")
+def lines():
+    with open(TRAIN_FILE) as file:
+        return file.readlines()
+
+
+@pytest.fixture(scope="module")
+def data():
+    return Dataset.from_file(TRAIN_FILE)
+
+
+def test_extraction_matches_baseline(lines, data):
+    expected = [[baseline_features(parse_line(line)[1])[name] for name in FEATURE_NAMES] for line in lines]
+    matrix, labels = extract_matrix(lines)
+    assert matrix.tolist() == expected
+    assert labels.tolist() == [line.startswith("nl|") for line in lines]
+    assert data.matrix().astype(bool).tolist() == expected
+    evaluated = [[evaluate(parse_line(line)[1]) for evaluate in DEFAULT_SPEC.evaluators] for line in lines]
+    assert evaluated == expected
+
@@ -0,0 +1,86 @@
+import asyncio
+import json
+import os
+import pytest
+import adaboost as ada
+import server
+from dataset import Dataset, extract_matrix
+from model import label_names, predict_batch
+
+
+DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+
+
+@pytest.fixture(scope="module")
+def model():
+    return ada.make_stumps(Dataset.from_file(os.path.join(DIRECTORY, "train.dat")), 10)
+
+
+@pytest.fixture(scope="module")
+def texts():
+    with open(os.path.join(DIRECTORY, "test.txt")) as file:
+        return [line.rstrip("\n") for line in file]
+
+
+def talk(model, socket_path, lines):
+    """
+    starts the server, sends the lines over one connection and reads a response to each of them
+
+    :param model: model the server scores with
+    :param socket_path: path of the unix socket
+    :param lines: list of request lines as bytes, without the newline
+    :return: list of the responses, ending with None if the server closed the connection
+    """
+    async def run():
+        server_task = asyncio.ensure_future(server.serve_forever(model, socket_path))
+        while not os.path.exists(socket_path):
+            await asyncio.sleep(0.01)
+        reader, writer = await asyncio.open_unix_connection(socket_path)
+        responses = []
+        try:
+            for line in lines:
+                try:
+                    writer.write(line + b"\n")
+                    await writer.drain()
+                    response = await reader.readline()
+                except ConnectionError:
+                    response = b""
+                if not response:
+                    responses.append(None)
+                    break
+                responses.append(json.loads(response))
+        finally:
+            writer.close()
+            server_task.cancel()
+            with pytest.raises(asyncio.CancelledError):
+                await server_task
+        return responses
+
+    return asyncio.run(run())
+
+
+def request(content):
+    return json.dumps(content).encode("utf-8")
+
+
+def test_text_and_texts_round_trip(model, texts, tmp_path):
+    expected = label_names(predict_batch(model, extract_matrix(texts, is_test=True)[0]))
+    responses = talk(model, str(tmp_path / "socket"), [request({"texts": texts})] +
+                     [request({"text": text}) for text in texts])
+    assert responses[0] == {"labels": expected}
+    assert [response["label"] for response in responses[1:]] == expected
+
+
+@pytest.mark.parametrize("line", [b"{not json", request([1, 2]), request({"text": None}), request({"text": 5}),
+                                  request({"texts": "one text"}), request({"texts": ["a", 5]}), request({"other": 1})])
+def test_bad_request_is_answered_with_an_error(model, texts, tmp_path, line):
+    responses = talk(model, str(tmp_path / "socket"), [line, request({"text": texts[0]})])
+    assert list(responses[0]) == ["error"]
+    # the connection keeps serving after the error
+    assert "label" in responses[1]
+
+
+def test_over_long_line_ends_the_connection(model, tmp_path, monkeypatch):
+    monkeypatch.setattr(server, "MAX_LINE_LENGTH", 1024)
+    responses = talk(model, str(tmp_path / "socket"), [request({"text": "x" * 2048}), request({"text": "x"})])
+    assert responses == [{"error": "request is longer than 1024 bytes"}, None]
@@ -0,0 +1,74 @@
+import os
+import shutil
+import sys
+import numpy as np
+import pytest
+import store
+from dataset import Dataset
+from make_features import DEFAULT_SPEC, FeatureSpec
+
+
+DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+
+
+@pytest.fixture
+def corpus(tmp_path):
+    file_name = str(tmp_path / "train.dat")
+    shutil.copy(os.path.join(DIRECTORY, "train.dat"), file_name)
+    return file_name
+
+
+@pytest.fixture(scope="module")
+def hashed_spec():
+    return FeatureSpec.from_file(os.path.join(DIRECTORY, "features_hashed.json"))
+
+
+def assert_same_dataset(data, expected):
+    assert data.n_rows == expected.n_rows
+    assert np.array_equal(data.matrix(), expected.matrix())
+    assert np.array_equal(data.labels, expected.labels)
+
+
+def test_store_is_made_again_when_the_corpus_changes(corpus):
+    data = store.load_dataset(corpus)
+    created = store.open_store(store.store_path(corpus)).meta["created"]
+    assert_same_dataset(data, Dataset.from_file(corpus))
+    # an unchanged corpus is read from the store
+    store.load_dataset(corpus)
+    assert store.open_store(store.store_path(corpus)).meta["created"] == created
+    with open(corpus, "a") as file:
+        file.write("nl|de kat zit op de mat\n")
+    data = store.load_dataset(corpus)
+    assert data.n_rows == Dataset.from_file(os.path.join(DIRECTORY, "train.dat")).n_rows + 1
+    assert_same_dataset(data, Dataset.from_file(corpus))
+
+
+def test_every_spec_has_its_own_store(corpus, hashed_spec):
+    store.load_dataset(corpus)
+    store.load_dataset(corpus, spec=hashed_spec)
+    default_store = store.open_store(store.store_path(corpus))
+    hashed_store = store.open_store(store.store_path(corpus, hashed_spec))
+    assert default_store.file_name != hashed_store.file_name
+    assert default_store.meta["spec_version"] == DEFAULT_SPEC.version
+    assert hashed_store.meta["spec_version"] == hashed_spec.version
+
+
+def test_invalidate_removes_the_store(corpus, monkeypatch, capsys):
+    store.load_dataset(corpus)
+    file_name = store.store_path(corpus)
+    assert os.path.exists(file_name)
+    monkeypatch.setattr(sys, "argv", ["store.py", "invalidate", corpus])
+    store.main()
+    assert not os.path.exists(file_name)
+    assert capsys.readouterr().out == "removed %s\n" % file_name
+
+
+def test_sparse_store_round_trip(corpus, hashed_spec):
+    expected = Dataset.from_file(corpus, spec=hashed_spec)
+    store.build_store(corpus, spec=hashed_spec)
+    data = store.open_store(store.store_path(corpus, hashed_spec)).data
+    assert data.spec.sparse
+    assert data.spec.to_json() == hashed_spec.to_json()
+    assert np.array_equal(data.bits.indptr, expected.bits.indptr)
+    assert np.array_equal(data.bits.indices, expected.bits.indices)
+    assert np.array_equal(data.labels, expected.labels)
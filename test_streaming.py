@@ -0,0 +1,30 @@
+import os
+import numpy as np
+import pytest
+import adaboost as ada
+import decision_tree as dt
+import streaming
+from dataset import Dataset
+
+
+TRAIN_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "train.dat")
+
+
+@pytest.fixture(scope="module")
+def data():
+    return Dataset.from_file(TRAIN_FILE)
+
+
+@pytest.mark.parametrize("spill", [True, False])
+def test_streaming_matches_in_memory(data, spill, monkeypatch):
+    # 8 rows at a time, so the passes read train.dat in several chunks with a short one at the end
+    monkeypatch.setattr(streaming, "PASS_CHUNK_VALUES", 8 * len(data.spec))
+    assert streaming.chunk_rows(len(data.spec)) == 8
+    model = streaming.train(TRAIN_FILE, "dt", spill=spill)
+    expected = dt.make_decision_tree(data)
+    for name in ("feature", "left", "right", "value"):
+        assert np.array_equal(getattr(model, name), getattr(expected, name)), name
+    model = streaming.train(TRAIN_FILE, "ada", 10, spill=spill)
+    expected = ada.make_stumps(data, 10)
+    assert np.array_equal(model.stump_feature, expected.stump_feature)
+    assert np.allclose(model.stump_say, expected.stump_say)
@@ -1,8 +1,15 @@
-from make_features import Features
+from dataset import Dataset
 import decision_tree as dt
 import adaboost as ada
+import argparse
 import sys
-import pickle
+import numpy as np
+import ingest
+import store
+import streaming
+from make_features import DEFAULT_SPEC, FeatureSpec
+from metrics import METRICS, Profile
+from model import BoostModel, load_model, save_model
 
 
 def main():
@@ -11,45 +18,174 @@ def main():
     first command line argument: file_name which has the training data
     second command line argument: file_name which will store the serialized model
     third command line argument: if the model to be trained is decision tree or adaboost
+    optional fourth command line argument: number of adaboost rounds
+    --workers: number of processes extracting the features and building the decision tree
+    --features: json feature spec, the default features are used without it, the spec is stored in the model
+    --streaming: trains with passes over the data instead of keeping the rows in memory
+    --spill-file: file the extracted features are spilled to with --streaming, a temporary file without it
+    --no-spill: with --streaming, extracts the features from the text again in every pass instead of spilling them
+    --max-depth, --min-samples-split, --min-samples-leaf, --min-gain: limits on the growth of the decision tree
+    --validation: file of held out data the decision tree is pruned against
+    --holdout: holds out every holdout th training line and prunes the decision tree against them
+    --profile: file the cProfile statistics of the run are written to, the slowest functions are printed
+    --metrics: print the time of every stage and the counters to standard error at the end
+    --metrics-file: file the metrics are written to in the prometheus text format at the end
+    --warm-start: adaboost model which is replayed on the data and given rounds more stumps
+    --refit: with --warm-start, works out the amount_of_say of the stumps of the model again on the data first
 
     :return: None
     """
-    examples = sys.argv[1]
-    hypothesis_out = sys.argv[2]
-    learning_type = sys.argv[3]
-    training(examples, hypothesis_out, learning_type)
+    parser = argparse.ArgumentParser(description="trains a decision tree or adaboost model")
+    parser.add_argument("examples", help="file with the training data")
+    parser.add_argument("hypothesis_out", help="file the model is written to, prefixed with the type of model")
+    parser.add_argument("learning_type", choices=("dt", "ada"), help="dt for decision tree, ada for adaboost")
+    parser.add_argument("rounds", nargs="?", type=int, default=ada.NUMBER_OF_STUMPS,
+                        help="number of adaboost rounds")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="number of processes extracting the features and building the decision tree")
+    parser.add_argument("--features", metavar="SPEC", help="json file declaring the features, see features.json")
+    parser.add_argument("--streaming", action="store_true",
+                        help="train with passes over the data instead of keeping the rows in memory")
+    parser.add_argument("--spill-file", help="file the extracted features are spilled to with --streaming")
+    parser.add_argument("--no-spill", action="store_true",
+                        help="with --streaming, extract the features again in every pass instead of spilling them")
+    parser.add_argument("--max-depth", type=int, help="maximum depth of the decision tree")
+    parser.add_argument("--min-samples-split", type=int, help="fewest rows a node of the decision tree needs to split")
+    parser.add_argument("--min-samples-leaf", type=int, help="fewest rows each side of a split needs")
+    parser.add_argument("--min-gain", type=float, help="information gain a split needs, only gains above it count")
+    parser.add_argument("--validation", metavar="FILE", help="held out data the decision tree is pruned against")
+    parser.add_argument("--holdout", type=int, default=0,
+                        help="hold out every holdout th line and prune the decision tree against them")
+    parser.add_argument("--profile", metavar="FILE", help="write the cProfile statistics of the run to FILE")
+    parser.add_argument("--metrics", action="store_true", help="print the stage timers and counters at the end")
+    parser.add_argument("--metrics-file", help="file the metrics are written to in the prometheus text format")
+    parser.add_argument("--warm-start", metavar="MODEL", help="adaboost model to go on from, rounds stumps are added")
+    parser.add_argument("--refit", action="store_true",
+                        help="with --warm-start, work out the amount_of_say of its stumps again on the data")
+    parser.add_argument("--input-format", choices=ingest.FORMATS,
+                        help="layout of the lines, guessed from the extension of examples if not given")
+    parser.add_argument("--label-field", help="tsv column or jsonl key with the language")
+    parser.add_argument("--text-field", help="tsv column or jsonl key with the text")
+    parser.add_argument("--feature-store", action="store_true",
+                        help="keep the extracted features in a store next to examples and use it in later runs")
+    parser.add_argument("--store-file", help="file of the feature store, implies --feature-store")
+    args = parser.parse_args()
+    tree_options = (args.max_depth, args.min_samples_split, args.min_samples_leaf, args.min_gain, args.validation)
+    if args.learning_type != "dt" and (any(option is not None for option in tree_options) or args.holdout):
+        parser.error("the tree growth and pruning options are only for dt")
+    if args.validation and args.holdout:
+        parser.error("--validation and --holdout can not be used together")
+    if args.holdout and args.streaming:
+        parser.error("--holdout keeps the rows in memory, use --validation with --streaming")
+    if args.holdout == 1:
+        parser.error("--holdout 1 would hold out every line")
+    if args.streaming and args.workers > 1:
+        parser.error("--streaming reads the data in one process, it can not be used with --workers")
+    if not args.streaming and (args.spill_file or args.no_spill):
+        parser.error("--spill-file and --no-spill need --streaming")
+    input_format = ingest.InputFormat.for_file(args.examples, args.input_format, args.label_field, args.text_field)
+    if input_format.kind == "prefix" and (args.label_field or args.text_field):
+        parser.error("--label-field and --text-field are for the tsv and jsonl formats")
+    feature_store = None
+    if args.feature_store or args.store_file:
+        if args.streaming:
+            parser.error("--feature-store keeps the features of every row, it can not be used with --streaming")
+        if args.examples == "-":
+            parser.error("--feature-store needs a file, not standard input")
+        feature_store = args.store_file or ""
+    spec = FeatureSpec.from_file(args.features) if args.features else DEFAULT_SPEC
+    warm_start = None
+    if args.refit and not args.warm_start:
+        parser.error("--refit needs --warm-start")
+    if args.warm_start:
+        if args.learning_type != "ada" or args.streaming:
+            parser.error("--warm-start goes on from an adaboost model in memory, it needs ada without --streaming")
+        warm_start = load_model(args.warm_start)
+        if not isinstance(warm_start, BoostModel):
+            parser.error("--warm-start needs an adaboost model")
+        if args.features and spec != warm_start.spec:
+            parser.error("--features differ from the features of the --warm-start model")
+        spec = warm_start.spec
+    params = dt.TreeParams.from_args(args)
+    if args.metrics or args.metrics_file:
+        METRICS.enable(args.metrics_file)
+    with Profile(args.profile):
+        training(args.examples, args.hypothesis_out, args.learning_type, args.rounds, args.workers, spec,
+                 args.streaming, not args.no_spill, args.spill_file, params, args.validation, args.holdout,
+                 warm_start, args.refit, input_format, feature_store)
+    if args.metrics:
+        print(METRICS.format_summary(), file=sys.stderr)
+    METRICS.dump()
 
 
-def training(input_file_name, hypothesis_out, learn_type):
+def training(input_file_name, hypothesis_out, learn_type, rounds=ada.NUMBER_OF_STUMPS, workers=1,
+             spec=DEFAULT_SPEC, stream=False, spill=True, spill_file_name=None, params=dt.DEFAULT_PARAMS,
+             validation_file_name=None, holdout=0, warm_start=None, refit=False, input_format=ingest.DEFAULT_FORMAT,
+             feature_store=None):
     """
-    calls make_features.py to make a dictionary of features and passes it on
+    reads the input data into a Dataset of packed features and passes it on
     transfers control to the respective learning model asked
-    after model is returned the dictionary is written is serialized using pickle and stored in the hypothesis_out file
+    after model is returned it is written in the compiled model format to the hypothesis_out file
 
     :param input_file_name: file_name of input data
     :param hypothesis_out: file_name in which model is to be stored
     :param learn_type: can be 'dt' for decision tree or 'ada' for adaboost
+    :param rounds: number of stumps made by adaboost
+    :param workers: number of processes extracting the features and building the decision tree
+    :param spec: FeatureSpec of the features the model is trained on
+    :param stream: True to train with passes over the data, see streaming.train
+    :param spill: with stream, True to spill the extracted features to a file instead of extracting them every pass
+    :param spill_file_name: with stream, name of the spill file, a temporary file if None
+    :param params: TreeParams limiting the growth of the decision tree
+    :param validation_file_name: optional file of held out data the decision tree is pruned against
+    :param holdout: if above 1, every holdout th line is held out of training and the decision tree is pruned
+                    against them
+    :param warm_start: optional BoostModel adaboost goes on from, see adaboost.continue_stumps
+    :param refit: with warm_start, True to work out the amount_of_say of its stumps again on the data first
+    :param input_format: ingest.InputFormat of the lines of the input and validation data
+    :param feature_store: None to extract the features, or the name of the store.FeatureStore the rows are read
+                          from and written to when it is missing or stale, an empty name for the one next to the input
 
     :return: None
     """
-    feature_value_mapping = []
-    dictionary = {}
-    with open(input_file_name) as file:
-        for line in file:
-            features = Features()
-            features.make_features(line)
-            feature_value_mapping.append(features.features)
-
-    if learn_type == "dt":
-        hypothesis_out = "dt" + hypothesis_out
-        dictionary = dt.make_decision_tree(feature_value_mapping)
-    elif learn_type == "ada":
-        hypothesis_out = "ada" + hypothesis_out
-        dictionary = ada.make_stumps(feature_value_mapping)
-
-    print(dictionary)
-    with open(hypothesis_out, "wb") as output_file:
-        pickle.dump(dictionary, output_file)
+    validation = None
+    if validation_file_name is not None:
+        validation = Dataset.from_file(validation_file_name, spec=spec, input_format=input_format)
+    if stream:
+        hypothesis_out = learn_type + hypothesis_out
+        model = streaming.train(input_file_name, learn_type, rounds, spec, spill, spill_file_name, params, validation,
+                                input_format)
+    else:
+        with METRICS.timer("read"):
+            if feature_store is not None:
+                data = store.load_dataset(input_file_name, feature_store or None, spec, input_format, workers)
+            else:
+                data = store.read_corpus(input_file_name, workers, spec, input_format)
+        if holdout > 1:
+            indices = np.arange(len(data))
+            is_held_out = indices % holdout == holdout - 1
+            validation = data.take(indices[is_held_out])
+            data = data.take(indices[~is_held_out])
+
+        if learn_type == "dt":
+            hypothesis_out = "dt" + hypothesis_out
+            model = dt.make_decision_tree(data, workers, params)
+            if validation is not None:
+                grown_nodes = len(model.feature)
+                model = dt.prune_tree(model, dt.node_counts(model, data.chunks()),
+                                      dt.node_counts(model, validation.chunks()))
+                print("pruned from %d to %d nodes" % (grown_nodes, len(model.feature)), file=sys.stderr)
+        elif learn_type == "ada":
+            hypothesis_out = "ada" + hypothesis_out
+            if warm_start is not None:
+                model = ada.continue_stumps(warm_start, data, rounds, refit)
+            else:
+                model = ada.make_stumps(data, rounds)
+        else:
+            raise ValueError("type of model has to be dt or ada, not " + learn_type)
+
+    save_model(model, hypothesis_out)
+    print(model)
 
 
 if __name__ == "__main__":